@@ -0,0 +1,131 @@
+"""Benchmark and parity check for the inference backends.
+
+Each backend is loaded in its own process, so peak memory isn't shared between them. Labels
+from every backend are compared against the fp32 torch backend on a fixed corpus, and the
+script exits with an error if agreement falls below --min-agreement.
+
+Expects the model to already be extracted at MODEL_CHECKPOINT, as download_new_model leaves it.
+
+Usage:
+    python benchmarks/backend_benchmark.py --backends torch torch_int8 onnx
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from config.config import (  # noqa: E402
+    ENV_INFERENCE_BACKEND_VAR_NAME,
+    INFERENCE_BACKEND_TORCH,
+    INFERENCE_BACKEND_TORCH_INT8,
+)
+from corpus import PARITY_CORPUS  # noqa: E402
+
+
+def run_backend(repeats, batch_size):
+    """Load the backend named by the INFERENCE_BACKEND env variable and time it on the corpus
+
+    Args:
+        repeats (int): Number of times the corpus is processed
+        batch_size (int): Number of sents passed to the model at once
+
+    Returns:
+        Dict: Labels, load time, latencies, throughput and peak RSS for the backend
+    """
+    from utils.model_utils import ModelHandler
+
+    load_start = time.perf_counter()
+    model_handler = ModelHandler()
+    load_seconds = time.perf_counter() - load_start
+    corpus = PARITY_CORPUS
+    labels = model_handler.generate_processed_sents(corpus)
+    batch_seconds = []
+    run_start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(corpus), batch_size):
+            batch_start = time.perf_counter()
+            model_handler.generate_processed_sents(corpus[i : i + batch_size])
+            batch_seconds.append(time.perf_counter() - batch_start)
+    run_seconds = time.perf_counter() - run_start
+    batch_seconds.sort()
+    return {
+        "labels": labels,
+        "load_seconds": load_seconds,
+        "batch_p50_ms": 1000 * batch_seconds[len(batch_seconds) // 2],
+        "batch_p95_ms": 1000 * batch_seconds[int(len(batch_seconds) * 0.95)],
+        "sents_per_second": repeats * len(corpus) / run_seconds,
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=[INFERENCE_BACKEND_TORCH, INFERENCE_BACKEND_TORCH_INT8],
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=30)
+    parser.add_argument("--min-agreement", type=float, default=0.95)
+    parser.add_argument("--run-backend", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend is not None:
+        print(json.dumps(run_backend(args.repeats, args.batch_size)))
+        return
+
+    results = {}
+    for backend in [INFERENCE_BACKEND_TORCH] + [
+        backend for backend in args.backends if backend != INFERENCE_BACKEND_TORCH
+    ]:
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--run-backend",
+                backend,
+                "--repeats",
+                str(args.repeats),
+                "--batch-size",
+                str(args.batch_size),
+            ],
+            env=os.environ | {ENV_INFERENCE_BACKEND_VAR_NAME: backend},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results[backend] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    reference_labels = results[INFERENCE_BACKEND_TORCH]["labels"]
+    parity_failed = False
+    print(
+        f"{'backend':<12}{'agreement':>10}{'load s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'sents/s':>10}{'peak MB':>9}"
+    )
+    for backend, result in results.items():
+        agreement = sum(
+            label == reference
+            for label, reference in zip(result.pop("labels"), reference_labels)
+        ) / len(reference_labels)
+        parity_failed = parity_failed or agreement < args.min_agreement
+        print(
+            f"{backend:<12}{agreement:>10.3f}{result['load_seconds']:>9.2f}"
+            f"{result['batch_p50_ms']:>9.1f}{result['batch_p95_ms']:>9.1f}"
+            f"{result['sents_per_second']:>10.1f}{result['peak_rss_mb']:>9d}"
+        )
+    if parity_failed:
+        sys.exit(f"Label agreement below {args.min_agreement}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Fixed and synthetic sentence corpora shared by the benchmarks"""
+
+# Fixed corpus covering each emotion label, used to check backends agree on their labels
+PARITY_CORPUS = [
+    "I enjoy sunny days",
+    "I wish you were here but it is impossible",
+    "I can't believe they cancelled the show again, this is infuriating",
+    "My dog passed away this morning and the house feels empty",
+    "I love spending lazy sundays with my family",
+    "Walking home alone at night in the dark makes me really nervous",
+    "Wow, I did not expect to win the raffle at all!",
+    "The meeting ran long and nothing got decided",
+    "Thank you so much for the birthday flowers, they're beautiful",
+    "Why does the bus always leave exactly when I get to the stop",
+    "I miss my grandmother's cooking so much",
+    "Can't stop smiling after the concert last night",
+    "Someone keeps parking in my spot and it drives me mad",
+    "I'm terrified of the exam results coming out tomorrow",
+    "She said yes! We're getting married!",
+    "Nobody came to my party and I feel so alone",
+    "The new puppy is the cutest thing I've ever seen",
+    "I was shocked to see the price of coffee go up again",
+    "The storm knocked out the power and I'm scared of the thunder",
+    "You are the best friend anyone could ask for",
+    "I'm so tired of being ignored at work",
+    "The sunset over the beach was absolutely stunning",
+    "Lost my wallet on the train, what a terrible day",
+    "Just got promoted, feeling on top of the world",
+    "My heart aches every time I hear that song",
+    "How dare they speak to my mother like that",
+    "There's a strange noise coming from the basement",
+    "I never thought I'd see snow in april",
+    "Holding my newborn daughter for the first time",
+    "The team lost in the final minute, heartbreaking",
+    "Finally finished the marathon, I'm so proud",
+    "The customer service was rude and useless",
+    "I adore the way you laugh",
+    "Getting the scan results next week, I can't sleep",
+    "Out of nowhere my old friend called after ten years",
+    "Rainy days always make me feel a bit down",
+    "Best. Holiday. Ever.",
+    "They lied to me for months",
+    "I'm nervous about moving to a new city",
+    "Just found twenty pounds in an old coat pocket",
+]
+
+# Sents with emoji and accents, mixed into the mostly ascii corpus
+NON_ASCII_SENTS = [
+    "Café con leche ☕ por la mañana",
+    "Best day ever 😀😀🎉",
+    "Ich möchte ein Brötchen",
+    "Family trip 👨‍👩‍👧 to the beach 🏖️",
+    "That’s — honestly — too much",
+    "Keycap #️⃣ and © 2024",
+    "Thumbs up 👍🏽",
+]
+
+# Word counts of synthetic sents for each length distribution, as (min, max) for uniform
+# lengths, or "tail" for mostly short sents with a long tail, like user comments
+SYNTHETIC_LENGTHS = {
+    "short": (3, 8),
+    "medium": (10, 30),
+    "long": (40, 120),
+    "tail": "tail",
+}
+
+_SYNTHETIC_WORDS = (
+    "i you we they she he it the a an my your our this that day night home work friend "
+    "family dog cat rain sun party exam train coffee song game team city love hate miss "
+    "enjoy fear wish feel think know want need lost found won cancelled happy sad angry "
+    "scared surprised tired proud lonely excited nervous great terrible beautiful awful "
+    "again today tomorrow finally never always so very really not"
+).split()
+
+
+def make_synthetic_corpus(num_sents, length_dist, duplicate_ratio, rng):
+    """Generate random sents. A duplicate_ratio share of the sents repeat an earlier sent of
+    the corpus, with different capitalisation half of the time so they only match once
+    normalised
+
+    Args:
+        num_sents (int): Number of sents to generate
+        length_dist (string): Key of SYNTHETIC_LENGTHS
+        duplicate_ratio (float): Share of sents which repeat an earlier sent
+        rng (random.Random): Source of randomness
+
+    Returns:
+        str[]: The sents
+    """
+    lengths = SYNTHETIC_LENGTHS[length_dist]
+    sents = []
+    for _ in range(num_sents):
+        if len(sents) > 0 and rng.random() < duplicate_ratio:
+            sent = rng.choice(sents)
+            sents.append(sent.upper() if rng.random() < 0.5 else sent)
+            continue
+        if lengths == "tail":
+            num_words = min(int(rng.lognormvariate(2.2, 0.8)) + 1, 200)
+        else:
+            num_words = rng.randint(*lengths)
+        sents.append(" ".join(rng.choices(_SYNTHETIC_WORDS, k=num_words)))
+    return sents
@@ -0,0 +1,262 @@
+"""End to end benchmark of lambda_handler, with batch size autotuning.
+
+Each configuration runs in a fresh process, which imports app.py against the local stand-ins
+for MongoDB, s3 and the model (see stand_ins.py) and then calls lambda_handler directly, one
+request after another. Synthetic corpora cover several sent length distributions, shares of
+sents duplicated within a request, and shares already stored in the database (cache hits).
+Sents per second, request latency percentiles and peak RSS are reported for each.
+
+The batch size sweep then runs one corpus at each batch size and recommends the fastest batch
+size whose peak RSS stays within the memory limit, writing it to --output. The tiny stand-in
+model says little about memory, so pass --model-dir with the real model's files for a
+recommendation to deploy with. The extracted model in /tmp/ is replaced by the benchmark model.
+
+Usage:
+    python benchmarks/e2e_benchmark.py --output batch_size.json
+    python benchmarks/e2e_benchmark.py --model-dir /tmp/t5-base-finetuned-emotion \
+        --memory-limit-mb 3008 --batch-sizes 100 300 1000 --skip-suite
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from config.config import DEFAULT_BATCH_SIZE, SENT_LIST_KEY  # noqa: E402
+from utils.text_utils import normalise_sents  # noqa: E402
+from corpus import SYNTHETIC_LENGTHS, make_synthetic_corpus  # noqa: E402
+from stand_ins import make_tiny_t5, start_stand_ins, zip_model  # noqa: E402
+
+# Processed sent stored for the sents which are cache hits
+STORED_SENT_LABEL = "<pad> joy"
+
+
+def percentile(sorted_values, fraction):
+    """Return the value at a fraction of the way through a sorted list"""
+    return sorted_values[
+        min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    ]
+
+
+def run_config(model_dir, config):
+    """Import app.py against the stand-ins and time a series of requests
+
+    Args:
+        model_dir (string): Directory holding the model
+        config (Dict): The benchmark configuration, see make_config
+
+    Returns:
+        Dict: The configuration with its throughput, latency and memory results
+    """
+    start_stand_ins(zip_model(model_dir))
+    import app
+
+    rng = random.Random(config["seed"])
+    requests = [
+        make_synthetic_corpus(
+            config["request_sents"],
+            config["length_dist"],
+            config["duplicate_ratio"],
+            rng,
+        )
+        for _ in range(config["requests"])
+    ]
+    # Store a share of every request's sents ahead of time, so they're found in the database.
+    # They're written straight to the database so they aren't in the in-memory cache
+    stored_sents = list(
+        {
+            sent
+            for request in requests
+            for sent in normalise_sents(request)
+            if rng.random() < config["hit_ratio"]
+        }
+    )
+    app.db_handler.store_sents(stored_sents, [STORED_SENT_LABEL] * len(stored_sents))
+    # Warm up the model, so the first request doesn't pay for torch's lazy initialisation
+    warm_up_sents = make_synthetic_corpus(config["batch_size"], "short", 0, rng)
+    app.lambda_handler({SENT_LIST_KEY: warm_up_sents}, None)
+
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        response = app.lambda_handler(
+            {SENT_LIST_KEY: request, "BATCH_SIZE": config["batch_size"]}, None
+        )
+        latencies.append(time.perf_counter() - start)
+        if response["statusCode"] != 200:
+            raise RuntimeError(f"Request failed: {response['body']}")
+    sorted_ms = sorted(latency * 1000 for latency in latencies)
+    return config | {
+        "sents_per_second": config["requests"]
+        * config["request_sents"]
+        / sum(latencies),
+        "p50_ms": percentile(sorted_ms, 0.5),
+        "p95_ms": percentile(sorted_ms, 0.95),
+        "p99_ms": percentile(sorted_ms, 0.99),
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def measure_config(model_dir, config):
+    """Run one configuration in a fresh process and return its results"""
+    output = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--run-config",
+            json.dumps(config),
+            "--model-dir",
+            model_dir,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def make_config(args, length_dist, duplicate_ratio, hit_ratio, batch_size):
+    """Return a benchmark configuration"""
+    return {
+        "length_dist": length_dist,
+        "duplicate_ratio": duplicate_ratio,
+        "hit_ratio": hit_ratio,
+        "batch_size": batch_size,
+        "requests": args.requests,
+        "request_sents": args.request_sents,
+        "seed": args.seed,
+    }
+
+
+def print_results(results):
+    """Print a table of results"""
+    print(
+        f"{'lengths':<8}{'dup':>6}{'hit':>6}{'batch':>7}{'sents/s':>10}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}{'peak MB':>9}"
+    )
+    for result in results:
+        print(
+            f"{result['length_dist']:<8}{result['duplicate_ratio']:>6.2f}"
+            f"{result['hit_ratio']:>6.2f}{result['batch_size']:>7d}"
+            f"{result['sents_per_second']:>10.1f}{result['p50_ms']:>10.1f}"
+            f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            f"{result['peak_rss_mb']:>9.0f}"
+        )
+
+
+def recommend_batch_size(results, memory_limit_mb, memory_headroom):
+    """Return the batch size with the highest throughput whose peak RSS leaves headroom under
+    the memory limit
+
+    Args:
+        results (Dict[]): Results of the batch size sweep
+        memory_limit_mb (float): Memory of the lambda
+        memory_headroom (float): Share of the memory limit kept free
+
+    Returns:
+        int: The recommended batch size, or None if every batch size used too much memory
+    """
+    memory_budget_mb = memory_limit_mb * (1 - memory_headroom)
+    fitting = [
+        result for result in results if result["peak_rss_mb"] <= memory_budget_mb
+    ]
+    if len(fitting) == 0:
+        return None
+    return max(fitting, key=lambda result: result["sents_per_second"])["batch_size"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model-dir", help="Model files, the stand-in is built if not given"
+    )
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--request-sents", type=int, default=200)
+    parser.add_argument(
+        "--length-dists", nargs="+", default=list(SYNTHETIC_LENGTHS.keys())
+    )
+    parser.add_argument("--duplicate-ratios", nargs="+", type=float, default=[0, 0.3])
+    parser.add_argument("--hit-ratios", nargs="+", type=float, default=[0, 0.5])
+    parser.add_argument(
+        "--batch-sizes", nargs="+", type=int, default=[30, 100, 300, 1000, 3000]
+    )
+    parser.add_argument("--sweep-length-dist", default="tail")
+    # The memory size in template.yaml
+    parser.add_argument("--memory-limit-mb", type=float, default=3008)
+    parser.add_argument("--memory-headroom", type=float, default=0.2)
+    parser.add_argument("--skip-suite", action="store_true")
+    parser.add_argument("--output", help="Write the sweep and recommendation as json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run-config", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_config is not None:
+        print(json.dumps(run_config(args.model_dir, json.loads(args.run_config))))
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        model_dir = args.model_dir
+        if model_dir is None:
+            model_dir = os.path.join(work_dir, "model")
+            make_tiny_t5(model_dir)
+
+        if not args.skip_suite:
+            print_results(
+                [
+                    measure_config(
+                        model_dir,
+                        make_config(
+                            args,
+                            length_dist,
+                            duplicate_ratio,
+                            hit_ratio,
+                            DEFAULT_BATCH_SIZE,
+                        ),
+                    )
+                    for length_dist in args.length_dists
+                    for duplicate_ratio in args.duplicate_ratios
+                    for hit_ratio in args.hit_ratios
+                ]
+            )
+            print()
+
+        sweep_results = [
+            measure_config(
+                model_dir, make_config(args, args.sweep_length_dist, 0, 0, batch_size)
+            )
+            for batch_size in args.batch_sizes
+        ]
+    print_results(sweep_results)
+    recommended = recommend_batch_size(
+        sweep_results, args.memory_limit_mb, args.memory_headroom
+    )
+    if recommended is None:
+        print(f"No batch size fits within {args.memory_limit_mb} MB")
+    else:
+        print(f"Recommended DEFAULT_BATCH_SIZE = {recommended}")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(
+                {
+                    "memory_limit_mb": args.memory_limit_mb,
+                    "memory_headroom": args.memory_headroom,
+                    "recommended_batch_size": recommended,
+                    "results": sweep_results,
+                },
+                output_file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Serve lambda_handler over HTTP on localhost, for load tests with concurrent requests.
+
+Every request is handled on its own thread of one process, so concurrent requests share the
+module level state of app.py the same way concurrent invocations in one environment do. The
+request body and headers are passed to lambda_handler the way API Gateway passes them.
+
+app.py connects to MongoDB and s3 on import, so the same env variables as a deployment are
+needed, either set or in a .env file.
+
+Usage:
+    COALESCE_WAIT_MS=5 python benchmarks/local_server.py --port 8080
+    curl -X POST localhost:8080 -d '{"sent_list": ["I enjoy sunny days"]}'
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+
+def make_request_handler(lambda_handler):
+    """Create a request handler class which passes each POST request to lambda_handler
+
+    Args:
+        lambda_handler (callable): The lambda entry point
+
+    Returns:
+        type: BaseHTTPRequestHandler subclass
+    """
+
+    class LambdaRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            event = {
+                "headers": dict(self.headers),
+                "isBase64Encoded": True,
+                "body": base64.b64encode(body).decode("ascii"),
+            }
+            # API Gateway only base64 encodes bodies which aren't text
+            try:
+                event["body"] = body.decode("utf-8")
+                event["isBase64Encoded"] = False
+            except UnicodeDecodeError:
+                pass
+            res = lambda_handler(event, None)
+            res_body = res.get("body", "")
+            if res.get("isBase64Encoded"):
+                res_body = base64.b64decode(res_body)
+            elif isinstance(res_body, str):
+                res_body = res_body.encode("utf-8")
+            else:
+                res_body = json.dumps(res_body, default=str).encode("utf-8")
+            self.send_response(res["statusCode"])
+            for name, value in res.get("headers", {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(res_body)))
+            self.end_headers()
+            self.wfile.write(res_body)
+
+    return LambdaRequestHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    import app
+
+    server = ThreadingHTTPServer(
+        (args.host, args.port), make_request_handler(app.lambda_handler)
+    )
+    print(f"Serving lambda_handler on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Benchmark of the sent lookup query and of the first lookup after a cold start.
+
+The lookup is timed the way it was first written, fetching whole documents in the default
+batches, and the way DbHandler now runs it, fetching only the needed fields with every match
+in the first batch. The first lookup is then timed with and without the background warm up.
+
+Runs against the MongoDB given by --uri, or against mongomock when no uri is given. mongomock
+has no network round trips, so only a real server shows the connection and batching savings.
+
+Usage:
+    python benchmarks/mongo_benchmark.py --uri "mongodb://localhost" --docs 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from config.config import (  # noqa: E402
+    ENV_DB_VAR_NAME,
+    ENV_URI_VAR_NAME,
+    MONGO_MAX_QUERY_SENTS,
+)
+
+
+def percentile(sorted_values, fraction):
+    """Return the value at fraction of the way through sorted_values"""
+    return sorted_values[
+        min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    ]
+
+
+def time_lookups(run_lookup, batches):
+    """Time run_lookup on every batch
+
+    Args:
+        run_lookup (callable): Function taking a list of keys and returning the matches
+        batches (str[][]): The batches of normalised sents to look up
+
+    Returns:
+        float[]: Sorted lookup times in milliseconds
+    """
+    times_ms = []
+    for batch in batches:
+        start = time.perf_counter()
+        run_lookup(batch)
+        times_ms.append(1000 * (time.perf_counter() - start))
+    return sorted(times_ms)
+
+
+def time_first_lookup(db_handler_class, warm_up, sents, startup_seconds):
+    """Time the first lookup made by a new DbHandler
+
+    Args:
+        db_handler_class (type): The DbHandler class
+        warm_up (bool): Whether the handler warms up in the background
+        sents (str[]): The normalised sents to look up
+        startup_seconds (float): Time the rest of the cold start takes, during which the warm
+                                 up can run
+
+    Returns:
+        float: First lookup time in milliseconds
+    """
+    db_handler = db_handler_class(warm_up=warm_up)
+    time.sleep(startup_seconds)
+    start = time.perf_counter()
+    db_handler.find_many_sents(sents)
+    first_ms = 1000 * (time.perf_counter() - start)
+    db_handler.mongo_client.close()
+    return first_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default=None)
+    parser.add_argument("--db", default="mongo_benchmark")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--hit-ratio", type=float, default=0.8)
+    parser.add_argument("--startup-seconds", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ[ENV_DB_VAR_NAME] = args.db
+    os.environ[ENV_URI_VAR_NAME] = args.uri or "mongodb://localhost"
+    if args.uri is None:
+        import mongomock
+        import pymongo
+
+        pymongo.MongoClient = mongomock.MongoClient
+        print("No --uri given, running against mongomock")
+    # Imported after the MongoClient is chosen, as db_utils binds it at import
+    from utils.db_utils import DbHandler
+
+    db_handler = DbHandler()
+    db_handler.wait_for_warm_up()
+    layout = db_handler.layout
+    db_handler.mongo_col.delete_many({})
+    # Stored sents carry the fields a production document has, so the projection has
+    # something to leave out
+    stored_sents = [f"benchmark sent number {index}" for index in range(args.docs)]
+    db_handler.store_sents(
+        stored_sents, [f"<pad> label {index % 6}" for index in range(args.docs)]
+    )
+    db_handler.increment_hits({sent: 1 for sent in stored_sents})
+
+    rng = random.Random(args.seed)
+    batches = []
+    for _ in range(args.batches):
+        hit_count = int(args.batch_size * args.hit_ratio)
+        batch = rng.sample(stored_sents, hit_count)
+        batch += [
+            f"missing sent {rng.random()}" for _ in range(args.batch_size - hit_count)
+        ]
+        batches.append(batch[:MONGO_MAX_QUERY_SENTS])
+
+    def baseline_lookup(batch):
+        query_keys = [layout.key_func(sent) for sent in batch]
+        return list(db_handler.mongo_col.find({layout.key_field: {"$in": query_keys}}))
+
+    def tuned_lookup(batch):
+        query_keys = [layout.key_func(sent) for sent in batch]
+        return list(
+            db_handler.read_col.find(
+                {layout.key_field: {"$in": query_keys}},
+                layout.get_projection(),
+                batch_size=len(query_keys),
+            )
+        )
+
+    # Warm both paths up once, so neither pays for opening connections
+    baseline_lookup(batches[0])
+    tuned_lookup(batches[0])
+    print(f"{args.docs} docs, {args.batches} lookups of {args.batch_size} sents")
+    for name, run_lookup in [("baseline", baseline_lookup), ("tuned", tuned_lookup)]:
+        times_ms = time_lookups(run_lookup, batches)
+        print(
+            f"{name:10} p50 {percentile(times_ms, 0.5):8.2f} ms"
+            f"   p95 {percentile(times_ms, 0.95):8.2f} ms"
+        )
+
+    for warm_up in [False, True]:
+        first_ms = time_first_lookup(
+            DbHandler, warm_up, batches[0], args.startup_seconds
+        )
+        name = "warm up" if warm_up else "no warm up"
+        print(f"first lookup, {name:10} {first_ms:8.2f} ms")
+    db_handler.mongo_col.delete_many({})
+    db_handler.mongo_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Micro-benchmark of normalise_sent against normalise_sents. tests/test_text_utils.py checks
+they give exactly the same output.
+
+Usage:
+    python benchmarks/normalise_benchmark.py --repeats 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from corpus import NON_ASCII_SENTS, PARITY_CORPUS  # noqa: E402
+from utils.text_utils import normalise_sent, normalise_sents  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--non-ascii-share", type=float, default=0.1)
+    args = parser.parse_args()
+
+    non_ascii_count = int(len(PARITY_CORPUS) * args.non_ascii_share)
+    sents = PARITY_CORPUS + (NON_ASCII_SENTS * len(PARITY_CORPUS))[:non_ascii_count]
+    # Make each repeat's sents unique so the memo cache only helps where it would in production
+    batches = [[f"{sent} {repeat}" for sent in sents] for repeat in range(args.repeats)]
+
+    start = time.perf_counter()
+    for batch in batches:
+        [normalise_sent(sent) for sent in batch]
+    old_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for batch in batches:
+        normalise_sents(batch)
+    new_seconds = time.perf_counter() - start
+    # Repeated sents, as seen on cache hit heavy traffic
+    start = time.perf_counter()
+    for _ in batches:
+        normalise_sents(batches[0])
+    memo_seconds = time.perf_counter() - start
+
+    sent_count = len(sents) * args.repeats
+    print(f"normalise_sent          {1e6 * old_seconds / sent_count:8.2f} us/sent")
+    print(f"normalise_sents         {1e6 * new_seconds / sent_count:8.2f} us/sent")
+    print(f"normalise_sents, repeat {1e6 * memo_seconds / sent_count:8.2f} us/sent")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Local stand-ins for the services app.py uses at import, so a cold start can be run offline.
+
+MongoDB is replaced with mongomock, s3 with moto, and the model with a tiny randomly initialised
+T5 checkpoint with the real model's file layout. These need mongomock, moto, sentencepiece and
+transformers installed, none of which are part of the lambda image.
+"""
+
+import io
+import os
+import random
+import tempfile
+import zipfile
+
+from config.config import (
+    ENV_BUCKET_VAR_NAME,
+    ENV_DB_VAR_NAME,
+    ENV_URI_VAR_NAME,
+    SENT_MODEL_FILE,
+    SENT_MODEL_LABELS,
+    SENT_MODEL_NAME,
+)
+
+STAND_IN_BUCKET = "stand-in-model-bucket"
+
+# Words the stand-in tokenizer is trained on
+_VOCAB_WORDS = (
+    "i you we they enjoy love hate miss wish fear sunny days the cat dog sat on a mat happy "
+    "sad angry scared surprised great terrible home night party friends work exam"
+).split()
+
+
+def make_tiny_t5(model_dir, seed=0):
+    """Save a tiny random T5 model and tokenizer to model_dir, laid out like the real model.
+    Each label is a single token, so both inference modes work with it
+
+    Args:
+        model_dir (string): Directory to save the checkpoint to
+        seed (int): Seed for the training text and the weights
+    """
+    import sentencepiece
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration, T5Tokenizer
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        text_path = os.path.join(work_dir, "text.txt")
+        with open(text_path, "w", encoding="utf-8") as text_file:
+            for _ in range(2000):
+                text_file.write(
+                    " ".join(rng.choices(_VOCAB_WORDS, k=rng.randint(3, 15))) + "\n"
+                )
+        model_prefix = os.path.join(work_dir, "spiece")
+        sentencepiece.SentencePieceTrainer.train(
+            input=text_path,
+            model_prefix=model_prefix,
+            vocab_size=64,
+            pad_id=0,
+            eos_id=1,
+            unk_id=2,
+            bos_id=-1,
+            user_defined_symbols=["▁" + label for label in SENT_MODEL_LABELS],
+        )
+        tokenizer = T5Tokenizer(model_prefix + ".model", extra_ids=0)
+        tokenizer.save_pretrained(model_dir)
+    config = T5Config(
+        vocab_size=len(tokenizer),
+        d_model=32,
+        d_ff=64,
+        num_layers=2,
+        num_heads=2,
+        d_kv=16,
+        decoder_start_token_id=0,
+        pad_token_id=0,
+        eos_token_id=1,
+        tie_word_embeddings=False,
+    )
+    torch.manual_seed(seed)
+    model = T5ForConditionalGeneration(config).eval()
+    label_ids = [
+        tokenizer.convert_tokens_to_ids("▁" + label) for label in SENT_MODEL_LABELS
+    ]
+    calibration_sents = [
+        " ".join(rng.choices(_VOCAB_WORDS, k=rng.randint(3, 15))) for _ in range(200)
+    ]
+    _answer_with_labels(model, tokenizer(calibration_sents), label_ids)
+    model.save_pretrained(model_dir, safe_serialization=False)
+
+
+def _answer_with_labels(model, calibration_inputs, label_ids, margin=20.0, spread=4.0):
+    """Change a random T5 so its first decoded token is always one of label_ids, like the
+    fine-tuned model, with the label it picks depending on the input. Both inference modes
+    only run the first decoder step, whose only input is the decoder start token
+
+    Args:
+        model (T5ForConditionalGeneration): Model with untied word embeddings
+        calibration_inputs (BatchEncoding): Unpadded tokenized sents to calibrate the labels on
+        label_ids (int[]): Token ids of the labels
+        margin (float): Weight pushing every label above every other token
+        spread (float): Standard deviation of each label's logit over the calibration sents
+    """
+    import torch
+
+    # Nothing is written to the last dimension of the decoder's residual stream, so at the
+    # first step it holds the start token's embedding, which is positive, and stays positive
+    # through the final layer norm
+    bias_dim = model.config.d_model - 1
+    with torch.no_grad():
+        for block in model.decoder.block:
+            for layer in block.layer:
+                for name in ("SelfAttention", "EncDecAttention"):
+                    if hasattr(layer, name):
+                        getattr(layer, name).o.weight[bias_dim] = 0
+                if hasattr(layer, "DenseReluDense"):
+                    layer.DenseReluDense.wo.weight[bias_dim] = 0
+        model.shared.weight[model.config.decoder_start_token_id, bias_dim] = 1.0
+        model.decoder.final_layer_norm.weight[bias_dim] = 1.0
+
+        # The decoder output barely varies between inputs, so the label weights only look at
+        # how it varies, scaled up so the most likely label changes from sent to sent
+        hidden = torch.cat(
+            [
+                model(
+                    input_ids=torch.tensor([input_ids]),
+                    decoder_input_ids=torch.tensor(
+                        [[model.config.decoder_start_token_id]]
+                    ),
+                    output_hidden_states=True,
+                ).decoder_hidden_states[-1][:, -1]
+                for input_ids in calibration_inputs["input_ids"]
+            ]
+        )
+        centered = hidden - hidden.mean(dim=0)
+        centered[:, bias_dim] = 0
+        label_weights = torch.randn(len(label_ids), model.config.d_model)
+        label_weights[:, bias_dim] = 0
+        label_weights *= spread / (centered @ label_weights.T).std(dim=0)[:, None]
+        label_bias = -(hidden.mean(dim=0) @ label_weights.T)
+
+        # The last dimension acts as a bias, pushing every label above every other token and
+        # cancelling out the part of each label's logit which is the same for every input
+        lm_head = model.lm_head.weight
+        lm_head.zero_()
+        lm_head[:, bias_dim] = -margin
+        lm_head[label_ids] = label_weights
+        lm_head[label_ids, bias_dim] = margin + label_bias / hidden[:, bias_dim].mean()
+
+
+def zip_model(model_dir):
+    """Return model_dir zipped the way the model is stored in s3
+
+    Args:
+        model_dir (string): Directory holding the checkpoint
+
+    Returns:
+        bytes: The zip file
+    """
+    zip_bytes = io.BytesIO()
+    with zipfile.ZipFile(zip_bytes, "w") as model_zip:
+        for file_name in sorted(os.listdir(model_dir)):
+            model_zip.write(
+                os.path.join(model_dir, file_name), f"{SENT_MODEL_NAME}/{file_name}"
+            )
+    return zip_bytes.getvalue()
+
+
+def start_stand_ins(model_zip):
+    """Point app.py at an in-memory MongoDB and a fake s3 bucket holding model_zip. Must be
+    called before app.py is imported
+
+    Args:
+        model_zip (bytes): The zipped model, from zip_model
+
+    Returns:
+        The moto mock, which can be stopped with its stop method
+    """
+    os.environ.update(
+        {
+            ENV_DB_VAR_NAME: "stand_in_db",
+            ENV_URI_VAR_NAME: "mongodb://localhost",
+            ENV_BUCKET_VAR_NAME: STAND_IN_BUCKET,
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "stand-in",
+            "AWS_SECRET_ACCESS_KEY": "stand-in",
+        }
+    )
+    import boto3
+    import mongomock
+    import pymongo
+    from moto import mock_aws
+
+    pymongo.MongoClient = mongomock.MongoClient
+    aws_mock = mock_aws()
+    aws_mock.start()
+    s3_client = boto3.client("s3")
+    s3_client.create_bucket(Bucket=STAND_IN_BUCKET)
+    s3_client.put_object(Bucket=STAND_IN_BUCKET, Key=SENT_MODEL_FILE, Body=model_zip)
+    return aws_mock
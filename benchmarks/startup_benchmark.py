@@ -0,0 +1,182 @@
+"""Cold start benchmark with a regression check.
+
+Each run imports app.py in a fresh process with the startup profiler enabled, against local
+stand-ins for MongoDB, s3 and the model (see stand_ins.py), so no network access is needed.
+The median wall time and resident memory of each startup phase is compared against a baseline,
+and the script exits with an error if any phase regressed past the thresholds.
+
+The stand-ins import pymongo and boto3 before app.py does, so those imports aren't included in
+the import times. The extracted model in /tmp/ is deleted before each run, as it would be on a
+real cold start, so a real model extracted there will be downloaded again on its next use.
+
+Usage:
+    python benchmarks/startup_benchmark.py --write-baseline startup_baseline.json
+    python benchmarks/startup_benchmark.py --baseline startup_baseline.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from config.config import (  # noqa: E402
+    ENV_STARTUP_PROFILE_VAR_NAME,
+    MODEL_CHECKPOINT,
+    MODEL_STAGING_DIR,
+    ONNX_CHECKPOINT,
+    SAFETENSORS_CHECKPOINT,
+)
+from stand_ins import make_tiny_t5, start_stand_ins, zip_model  # noqa: E402
+
+
+def run_cold_start(model_dir):
+    """Import app.py against the stand-ins. The startup profiler prints its report to stdout
+
+    Args:
+        model_dir (string): Directory holding the stand-in model
+    """
+    start_stand_ins(zip_model(model_dir))
+    import app  # noqa: F401
+
+
+def measure_cold_start(model_dir):
+    """Run one cold start in a fresh process and return its startup report
+
+    Args:
+        model_dir (string): Directory holding the stand-in model
+
+    Returns:
+        Dict: The startup report
+    """
+    for checkpoint in (
+        MODEL_CHECKPOINT,
+        MODEL_STAGING_DIR,
+        SAFETENSORS_CHECKPOINT,
+        ONNX_CHECKPOINT,
+    ):
+        shutil.rmtree(checkpoint, ignore_errors=True)
+    output = subprocess.run(
+        [sys.executable, __file__, "--run-cold-start", "--model-dir", model_dir],
+        env=os.environ | {ENV_STARTUP_PROFILE_VAR_NAME: "true"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in output.stdout.splitlines():
+        if line.startswith('{"startup_profile"'):
+            return json.loads(line)["startup_profile"]
+    raise RuntimeError(f"No startup report found in output:\n{output.stdout}")
+
+
+def summarise(reports):
+    """Return the median of every phase's wall time and memory over several runs
+
+    Args:
+        reports (Dict[]): Startup reports of each run
+
+    Returns:
+        Dict: Dictionary of phase name : {"wall_ms", "rss_mb"}, including a "total" phase
+    """
+    samples = {}
+    for report in reports:
+        phases = report["phases"] + [
+            {
+                "name": "total",
+                "wall_ms": report["total_ms"],
+                "rss_mb": report["peak_rss_mb"],
+            }
+        ]
+        for phase in phases:
+            phase_samples = samples.setdefault(
+                phase["name"], {"wall_ms": [], "rss_mb": []}
+            )
+            phase_samples["wall_ms"].append(phase["wall_ms"])
+            phase_samples["rss_mb"].append(phase["rss_mb"])
+    return {
+        name: {metric: statistics.median(values) for metric, values in phase.items()}
+        for name, phase in samples.items()
+    }
+
+
+def find_regressions(summary, baseline, max_ratio, min_wall_ms, min_rss_mb):
+    """Return the phases slower, or larger, than the baseline by more than both the ratio and
+    the absolute threshold. The absolute thresholds stop short phases failing on noise
+
+    Args:
+        summary (Dict): Summary of the current runs, from summarise
+        baseline (Dict): Summary of the baseline runs
+        max_ratio (float): Allowed ratio of current to baseline
+        min_wall_ms (float): Wall time increase always allowed
+        min_rss_mb (float): Memory increase always allowed
+
+    Returns:
+        str[]: Description of each regression
+    """
+    regressions = []
+    for name, base_phase in baseline.items():
+        phase = summary.get(name)
+        if phase is None:
+            continue
+        for metric, min_increase in (("wall_ms", min_wall_ms), ("rss_mb", min_rss_mb)):
+            current, base = phase[metric], base_phase[metric]
+            if current > base * max_ratio and current - base > min_increase:
+                regressions.append(f"{name} {metric} {base:.1f} -> {current:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--baseline", help="Baseline summary to check against")
+    parser.add_argument(
+        "--write-baseline", help="Save this run's summary as a baseline"
+    )
+    parser.add_argument("--max-ratio", type=float, default=1.25)
+    parser.add_argument("--min-wall-ms", type=float, default=100)
+    parser.add_argument("--min-rss-mb", type=float, default=25)
+    parser.add_argument("--model-dir", help="Stand-in model, built if not given")
+    parser.add_argument("--run-cold-start", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_cold_start:
+        run_cold_start(args.model_dir)
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        model_dir = args.model_dir
+        if model_dir is None:
+            model_dir = os.path.join(work_dir, "model")
+            make_tiny_t5(model_dir)
+        reports = [measure_cold_start(model_dir) for _ in range(args.runs)]
+    summary = summarise(reports)
+
+    print(f"{'phase':<20}{'wall ms':>10}{'rss MB':>10}")
+    for name, phase in summary.items():
+        print(f"{name:<20}{phase['wall_ms']:>10.1f}{phase['rss_mb']:>10.1f}")
+    print("Slowest imports of the last run (ms):")
+    for module_name, import_ms in list(reports[-1]["slowest_imports_ms"].items())[:10]:
+        print(f"    {module_name:<40}{import_ms:>10.1f}")
+
+    if args.write_baseline is not None:
+        with open(args.write_baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(summary, baseline_file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(
+            summary, baseline, args.max_ratio, args.min_wall_ms, args.min_rss_mb
+        )
+        if len(regressions) > 0:
+            sys.exit("Startup regressed:\n    " + "\n    ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
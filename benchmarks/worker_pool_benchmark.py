@@ -0,0 +1,90 @@
+"""Benchmark of inference throughput as the number of cores grows, comparing torch intra-op
+threads in one process against the forked worker pool with one thread per worker.
+
+Expects the model to already be extracted at MODEL_CHECKPOINT, as download_new_model leaves it.
+
+Usage:
+    python benchmarks/worker_pool_benchmark.py --max-workers 4
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from corpus import PARITY_CORPUS  # noqa: E402
+
+
+def time_handler(handler, sents, batch_size, repeats):
+    """Time how many sents per second a handler processes
+
+    Args:
+        handler: Object with a generate_processed_sents method
+        sents (str[]): Sents to process
+        batch_size (int): Number of sents passed to the handler at once
+        repeats (int): Number of times the sents are processed
+
+    Returns:
+        float: Sents processed per second
+    """
+    # Warm up once so lazy initialisation isn't timed
+    handler.generate_processed_sents(sents[:batch_size])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(sents), batch_size):
+            handler.generate_processed_sents(sents[i : i + batch_size])
+    return repeats * len(sents) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=120)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    from utils.worker_pool_utils import InferenceWorkerPool, WorkerZygote
+
+    sents = PARITY_CORPUS * 6
+    # The zygote is forked before this process imports torch or runs the model, as the lambda
+    # does, so the worker pools are measured first
+    zygote = WorkerZygote()
+    pool_results = {}
+    for num_workers in range(1, args.max_workers + 1):
+        pool = InferenceWorkerPool(zygote, num_workers, 1)
+        pool_results[num_workers] = time_handler(
+            pool, sents, args.batch_size, args.repeats
+        )
+        pool.close()
+    zygote.close()
+
+    import torch
+
+    from utils.model_utils import ModelHandler
+
+    model_handler = ModelHandler()
+    thread_results = {}
+    for num_threads in range(1, args.max_workers + 1):
+        torch.set_num_threads(num_threads)
+        thread_results[num_threads] = time_handler(
+            model_handler, sents, args.batch_size, args.repeats
+        )
+
+    print(
+        f"{'cores':>6}{'threads s/s':>13}{'speedup':>9}{'workers s/s':>13}{'speedup':>9}"
+    )
+    for cores in range(1, args.max_workers + 1):
+        print(
+            f"{cores:>6}{thread_results[cores]:>13.1f}"
+            f"{thread_results[cores] / thread_results[1]:>9.2f}"
+            f"{pool_results[cores]:>13.1f}"
+            f"{pool_results[cores] / pool_results[1]:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,90 @@
 """The main module for the NLP lambda function"""
 
-import json
 import logging
 import os
+import threading
+import time
 
+# The startup profiler is imported before anything slow, so it can time the other imports
+from utils.startup_utils import startup_profiler  # isort: skip
+
+import boto3
 from dotenv import load_dotenv
 
-from config.config import DEFAULT_BATCH_SIZE, ENV_DB_VAR_NAME, SENT_LIST_KEY
+from config.config import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_DISK_CACHE,
+    DEFAULT_INFERENCE_WORKERS,
+    DEFAULT_PIPELINE_MODE,
+    DEFAULT_LAZY_MODEL_LOAD,
+    DEFAULT_METRICS,
+    DEFAULT_JOB_SELF_INVOKE,
+    DEFAULT_SENT_BLOOM_FILTER,
+    DEFAULT_SERVER_TIMING,
+    DEFAULT_TRACK_SENT_HITS,
+    DISK_CACHE_EVICT_FRACTION,
+    DISK_CACHE_FILE,
+    DISK_CACHE_MAX_ENTRIES,
+    ENV_DB_VAR_NAME,
+    ENV_DISK_CACHE_VAR_NAME,
+    ENV_INFERENCE_WORKERS_VAR_NAME,
+    ENV_JOB_SELF_INVOKE_VAR_NAME,
+    ENV_LAZY_MODEL_LOAD_VAR_NAME,
+    ENV_METRICS_VAR_NAME,
+    ENV_SENT_BLOOM_FILTER_VAR_NAME,
+    ENV_SERVER_TIMING_VAR_NAME,
+    ENV_TRACK_SENT_HITS_VAR_NAME,
+    HOT_SET_DOWNLOAD_PATH,
+    HOT_SET_FILE,
+    JOB_ACTION_KEY,
+    JOB_ACTION_RESULTS,
+    JOB_ACTION_RUN,
+    JOB_ACTION_STATUS,
+    JOB_ACTION_SUBMIT,
+    JOB_CHUNK_LEASE_SECONDS,
+    JOB_CHUNK_SIZE,
+    JOB_ID_KEY,
+    JOB_LEASE_POLL_SECONDS,
+    JOB_MAX_CHUNK_ATTEMPTS,
+    JOB_MAX_CHUNK_BYTES,
+    JOB_MIN_REMAINING_MS,
+    JOB_PAGE_KEY,
+    JOB_RESULTS_PAGE_CHUNKS,
+    METRICS_NAMESPACE,
+    METRICS_SERVICE_NAME,
+    MODEL_READY_TIMEOUT_SECONDS,
+    ENV_PIPELINE_MODE_VAR_NAME,
+    PIPELINE_CHUNK_SIZE,
+    PIPELINE_MAX_PENDING_WRITES,
+    PIPELINE_PREFETCH_DEPTH,
+    PIPELINE_WRITE_WORKERS,
+    RESPONSE_FORMAT_POSITIONAL,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_TTL_SECONDS,
+    SENT_LIST_KEY,
+    WRITE_BEHIND_FLUSH_SECONDS,
+    WRITE_BEHIND_MAX_PENDING,
+    WRITE_BEHIND_MAX_RETRY_SENTS,
+    WRITE_BEHIND_RECENT_KEYS,
+)
+from utils.cache_utils import ResultCache
 from utils.db_utils import DbHandler, check_sent_collection
-from utils.model_utils import ModelHandler
-from utils.s3_utils import download_new_model
-from utils.text_utils import normalise_sent
+from utils.disk_cache_utils import DiskCache
+from utils.env_utils import get_env_flag, get_env_number
+from utils.job_utils import JobStore, invoke_async, run_job
+from utils.loader_utils import ModelLoader
+from utils.metrics_utils import get_metrics, instrument_handler
+from utils.pipeline_utils import BackgroundWriter, prefetch_map
+from utils.s3_utils import download_hot_set
+from utils.text_utils import group_sents_by_normalised
+from utils.wire_utils import (
+    decode_request_body,
+    encode_response_body,
+    get_response_options,
+)
+from utils.worker_pool_utils import WorkerZygote
+from utils.write_behind_utils import WriteBehindBuffer
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -19,52 +93,114 @@ logger.setLevel(logging.INFO)
 # NOTE: .env file is not included in git for security reasons
 if os.environ.get(ENV_DB_VAR_NAME) is None:
     load_dotenv()
+startup_profiler.mark("imports")
 
 # The global variables outside of the lambda_handler function can be shared between invocations
 # if they are on the same machine. This means we must consider race conditions for shared resources.
 # Despite this, we gain significant performance increase by sharing the parts that are expensive to
 # setup.
+worker_zygote = None
+if get_env_number(ENV_INFERENCE_WORKERS_VAR_NAME, DEFAULT_INFERENCE_WORKERS) > 0:
+    # The inference workers are forked from a process forked here, before any other thread is
+    # started, so no worker can inherit a lock held by one of those threads
+    worker_zygote = WorkerZygote()
 db_handler = DbHandler()
 logger.info("Connected to db")
+startup_profiler.mark("db_connect")
+if get_env_flag(ENV_SENT_BLOOM_FILTER_VAR_NAME, DEFAULT_SENT_BLOOM_FILTER):
+    # Fresh sents skip the database lookup once the filter of stored sents has loaded
+    db_handler.start_membership_index()
+# Processed sents are cached in memory so warm invocations can skip the database for sents that
+# were seen recently
+result_cache = ResultCache(
+    RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL_SECONDS
+)
+# New processed sents are written to the database in bulk, shared between invocations so
+# repeated sents from different invocations are only written once
+write_buffer = WriteBehindBuffer(
+    db_handler.store_sents,
+    WRITE_BEHIND_MAX_PENDING,
+    WRITE_BEHIND_FLUSH_SECONDS,
+    WRITE_BEHIND_RECENT_KEYS,
+    WRITE_BEHIND_MAX_RETRY_SENTS,
+    db_handler.increment_hits,
+)
+# Processed sents are also cached on disk, which outlives this process, and is seeded with the
+# most requested sents in the background
+disk_cache = None
+if get_env_flag(ENV_DISK_CACHE_VAR_NAME, DEFAULT_DISK_CACHE):
+    disk_cache = DiskCache(
+        DISK_CACHE_FILE, DISK_CACHE_MAX_ENTRIES, DISK_CACHE_EVICT_FRACTION
+    )
 
-# The download_new_model() and initialising the model_handler steps have race conditions where
-# one lambda is invoked in the same environment before the other lambda finishes downloading the new
-# model. In this case the model is deleted and the first lambda will fail to read the model into
-# memory.
-# N.B. I've not yet found the AWS documentation confirming whether two lambda instances can run
-# simultaneously in the same environment. As such, I'm assuming they can.
-# Also, a mutex is most efficiently done with the threading library's mutex, because it guarantees
-# it can only lock for invocations in the same environment (we don't care otherwise).
-# I implemented a MongoDB lock because it was interesting, but it's definitely a less efficient
-# method than threading's mutex due to operating over all instances in all environments.
-try:
-    # If the model_handler has been created by another lambda in the same environment, this will
-    # be shared and we don't need to recreate it.
-    model_handler
-    logger.info("Model already loaded, skipping download")
-except NameError:
-    db_handler.lock_mutex()
+job_store = JobStore(
+    db_handler.job_col,
+    db_handler.job_chunk_col,
+    JOB_CHUNK_LEASE_SECONDS,
+    JOB_MAX_CHUNK_ATTEMPTS,
+)
+# Only created when a job first needs to invoke this lambda again
+lambda_client = None
+startup_profiler.mark("shared_state")
+
+
+def seed_disk_cache():
+    """Load the hot set snapshot into the disk cache, preferring a snapshot in the image over
+    one next to the model in s3. Sents looked up before it finishes go to the database
+    """
     try:
-        # Check again if the model_handler has been created since we started trying to acquire the
-        # lock
-        model_handler
-        logger.info("Model already loaded, skipping download")
-    except NameError:
-        logger.info("Model not found, initiating download")
-        download_new_model()
-        logger.info("Model downloaded")
+        snapshot_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), HOT_SET_FILE
+        )
+        if not os.path.exists(snapshot_path):
+            snapshot_path = HOT_SET_DOWNLOAD_PATH
+            if not download_hot_set(snapshot_path):
+                logger.info("No hot set snapshot found")
+                return
+        disk_cache.load_snapshot(snapshot_path)
+    except Exception:
+        # The cache still works without the snapshot, it just starts cold
+        logger.exception("Failed to load the hot set snapshot")
+
+
+if disk_cache is not None:
+    threading.Thread(target=seed_disk_cache, name="hot-set-loader", daemon=True).start()
 
-        model_handler = ModelHandler()
-        logger.info("Model and Tokenizer loaded")
-    db_handler.unlock_mutex()
+# The model download is locked with the threading library's mutex and a file lock, because they
+# only lock for invocations in the same environment (we don't care otherwise). A MongoDB lease
+# lock over all instances in all environments can be added with the REMOTE_MODEL_LOCK env
+# variable, but it's definitely less efficient.
+# N.B. I've not yet found the AWS documentation confirming whether two lambda instances can run
+# simultaneously in the same environment. As such, I'm assuming they can.
+model_loader = ModelLoader(db_handler, worker_zygote)
+if get_env_flag(ENV_LAZY_MODEL_LOAD_VAR_NAME, DEFAULT_LAZY_MODEL_LOAD):
+    # Requests which are fully cached can be answered while the model loads in the background.
+    # Requests which need the model wait for it in process_sents
+    # The startup report is printed once the background load finishes
+    model_loader.start()
+    logger.info("Model loading in the background")
+    startup_profiler.mark("model_load_started")
+else:
+    model_loader.load()
+    startup_profiler.mark("model_load")
+    startup_profiler.finish()
 
 
+# Metrics cost nothing beyond the env flag check when disabled
+@instrument_handler(
+    METRICS_NAMESPACE,
+    {"Service": METRICS_SERVICE_NAME},
+    lambda: get_env_flag(ENV_METRICS_VAR_NAME, DEFAULT_METRICS),
+    lambda: get_env_flag(ENV_SERVER_TIMING_VAR_NAME, DEFAULT_SERVER_TIMING),
+)
 def lambda_handler(event, context) -> None:
     """Entry point for NLP lambda function
 
     Args:
-        event (json): json object containing the list of sentences (sents) to process
-        context (): Unused
+        event (json): json object containing the list of sentences (sents) to process, or a
+                      job action
+        context (LambdaContext): Lambda context, used by jobs for the time remaining and
+                                 the ARN to invoke again. May be None when run locally
     """
     # DEFAULT_BATCH_SIZE is a global parameter, which preserves changes by other invocations.
     # To avoid this make a local variable and change that
@@ -73,6 +209,7 @@ def lambda_handler(event, context) -> None:
     try:
         # First attempt to get the sentence list
         full_sent_list = None
+        request_fields = dict(event)
         # When directly tested the lambda is passed the sent_list in the top level of the event
         # object
         if SENT_LIST_KEY in event.keys():
@@ -81,88 +218,341 @@ def lambda_handler(event, context) -> None:
                 batch_size = int(event["BATCH_SIZE"])
         # When invoked by the api the lambda is passed the sent_list in the body of the event object
         if "body" in event.keys():
-            body = json.loads(event["body"])
+            body = decode_request_body(event)
+            request_fields |= body
             if SENT_LIST_KEY in body.keys():
                 full_sent_list = body[SENT_LIST_KEY]
             # Makes testing efficient batch sizes easier
             if "BATCH_SIZE" in body.keys():
                 batch_size = int(body["BATCH_SIZE"])
+        if JOB_ACTION_KEY in request_fields.keys():
+            return handle_job_action(
+                request_fields, full_sent_list, batch_size, context
+            )
         processed_sents = {}
         # If a sent list has been passed in, continue
         if full_sent_list is not None and len(full_sent_list) > 0:
-            # We don't want to waste compute by re-processing the same sents
-            full_sent_list = list(set(full_sent_list))
             logger.info("Recieved event %s", full_sent_list[0])
-            # Process in batches to reduce memory load when running as lambda. Very important
-            # for reducing load when processing a batch of sents with the model
-            for i in range(len(full_sent_list) // batch_size + 1):
-                sent_batch = full_sent_list[
-                    i * batch_size : i * batch_size + batch_size
-                ]
-                if len(sent_batch) > 0:
-                    # Prepare sents for processing by the model by handling non-ascii chars
-                    normalised_sent_batch = [
-                        normalise_sent(single_sent) for single_sent in sent_batch
-                    ]
-                    # Check if the normalised sents have already been processed in the database
-                    # Use a list of indexes for unprocessed sents so we can keep track of
-                    # corresponding original sents and normalised sents
-                    old_processed_sents, unprocessed_sent_indexes = (
-                        check_sent_collection(
-                            db_handler, sent_batch, normalised_sent_batch
-                        )
-                    )
-                    # Get processed sents from unprocessed sents, and record to the database
-                    new_processed_sents = process_sents(
-                        unprocessed_sent_indexes,
-                        sent_batch,
-                        normalised_sent_batch,
-                    )
-                    # Merge processed sentence dictionaries
-                    processed_sents = (
-                        processed_sents | old_processed_sents | new_processed_sents
-                    )
-        res = {
-            "statusCode": 200,
-            "headers": {"Content-Type": "application/json"},
-            "isBase64Encoded": False,
-            "body": json.dumps(processed_sents),
-        }
-        return res
+            try:
+                processed_sents = process_request(full_sent_list, batch_size)
+            finally:
+                # The environment is frozen once the lambda returns, so buffered writes must
+                # go out now
+                with get_metrics().time("flush"):
+                    write_buffer.flush()
+            logger.info("Result cache stats %s", result_cache.stats())
+            if disk_cache is not None:
+                logger.info("Disk cache stats %s", disk_cache.stats())
+            logger.info("Write buffer stats %s", write_buffer.stats())
+            if db_handler.membership_index is not None:
+                logger.info(
+                    "Bloom filter stats %s", db_handler.membership_index.stats()
+                )
+        response_format, compress = get_response_options(event, request_fields)
+        if response_format == RESPONSE_FORMAT_POSITIONAL:
+            # Bulk callers know the order they sent, so the sents don't need echoing back
+            return make_json_response(
+                200,
+                [processed_sents[sent] for sent in full_sent_list or []],
+                compress,
+            )
+        # Callers which haven't asked for a wire format get the same bytes as always
+        return make_json_response(200, processed_sents, compress, compact=compress)
 
     except Exception as e:
         print(str(e))
         return {"statusCode": 500, "body": {"event": event, "exception": str(e)}}
 
 
-def process_sents(unprocessed_sent_indexes, sent_batch, normalised_sent_batch):
-    """Process new sents, add them to the database and return a dictionary of
-        original_sent : processed sents
+def make_json_response(status_code, payload, compress=False, compact=True):
+    """Return a lambda response with a json body
+
+    Args:
+        status_code (int): HTTP status code
+        payload (object): json serializable body
+        compress (bool): Whether the caller asked for a gzip compressed body
+        compact (bool): Whether to use compact json rather than the original formatting
+
+    Returns:
+        Dict: The lambda response
+    """
+    body, is_base64_encoded, headers = encode_response_body(payload, compress, compact)
+    return {
+        "statusCode": status_code,
+        "headers": headers,
+        "isBase64Encoded": is_base64_encoded,
+        "body": body,
+    }
+
+
+def handle_job_action(request_fields, full_sent_list, batch_size, context):
+    """Submit, run, or report on an asynchronous job
+
+    Args:
+        request_fields (Dict): Fields of the event and its body
+        full_sent_list (str[]): List of original sents, for a job submission
+        batch_size (int): Maximum number of unprocessed sents tokenized together
+        context (LambdaContext): Lambda context, or None when run locally
+
+    Returns:
+        Dict: The lambda response
+    """
+    action = request_fields[JOB_ACTION_KEY]
+    if action == JOB_ACTION_SUBMIT:
+        if full_sent_list is None:
+            return make_json_response(400, {"error": "No sent list to submit"})
+        job = job_store.create_job(full_sent_list, JOB_CHUNK_SIZE, JOB_MAX_CHUNK_BYTES)
+        continue_job(job["_id"], batch_size, context)
+        return make_json_response(202, get_job_status(job))
+    job = job_store.get_job(request_fields.get(JOB_ID_KEY))
+    if job is None:
+        return make_json_response(404, {"error": "Unknown job"})
+    if action == JOB_ACTION_STATUS:
+        return make_json_response(200, get_job_status(job))
+    if action == JOB_ACTION_RESULTS:
+        start_chunk = request_fields.get(JOB_PAGE_KEY, 0)
+        if start_chunk is None:
+            # The next_chunk of the last page, there are no more results
+            return make_json_response(
+                200, get_job_status(job) | {"results": {}, JOB_PAGE_KEY: None}
+            )
+        try:
+            start_chunk = int(start_chunk)
+        except (TypeError, ValueError):
+            return make_json_response(
+                400, {"error": f"Invalid {JOB_PAGE_KEY} {start_chunk}"}
+            )
+        results, next_chunk = job_store.get_results_page(
+            job["_id"], start_chunk, JOB_RESULTS_PAGE_CHUNKS
+        )
+        return make_json_response(
+            200,
+            get_job_status(job) | {"results": results, JOB_PAGE_KEY: next_chunk},
+        )
+    if action == JOB_ACTION_RUN:
+        # Remaining time is unlimited when run locally without a context
+        chunks_processed, out_of_time = run_job(
+            job_store,
+            job["_id"],
+            lambda sents: process_job_chunk(sents, batch_size),
+            lambda: None if context is None else context.get_remaining_time_in_millis(),
+            JOB_MIN_REMAINING_MS,
+            JOB_LEASE_POLL_SECONDS,
+        )
+        if out_of_time:
+            continue_job(job["_id"], batch_size, context)
+        return make_json_response(
+            200,
+            get_job_status(job_store.get_job(job["_id"]))
+            | {"chunks_processed": chunks_processed},
+        )
+    return make_json_response(400, {"error": f"Unknown action {action}"})
+
+
+def get_job_status(job):
+    """Return the fields of a job document reported to callers
+
+    Args:
+        job (Dict): The job document
+
+    Returns:
+        Dict: The job's ID, status and progress
+    """
+    return {
+        JOB_ID_KEY: job["_id"],
+        "status": job["status"],
+        "total_sents": job["total_sents"],
+        "total_chunks": job["total_chunks"],
+        "done_chunks": job["done_chunks"],
+        "error": job["error"],
+    }
+
+
+def continue_job(job_id, batch_size, context):
+    """Invoke this lambda again asynchronously to run a job, if self invocation is enabled and
+    the lambda knows its own ARN
 
     Args:
-        unprocessed_sent_indexes (int[]): Indexes of unprocessed sents in sent_batch and
-                                           normalised_sent_batch
-        sent_batch (str[]): batch of original sents
-        normalised_sent_batch (str[]): batch of normalised sents
+        job_id (string): ID of the job
+        batch_size (int): Maximum number of unprocessed sents tokenized together
+        context (LambdaContext): Lambda context, or None when run locally
+    """
+    global lambda_client
+    if context is None or not get_env_flag(
+        ENV_JOB_SELF_INVOKE_VAR_NAME, DEFAULT_JOB_SELF_INVOKE
+    ):
+        return
+    if lambda_client is None:
+        lambda_client = boto3.client("lambda")
+    invoke_async(
+        lambda_client,
+        context.invoked_function_arn,
+        {JOB_ACTION_KEY: JOB_ACTION_RUN, JOB_ID_KEY: job_id, "BATCH_SIZE": batch_size},
+    )
+
+
+def process_job_chunk(full_sent_list, batch_size):
+    """Process one chunk of a job, making sure its new sents are stored before the chunk is
+    recorded as done
+
+    Args:
+        full_sent_list (str[]): List of original sents in the chunk
+        batch_size (int): Maximum number of unprocessed sents tokenized together
 
     Returns:
         Dict: a dictionary of original_sent : processed sents
     """
+    try:
+        return process_request(full_sent_list, batch_size)
+    finally:
+        write_buffer.flush()
+
+
+def process_request(full_sent_list, batch_size):
+    """Process every sent in a request, looking up previously processed sents first and only
+    running the model on the rest
+
+    Args:
+        full_sent_list (str[]): List of original sents in the request
+        batch_size (int): Maximum number of unprocessed sents tokenized together
+
+    Returns:
+        Dict: a dictionary of original_sent : processed sents
+    """
+    # Normalise every sent once, up front. Sents which only differ in case, emoji or accents
+    # share a normalised sent, so we don't waste compute by processing them more than once
+    metrics = get_metrics()
+    with metrics.time("normalise"):
+        grouped_sents = group_sents_by_normalised(full_sent_list)
+    normalised_sents = list(grouped_sents.keys())
+    metrics.count("sents", len(full_sent_list))
+    metrics.count("unique_sents", len(normalised_sents))
+    if get_env_flag(ENV_TRACK_SENT_HITS_VAR_NAME, DEFAULT_TRACK_SENT_HITS):
+        # Counted for every sent, wherever it's found, to pick the disk cache's hot set
+        write_buffer.add_hits(normalised_sents)
+    if get_env_flag(ENV_PIPELINE_MODE_VAR_NAME, DEFAULT_PIPELINE_MODE):
+        normalised_processed_sents = process_sents_pipelined(
+            normalised_sents, batch_size
+        )
+    else:
+        # Check if the normalised sents have already been processed with one bulk lookup
+        with metrics.time("lookup"):
+            known_processed_sents, unprocessed_sents = check_sent_collection(
+                db_handler, normalised_sents, result_cache, disk_cache
+            )
+        new_processed_sents = process_sent_batches(
+            unprocessed_sents, batch_size, store_processed_sents
+        )
+        normalised_processed_sents = known_processed_sents | new_processed_sents
+    # Fan the results back out to every original spelling of each normalised sent
+    return {
+        original_sent: normalised_processed_sents[normalised_sent]
+        for normalised_sent, original_sents in grouped_sents.items()
+        for original_sent in original_sents
+    }
+
+
+def process_sents_pipelined(normalised_sents, batch_size):
+    """Process sents in chunks, looking up the next chunk in the background while the model
+    runs on the current one, and writing results to the database on background threads
+
+    Args:
+        normalised_sents (str[]): List of unique normalised sents
+        batch_size (int): Maximum number of unprocessed sents tokenized together
+
+    Returns:
+        Dict: a dictionary of normalised_sent : processed sents
+    """
+    sent_chunks = [
+        normalised_sents[i : i + PIPELINE_CHUNK_SIZE]
+        for i in range(0, len(normalised_sents), PIPELINE_CHUNK_SIZE)
+    ]
+    normalised_processed_sents = {}
+    # The writer joins every write before returning, so failures surface as they do serially
+    with BackgroundWriter(
+        store_processed_sents, PIPELINE_WRITE_WORKERS, PIPELINE_MAX_PENDING_WRITES
+    ) as writer:
+        for known_processed_sents, unprocessed_sents in prefetch_map(
+            lambda sent_chunk: lookup_sent_chunk(sent_chunk),
+            sent_chunks,
+            PIPELINE_PREFETCH_DEPTH,
+        ):
+            new_processed_sents = process_sent_batches(
+                unprocessed_sents, batch_size, writer.submit
+            )
+            normalised_processed_sents |= known_processed_sents | new_processed_sents
+    return normalised_processed_sents
+
+
+def lookup_sent_chunk(normalised_sents):
+    """Check the cache and database for a chunk of sents, timed as the lookup stage
+
+    Args:
+        normalised_sents (str[]): List of unique normalised sents
+
+    Returns:
+        Tuple: The processed and unprocessed sents found by check_sent_collection
+    """
+    with get_metrics().time("lookup"):
+        return check_sent_collection(
+            db_handler, normalised_sents, result_cache, disk_cache
+        )
+
+
+def process_sent_batches(unprocessed_sents, batch_size, store_func):
+    """Process new sents in batches, passing the results of each batch to store_func
+
+    Args:
+        unprocessed_sents (str[]): List of unprocessed normalised sents
+        batch_size (int): Maximum number of unprocessed sents tokenized together
+        store_func (callable): Function called with each batch's dictionary of results
+
+    Returns:
+        Dict: a dictionary of normalised_sent : processed sents
+    """
+    # The model handler tokenizes each batch once and splits it into model batches by
+    # MAX_BATCH_TOKENS, so the whole list is normally passed at once. batch_size only caps the
+    # memory held by one tokenized batch and its results
+    new_processed_sents = {}
+    metrics = get_metrics()
+    for i in range(0, len(unprocessed_sents), batch_size):
+        batch_start = time.perf_counter()
+        batch_processed_sents = process_sents(unprocessed_sents[i : i + batch_size])
+        with metrics.time("store"):
+            store_func(batch_processed_sents)
+        new_processed_sents |= batch_processed_sents
+        metrics.observe("batch_ms", (time.perf_counter() - batch_start) * 1000)
+    return new_processed_sents
+
+
+def process_sents(normalised_sents):
+    """Process new sents and return a dictionary of normalised_sent : processed sents
+
+    Args:
+        normalised_sents (str[]): batch of unprocessed normalised sents
+
+    Returns:
+        Dict: a dictionary of normalised_sent : processed sents
+    """
     new_processed_sents_dict = {}
-    if len(unprocessed_sent_indexes) > 0:
-        # We use the indexes in unprocessed_sent_indexes to find the unprocessed sentences in
-        # sent_batch and normalised_sent_batch
-        new_normalised_sents = [
-            normalised_sent_batch[index] for index in unprocessed_sent_indexes
-        ]
-        new_original_sents = [sent_batch[index] for index in unprocessed_sent_indexes]
+    if len(normalised_sents) > 0:
+        model_handler = model_loader.get_model_handler(MODEL_READY_TIMEOUT_SECONDS)
         # Tokenize, process and detokenize sents to get processed sents
-        new_processed_sents = model_handler.generate_processed_sents(
-            new_normalised_sents
-        )
-        db_handler.store_sents(new_normalised_sents, new_processed_sents)
-        new_processed_sents_dict = {
-            new_original_sents[index]: processed_sent
-            for index, processed_sent in enumerate(new_processed_sents)
-        }
+        with get_metrics().time("inference"):
+            new_processed_sents = model_handler.generate_processed_sents(
+                normalised_sents
+            )
+        new_processed_sents_dict = dict(zip(normalised_sents, new_processed_sents))
+        result_cache.put_many(new_processed_sents_dict)
+        if disk_cache is not None:
+            disk_cache.put_many(new_processed_sents_dict)
     return new_processed_sents_dict
+
+
+def store_processed_sents(processed_sents):
+    """Buffer processed sents to be recorded to the database
+
+    Args:
+        processed_sents (Dict): a dictionary of normalised_sent : processed sents
+    """
+    write_buffer.add_many(processed_sents)
@@ -1,6 +1,32 @@
 """The module containing important and shared constant values"""
 
-DEFAULT_BATCH_SIZE = 30
+# Maximum number of new sents tokenized together and stored as one batch. The model batches
+# within it are sized by MAX_BATCH_TOKENS, so this only needs to cap the memory held by one
+# tokenized batch and its results
+DEFAULT_BATCH_SIZE = 1000
+# Lazy model loading downloads and loads the model on a background thread, so requests which
+# are fully cached can be answered during a cold start. Requests needing the model wait up to
+# MODEL_READY_TIMEOUT_SECONDS for it. The LAZY_MODEL_LOAD env variable overrides this
+DEFAULT_LAZY_MODEL_LOAD = False
+MODEL_READY_TIMEOUT_SECONDS = 240
+# A failed background load is retried by the next request needing the model, waiting at least
+# MODEL_LOAD_RETRY_BASE_SECONDS after the first failure, doubling up to the max after each one
+MODEL_LOAD_RETRY_BASE_SECONDS = 5
+MODEL_LOAD_RETRY_MAX_SECONDS = 120
+# Pipelined mode overlaps the lookup of the next chunk of sents with inference on the current
+# chunk, and writes results to the database on background threads. The PIPELINE_MODE env
+# variable overrides this
+DEFAULT_PIPELINE_MODE = False
+# Number of sents looked up at once in pipelined mode
+PIPELINE_CHUNK_SIZE = 300
+# Number of chunks looked up ahead of the chunk being processed
+PIPELINE_PREFETCH_DEPTH = 1
+PIPELINE_WRITE_WORKERS = 2
+# Maximum number of batches waiting to be written to the database
+PIPELINE_MAX_PENDING_WRITES = 4
+# Maximum number of padded tokens the model processes in one forward pass. Sents are sorted by
+# token length before batching, so short sents are not padded out to the length of a long one
+MAX_BATCH_TOKENS = 4096
 
 # Names of environment variables set by a .env file, or the SAM config
 ENV_URI_VAR_NAME = "MONGODB_URI"
@@ -9,23 +35,273 @@ ENV_PASS_VAR_NAME = "MONGODB_PASS"
 ENV_DB_VAR_NAME = "MONGODB_DB_NAME"
 ENV_HOST_VAR_NAME = "MONGODB_HOST"
 ENV_BUCKET_VAR_NAME = "BUCKET_NAME"
+ENV_INFERENCE_MODE_VAR_NAME = "INFERENCE_MODE"
+ENV_PIPELINE_MODE_VAR_NAME = "PIPELINE_MODE"
+ENV_LAZY_MODEL_LOAD_VAR_NAME = "LAZY_MODEL_LOAD"
+ENV_REMOTE_MODEL_LOCK_VAR_NAME = "REMOTE_MODEL_LOCK"
+ENV_MODEL_LOAD_FORMAT_VAR_NAME = "MODEL_LOAD_FORMAT"
+ENV_SAFETENSORS_CHECKPOINT_VAR_NAME = "SAFETENSORS_CHECKPOINT"
+ENV_INFERENCE_BACKEND_VAR_NAME = "INFERENCE_BACKEND"
+ENV_INFERENCE_WORKERS_VAR_NAME = "INFERENCE_WORKERS"
+ENV_COALESCE_WAIT_MS_VAR_NAME = "COALESCE_WAIT_MS"
+ENV_SENTS_DB_LAYOUT_VAR_NAME = "SENTS_DB_LAYOUT"
+ENV_SENT_BLOOM_FILTER_VAR_NAME = "SENT_BLOOM_FILTER"
+ENV_JOB_SELF_INVOKE_VAR_NAME = "JOB_SELF_INVOKE"
+ENV_METRICS_VAR_NAME = "METRICS"
+ENV_SERVER_TIMING_VAR_NAME = "SERVER_TIMING"
+ENV_STARTUP_PROFILE_VAR_NAME = "STARTUP_PROFILE"
+ENV_DISK_CACHE_VAR_NAME = "DISK_CACHE"
+ENV_TRACK_SENT_HITS_VAR_NAME = "TRACK_SENT_HITS"
+ENV_MONGO_READ_PREFERENCE_VAR_NAME = "MONGO_READ_PREFERENCE"
+
+# Per request stage timings and counters, printed as a CloudWatch embedded metric format line.
+# The METRICS env variable overrides this. With SERVER_TIMING set as well, the stage timings are
+# also returned in a Server-Timing response header
+DEFAULT_METRICS = False
+DEFAULT_SERVER_TIMING = False
+METRICS_NAMESPACE = "NlpDemoLambda"
+METRICS_SERVICE_NAME = "nlp-demo-lambda"
+
+# The startup profiler times each phase of a cold start and every import, and prints one json
+# report once the model is loaded. The STARTUP_PROFILE env variable overrides this
+DEFAULT_STARTUP_PROFILE = False
+# Number of the slowest modules and packages listed in the startup report
+STARTUP_PROFILE_TOP_IMPORTS = 30
+
+# Number of normalised sents containing non ascii characters memoized by normalise_sents
+NORMALISE_CACHE_SIZE = 50000
 
 # Key for sents to process, expected in the event object
 SENT_LIST_KEY = "sent_list"
 
+# Wire formats. Request bodies may be gzip compressed (Content-Encoding: gzip), and may be
+# newline delimited json with one json string sent per line (Content-Type: application/x-ndjson).
+# A response is a dictionary of original sent : processed sent by default, or with the
+# RESPONSE_FORMAT_KEY field or header set to "positional", a list of processed sents in the
+# order of the sent list. Responses are gzip compressed once they reach WIRE_GZIP_MIN_BYTES for
+# requests asking for it with the RESPONSE_ENCODING_KEY field or header set to "gzip".
+# Accept-Encoding alone isn't enough, as most http clients send it by default and would get a
+# base64 body back
+RESPONSE_FORMAT_KEY = "response_format"
+RESPONSE_FORMAT_HEADER = "x-response-format"
+RESPONSE_ENCODING_KEY = "response_encoding"
+RESPONSE_ENCODING_HEADER = "x-response-encoding"
+RESPONSE_FORMAT_MAP = "map"
+RESPONSE_FORMAT_POSITIONAL = "positional"
+CONTENT_ENCODING_GZIP = "gzip"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
+WIRE_GZIP_MIN_BYTES = 1024
+
+# Sent lists too large for one invocation are processed as asynchronous jobs. The event's
+# JOB_ACTION_KEY selects what to do with a job, the other job fields are identified by JOB_ID_KEY
+# and JOB_PAGE_KEY
+JOB_ACTION_KEY = "action"
+JOB_ID_KEY = "job_id"
+JOB_PAGE_KEY = "next_chunk"
+JOB_ACTION_SUBMIT = "submit_job"
+JOB_ACTION_STATUS = "job_status"
+JOB_ACTION_RESULTS = "job_results"
+JOB_ACTION_RUN = "run_job"
+MONGO_JOB_COLLECTION = "nlp_jobs"
+MONGO_JOB_CHUNK_COLLECTION = "nlp_job_chunks"
+# Each job chunk is processed, checkpointed and paged through as a unit
+JOB_CHUNK_SIZE = 500
+JOB_MAX_CHUNK_BYTES = 4 * 1024 * 1024
+JOB_RESULTS_PAGE_CHUNKS = 4
+# An invocation stops claiming chunks when it has less than this much time left. It must cover
+# processing one chunk, including a cold model load
+JOB_MIN_REMAINING_MS = 90000
+# A claimed chunk is reserved for this long, after which another invocation may take it over
+JOB_CHUNK_LEASE_SECONDS = 300
+# A chunk leased by an invocation which timed out or crashed is only free once its lease runs
+# out, so invocations with nothing else to claim check on leased chunks this often, and invoke
+# the lambda again if they run out of time first
+JOB_LEASE_POLL_SECONDS = 10
+JOB_MAX_CHUNK_ATTEMPTS = 3
+# Submitting a job, or running out of time while running one, invokes this lambda again
+# asynchronously to carry on. Without it, run_job must be invoked until the job is done. The
+# JOB_SELF_INVOKE env variable overrides this
+DEFAULT_JOB_SELF_INVOKE = True
+
 # Location of writeable memory
 WRITEABLE_DIR = "/tmp/"
 # filename of model on s3 bucket
 SENT_MODEL_NAME = "t5-base-finetuned-emotion"
 SENT_MODEL_FILE = SENT_MODEL_NAME + ".zip"
-MODEL_ZIP_LOCATION = WRITEABLE_DIR + SENT_MODEL_FILE
 MODEL_CHECKPOINT = WRITEABLE_DIR + SENT_MODEL_NAME
+# The model zip is extracted here before being moved to MODEL_CHECKPOINT
+MODEL_STAGING_DIR = WRITEABLE_DIR + SENT_MODEL_NAME + ".partial"
+# Written into MODEL_CHECKPOINT, records the ETag of the zip and the size and crc32 of each file
+MODEL_MANIFEST_FILE = ".model_manifest.json"
+# Checking the crc32 of every file reads the whole model, so by default only sizes are checked
+MODEL_VERIFY_CHECKSUMS = False
+# The model zip is fetched in ranges of this size, with this many ranges fetched in parallel
+MODEL_DOWNLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+MODEL_DOWNLOAD_WORKERS = 8
+# Model load formats. "pretrained" loads the downloaded checkpoint with from_pretrained, which
+# copies every weight. "safetensors_mmap" converts the checkpoint to safetensors once, then
+# memory maps the weights without copying them. The MODEL_LOAD_FORMAT env variable overrides this
+MODEL_LOAD_FORMAT_PRETRAINED = "pretrained"
+MODEL_LOAD_FORMAT_SAFETENSORS_MMAP = "safetensors_mmap"
+DEFAULT_MODEL_LOAD_FORMAT = MODEL_LOAD_FORMAT_PRETRAINED
+# Location of the converted checkpoint. The SAFETENSORS_CHECKPOINT env variable can point to a
+# checkpoint converted ahead of time and baked into the image instead
+SAFETENSORS_CHECKPOINT = MODEL_CHECKPOINT + "-safetensors"
+# Inference backends. "torch" runs the fp32 model, "torch_int8" applies dynamic int8
+# quantization to its linear layers, and "onnx" exports the model to ONNX Runtime, which needs
+# optimum[onnxruntime] installed. The INFERENCE_BACKEND env variable overrides this
+INFERENCE_BACKEND_TORCH = "torch"
+INFERENCE_BACKEND_TORCH_INT8 = "torch_int8"
+INFERENCE_BACKEND_ONNX = "onnx"
+DEFAULT_INFERENCE_BACKEND = INFERENCE_BACKEND_TORCH
+# Location of the exported ONNX checkpoint
+ONNX_CHECKPOINT = MODEL_CHECKPOINT + "-onnx"
+# Number of worker processes inference is sharded across, 0 runs inference on the calling
+# thread. The workers are forked from a process forked at import, before any other thread is
+# started. The INFERENCE_WORKERS env variable overrides this
+DEFAULT_INFERENCE_WORKERS = 0
+# Torch intra-op threads in each worker. Each worker is pinned to this many CPUs
+INFERENCE_WORKER_THREADS = 1
+# Concurrent invocations in one process can have their sents coalesced into a single batch.
+# The first caller waits up to this many milliseconds for others to join, 0 turns coalescing
+# off. The COALESCE_WAIT_MS env variable overrides this
+DEFAULT_COALESCE_WAIT_MS = 0
+# Number of sents which runs a coalesced batch without waiting any longer
+COALESCE_MAX_BATCH_SIZE = 64
+# Labels the model can output. The model only needs one decoder step to pick one of these
+SENT_MODEL_LABELS = ["sadness", "joy", "love", "anger", "fear", "surprise"]
+
+# Inference modes. "generate" runs model.generate, "label_scoring" runs a single encoder and
+# decoder step and picks the most likely label. The INFERENCE_MODE env variable overrides this
+INFERENCE_MODE_GENERATE = "generate"
+INFERENCE_MODE_LABEL_SCORING = "label_scoring"
+DEFAULT_INFERENCE_MODE = INFERENCE_MODE_GENERATE
 
 # Mongodb collection name
 MONGO_COLLECTION = "nlp_processed_sents"
 # Mongodb column names
 SENTS_DB_NORM_KEY = "normalised_sent"
 SENTS_DB_PROC_KEY = "processed_sent"
+# Number of requests which included a sent, counted when TRACK_SENT_HITS is set. Used to export
+# the most requested sents to the disk cache's hot set
+SENTS_DB_HITS_KEY = "hits"
+DEFAULT_TRACK_SENT_HITS = False
+
+# Layouts for the processed sents collection. "text" looks sents up by the full normalised sent.
+# "hashed" uses a separate collection keyed by a fixed width hash of the normalised sent in _id,
+# which keeps the index and the lookup queries small. The SENTS_DB_LAYOUT env variable
+# overrides this
+SENTS_DB_LAYOUT_TEXT = "text"
+SENTS_DB_LAYOUT_HASHED = "hashed"
+DEFAULT_SENTS_DB_LAYOUT = SENTS_DB_LAYOUT_TEXT
+MONGO_HASHED_COLLECTION = "nlp_processed_sents_hashed"
+SENTS_DB_HASH_BYTES = 16
+# Short field names for the hashed layout, as they're repeated in every document
+SENTS_DB_HASHED_PROC_KEY = "p"
+SENTS_DB_HASHED_TEXT_KEY = "t"
+SENTS_DB_HASHED_HITS_KEY = "h"
+# Storing the normalised sent lets lookups detect hash collisions, at the cost of larger
+# documents. It isn't indexed or sent in queries either way
+SENTS_DB_HASHED_STORE_TEXT = True
+# Collection recording the progress of collection migrations
+MONGO_MIGRATION_COLLECTION = "migrations"
+# A resumed migration rescans documents created up to this many seconds before its recorded
+# position. ObjectIds are generated by many hosts with their own clocks, so documents written
+# around the time of the last run can sort before the position it recorded
+MIGRATION_RESUME_MARGIN_SECONDS = 600
+# A bloom filter of the keys in the sents collection lets lookups skip sents which definitely
+# haven't been processed. It's loaded from a snapshot in MONGO_BLOOM_COLLECTION, or built by
+# scanning the collection, on a background thread, and every key is looked up until it's ready.
+# The filter is rebuilt every SENT_BLOOM_REBUILD_SECONDS. The SENT_BLOOM_FILTER env variable
+# overrides this
+DEFAULT_SENT_BLOOM_FILTER = False
+MONGO_BLOOM_COLLECTION = "bloom_snapshots"
+# The filter is sized for at least this many keys, at this false positive rate, and twice the
+# keys in the collection when it's rebuilt. 2 million keys at 1% is a 2.4MB filter. It's capped
+# at SENT_BLOOM_MAX_BYTES so its snapshot fits in a 16MB document, which is about 6.5 million
+# keys at 1%. The false positive rate rises past that
+SENT_BLOOM_CAPACITY = 2000000
+SENT_BLOOM_ERROR_RATE = 0.01
+SENT_BLOOM_MAX_BYTES = 15 * 1024 * 1024
+SENT_BLOOM_REBUILD_SECONDS = 3600
+# Each lambda adds the digests of the sents it stores to a log in MONGO_BLOOM_LOG_COLLECTION,
+# and adds the log's new entries to its filter every SENT_BLOOM_SYNC_SECONDS. Sents are only
+# skipped while the filter caught up within SENT_BLOOM_MAX_LAG_SECONDS, so sents stored by other
+# lambdas aren't processed again. Entries are read again for SENT_BLOOM_LOG_MARGIN_SECONDS, to
+# catch late writes and clock skew between lambdas, and expire after SENT_BLOOM_LOG_TTL_SECONDS
+MONGO_BLOOM_LOG_COLLECTION = "bloom_log"
+SENT_BLOOM_SYNC_SECONDS = 2
+SENT_BLOOM_MAX_LAG_SECONDS = 5
+SENT_BLOOM_LOG_MARGIN_SECONDS = 60
+SENT_BLOOM_LOG_TTL_SECONDS = 3 * SENT_BLOOM_REBUILD_SECONDS
+# Only one lambda rebuilds a stale filter, holding a lease lock in MONGO_LOCK_COLLECTION which
+# must outlast a full collection scan. The others check for its snapshot every
+# SENT_BLOOM_POLL_SECONDS
+SENT_BLOOM_REBUILD_LOCK_PREFIX = "bloom_rebuild:"
+SENT_BLOOM_REBUILD_LEASE_SECONDS = 900
+SENT_BLOOM_POLL_SECONDS = 60
+# Limits for the sents sent in a single $in query. MongoDB rejects query documents over 16MB,
+# so stay well under it
+MONGO_MAX_QUERY_SENTS = 10000
+MONGO_MAX_QUERY_BYTES = 8 * 1024 * 1024
+# MongoClient settings. A lambda serves one request at a time, plus the background writers, so
+# it needs few connections. Idle connections are dropped before the lambda is frozen for long
+# enough that the server or a load balancer closes them under us
+MONGO_MAX_POOL_SIZE = 10
+MONGO_MIN_POOL_SIZE = 1
+MONGO_MAX_IDLE_TIME_MS = 60000
+MONGO_CONNECT_TIMEOUT_MS = 5000
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGO_SOCKET_TIMEOUT_MS = 30000
+# Read preference for sent lookups, any MongoDB read preference mode name. "secondaryPreferred"
+# takes lookups off the primary, at the cost of missing sents stored in the last moments. The
+# MONGO_READ_PREFERENCE env variable overrides this
+DEFAULT_MONGO_READ_PREFERENCE = "primary"
+# Collection recording database wide state, such as which indexes have been created
+MONGO_META_COLLECTION = "meta"
+# Indexes are created once per database, and recorded in MONGO_META_COLLECTION and in a marker
+# file in each sandbox. Increase the version when the index definitions change
+MONGO_INDEX_VERSION = 3
+MONGO_INDEX_MARKER_FILE = WRITEABLE_DIR + ".mongo_indexes"
+# Processed sents are buffered and written to MongoDB in bulk. The buffer is flushed once it
+# holds WRITE_BEHIND_MAX_PENDING sents, every WRITE_BEHIND_FLUSH_SECONDS, and before a lambda
+# returns. The last WRITE_BEHIND_RECENT_KEYS sents written are remembered so repeats are skipped.
+# The sents of a failed flush are kept to retry, up to WRITE_BEHIND_MAX_RETRY_SENTS buffered sents
+WRITE_BEHIND_MAX_PENDING = 500
+WRITE_BEHIND_FLUSH_SECONDS = 2
+WRITE_BEHIND_RECENT_KEYS = 100000
+WRITE_BEHIND_MAX_RETRY_SENTS = 5000
 # Mongodb mutex lock collection name
 MONGO_LOCK_COLLECTION = "lock_collection"
 MONGO_LOCK_ID = 1
+# A held lock expires after its lease, so a sandbox that dies while holding it can't block the
+# others. The lease must outlast a model download
+MONGO_LOCK_LEASE_SECONDS = 300
+MONGO_LOCK_MAX_WAIT_SECONDS = 280
+# Retries back off exponentially from the base delay, up to the max delay, with random jitter
+MONGO_LOCK_BASE_DELAY_SECONDS = 0.2
+MONGO_LOCK_MAX_DELAY_SECONDS = 5
+
+# Name of the lock around the model download. It's always locked within the sandbox, and also
+# locked across every sandbox through MongoDB when the REMOTE_MODEL_LOCK env variable is set
+MODEL_LOCK_NAME = "model_download"
+DEFAULT_REMOTE_MODEL_LOCK = False
+
+# In-memory result cache, shared between warm invocations. Entries are evicted least recently
+# used first once either limit is reached. A TTL of None keeps entries until they are evicted
+RESULT_CACHE_MAX_ENTRIES = 100000
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL_SECONDS = None
+# sqlite cache of processed sents on disk, checked after the in-memory cache and before MongoDB.
+# It outlives the process, and is seeded from a hot set snapshot of the most requested sents,
+# found next to app.py in the image or next to the model zip in the s3 bucket. Least recently
+# used entries are evicted, DISK_CACHE_EVICT_FRACTION of them at a time, once it holds
+# DISK_CACHE_MAX_ENTRIES. The DISK_CACHE env variable overrides this
+DEFAULT_DISK_CACHE = False
+DISK_CACHE_FILE = WRITEABLE_DIR + "processed_sents.sqlite3"
+DISK_CACHE_MAX_ENTRIES = 500000
+DISK_CACHE_EVICT_FRACTION = 0.1
+HOT_SET_FILE = "hot_set.ndjson.gz"
+HOT_SET_DOWNLOAD_PATH = WRITEABLE_DIR + HOT_SET_FILE
+# Number of sents exported to the hot set by default
+HOT_SET_SIZE = 100000
@@ -0,0 +1,120 @@
+"""The module for the inference backends the model can be run with. Each backend loads the
+model into an object with the same generate and forward call interface as a transformers model,
+so ModelHandler doesn't need to know which backend it's using"""
+
+import logging
+
+import torch
+from transformers import AutoModelWithLMHead
+
+from config.config import (
+    INFERENCE_BACKEND_ONNX,
+    INFERENCE_BACKEND_TORCH,
+    INFERENCE_BACKEND_TORCH_INT8,
+    MODEL_CHECKPOINT,
+    MODEL_LOAD_FORMAT_SAFETENSORS_MMAP,
+    ONNX_CHECKPOINT,
+    WRITEABLE_DIR,
+)
+from utils.checkpoint_utils import (
+    is_converted,
+    load_mmap_model,
+    write_converted_checkpoint,
+)
+
+logger = logging.getLogger()
+
+
+def load_torch_model(checkpoint, load_format):
+    """Load the fp32 PyTorch model
+
+    Args:
+        checkpoint (string): Directory of the checkpoint to load
+        load_format (string): Format of the checkpoint, see MODEL_LOAD_FORMAT_*
+
+    Returns:
+        model (PreTrainedModel): The loaded model
+    """
+    if load_format == MODEL_LOAD_FORMAT_SAFETENSORS_MMAP:
+        return load_mmap_model(checkpoint)
+    return AutoModelWithLMHead.from_pretrained(
+        checkpoint, cache_dir=WRITEABLE_DIR, local_files_only=True
+    ).eval()
+
+
+def load_quantized_torch_model(checkpoint, load_format):
+    """Load the PyTorch model with its linear layers quantized to int8. Weights are quantized
+    once at load time, and activations are quantized on the fly for each batch
+
+    Args:
+        checkpoint (string): Directory of the checkpoint to load
+        load_format (string): Format of the checkpoint, see MODEL_LOAD_FORMAT_*
+
+    Returns:
+        model (PreTrainedModel): The quantized model
+    """
+    model = load_torch_model(checkpoint, load_format)
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def load_onnx_model(checkpoint, load_format):
+    """Load the model with ONNX Runtime, exporting the downloaded checkpoint to ONNX the first
+    time it's used. The export always starts from the downloaded checkpoint, so load_format
+    is ignored
+
+    Args:
+        checkpoint (string): Unused
+        load_format (string): Unused
+
+    Returns:
+        model (ORTModelForSeq2SeqLM): The ONNX Runtime model
+    """
+    # optimum is an optional dependency, only needed for this backend
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise ImportError(
+            "The onnx inference backend needs optimum[onnxruntime] installed"
+        ) from e
+
+    if not is_converted(MODEL_CHECKPOINT, ONNX_CHECKPOINT):
+
+        def save_onnx(staging_dir):
+            ORTModelForSeq2SeqLM.from_pretrained(
+                MODEL_CHECKPOINT, export=True, local_files_only=True
+            ).save_pretrained(staging_dir)
+
+        write_converted_checkpoint(MODEL_CHECKPOINT, ONNX_CHECKPOINT, save_onnx)
+        logger.info(
+            "Exported checkpoint %s to ONNX at %s", MODEL_CHECKPOINT, ONNX_CHECKPOINT
+        )
+    return ORTModelForSeq2SeqLM.from_pretrained(ONNX_CHECKPOINT, local_files_only=True)
+
+
+# Backend name : function loading the model for that backend
+INFERENCE_BACKENDS = {
+    INFERENCE_BACKEND_TORCH: load_torch_model,
+    INFERENCE_BACKEND_TORCH_INT8: load_quantized_torch_model,
+    INFERENCE_BACKEND_ONNX: load_onnx_model,
+}
+
+
+def load_backend_model(backend, checkpoint, load_format):
+    """Load the model with the given inference backend
+
+    Args:
+        backend (string): Name of the backend, a key of INFERENCE_BACKENDS
+        checkpoint (string): Directory of the checkpoint to load
+        load_format (string): Format of the checkpoint, see MODEL_LOAD_FORMAT_*
+
+    Returns:
+        model: The loaded model, with generate and forward call methods
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend {backend}, expected one of "
+            f"{list(INFERENCE_BACKENDS.keys())}"
+        )
+    return INFERENCE_BACKENDS[backend](checkpoint, load_format)
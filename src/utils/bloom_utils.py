@@ -0,0 +1,484 @@
+"""The module for a bloom filter of sents known to be in the database, used to skip lookups
+for sents which definitely haven't been processed"""
+
+import datetime
+import hashlib
+import logging
+import math
+import struct
+import threading
+import time
+
+logger = logging.getLogger()
+
+# Snapshot header, the number of bits, number of hashes and number of keys added
+_HEADER = struct.Struct("<QII")
+# Bytes in the digest of a key, which its bit positions are derived from
+DIGEST_BYTES = 16
+
+
+def get_digest(key):
+    """Function returning the digest of a key, which fixes its bit positions in any filter
+
+    Args:
+        key (str or bytes): The key
+
+    Returns:
+        bytes: The DIGEST_BYTES long digest
+    """
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    return hashlib.blake2b(key, digest_size=DIGEST_BYTES).digest()
+
+
+class BloomFilter:
+    """Probabilistic set of keys. A key which was added is always reported as present, a key
+    which wasn't is reported as present with a small false positive probability"""
+
+    def __init__(
+        self, capacity, error_rate, num_bits=None, num_hashes=None, max_bits=None
+    ):
+        """Initialise an empty filter sized for capacity keys at error_rate false positives
+
+        Args:
+            capacity (int): Number of keys the filter is sized for
+            error_rate (float): False positive probability at capacity
+            num_bits (int): Number of bits, overrides the size derived from capacity
+            num_hashes (int): Number of hashes, overrides the count derived from capacity
+            max_bits (int): Maximum number of bits. A filter capped below its derived size has
+                            a higher false positive rate at capacity
+        """
+        if num_bits is None:
+            num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        if max_bits is not None:
+            num_bits = min(num_bits, max_bits)
+        if num_hashes is None:
+            num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = 0
+        self.bits = bytearray(math.ceil(num_bits / 8))
+        self._lock = threading.Lock()
+
+    def _positions(self, digest):
+        """Return the bit positions of a key digest, using double hashing"""
+        hash_a = int.from_bytes(digest[:8], "little")
+        hash_b = int.from_bytes(digest[8:], "little") | 1
+        return [(hash_a + i * hash_b) % self.num_bits for i in range(self.num_hashes)]
+
+    def add_many(self, keys):
+        """Add several keys to the filter
+
+        Args:
+            keys (list): str or bytes keys to add
+        """
+        self.add_digests([get_digest(key) for key in keys])
+
+    def add_digests(self, digests):
+        """Add several keys to the filter by their digests
+
+        Args:
+            digests (bytes[]): Digests of the keys, from get_digest
+        """
+        positions = [self._positions(digest) for digest in digests]
+        with self._lock:
+            for key_positions in positions:
+                for position in key_positions:
+                    self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += len(positions)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(get_digest(key))
+        )
+
+    def estimated_false_positive_rate(self):
+        """Return the expected false positive rate for the number of keys added
+
+        Returns:
+            float: False positive probability
+        """
+        return (
+            1 - math.exp(-self.num_hashes * self.count / self.num_bits)
+        ) ** self.num_hashes
+
+    def to_bytes(self):
+        """Serialize the filter into a compact snapshot
+
+        Returns:
+            bytes: The snapshot
+        """
+        with self._lock:
+            return _HEADER.pack(self.num_bits, self.num_hashes, self.count) + bytes(
+                self.bits
+            )
+
+    @classmethod
+    def from_bytes(cls, snapshot):
+        """Load a filter from a snapshot made by to_bytes
+
+        Args:
+            snapshot (bytes): The snapshot
+
+        Returns:
+            BloomFilter: The loaded filter
+        """
+        num_bits, num_hashes, count = _HEADER.unpack_from(snapshot)
+        bloom_filter = cls(None, None, num_bits, num_hashes)
+        bloom_filter.bits = bytearray(snapshot[_HEADER.size :])
+        bloom_filter.count = count
+        return bloom_filter
+
+
+class SentMembershipIndex:
+    """Class keeping a bloom filter of the keys in a processed sents collection. The filter is
+    loaded from a snapshot in the database, or built by scanning the collection, and rebuilt
+    periodically. A newer snapshot saved by another lambda is loaded in place of rebuilding, and
+    only the lambda holding the rebuild lock scans the collection. Every lambda also appends
+    the digests of the keys it stores to a shared log, and adds the log entries since its filter
+    was built to the filter every few seconds. Keys are only reported as definitely absent while
+    the filter has caught up with the log recently, as between catch ups it's missing the keys
+    stored by other lambdas. Otherwise every key is reported as possibly present
+    """
+
+    def __init__(
+        self,
+        sents_col,
+        key_field,
+        snapshot_col,
+        capacity,
+        error_rate,
+        max_bytes,
+        rebuild_seconds,
+        rebuild_lock,
+        poll_seconds,
+        log_col,
+        sync_seconds,
+        max_lag_seconds,
+        log_margin_seconds,
+        log_ttl_seconds,
+    ):
+        """Initialise the index without loading anything
+
+        Args:
+            sents_col (Collection): Collection of processed sents
+            key_field (string): Field of sents_col holding each sent's key
+            snapshot_col (Collection): Collection holding the filter snapshot
+            capacity (int): Minimum number of keys the filter is sized for
+            error_rate (float): False positive probability at capacity
+            max_bytes (int): Maximum size of the filter, so its snapshot fits in a document
+            rebuild_seconds (float): Age after which the filter is rebuilt from the collection
+            rebuild_lock (MongoLeaseLock): Lock shared by every lambda, held while rebuilding
+            poll_seconds (float): Seconds between checks for a newer snapshot while another
+                                  lambda is rebuilding
+            log_col (Collection): Collection of the digests of recently stored keys, which must
+                                  expire its documents log_ttl_seconds after their created_at
+            sync_seconds (float): Seconds between reads of the log
+            max_lag_seconds (float): Seconds after the last read of the log past which keys are
+                                     no longer reported as definitely absent
+            log_margin_seconds (float): Seconds log entries are read again for, to catch entries
+                                        written late or by a lambda with a clock behind
+            log_ttl_seconds (float): Seconds log entries are kept. A filter built longer ago
+                                     than this can't catch up, and waits to be rebuilt
+        """
+        self.sents_col = sents_col
+        self.key_field = key_field
+        self.snapshot_col = snapshot_col
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_bytes = max_bytes
+        self.rebuild_seconds = rebuild_seconds
+        self.rebuild_lock = rebuild_lock
+        self.poll_seconds = poll_seconds
+        self.log_col = log_col
+        self.sync_seconds = sync_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.log_margin_seconds = log_margin_seconds
+        self.log_ttl_seconds = log_ttl_seconds
+        self.bloom_filter = None
+        self.built_at = None
+        self._lock = threading.Lock()
+        # Time the log was last read from, and the monotonic time of that read. Log entries
+        # created from log_margin_seconds before the read time are read again by the next read
+        self._synced_to = None
+        self._synced_at = None
+        # Dictionary of log entry id : created_at of the entries already added to the filter,
+        # so entries read again aren't counted twice
+        self._seen_log_ids = {}
+        self._sync_wakeup = threading.Event()
+        self._thread = None
+        self.keys_checked = 0
+        self.definite_misses = 0
+        self.false_positives = 0
+        self.round_trips_skipped = 0
+        self.unsynced_lookups = 0
+        self.log_entries_read = 0
+
+    def start(self):
+        """Load or build the filter, and keep it fresh, on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._maintain, name="sent-bloom-filter", daemon=True
+            )
+            self._thread.start()
+
+    def is_synced(self):
+        """Return True if the filter caught up with the log within max_lag_seconds
+
+        Returns:
+            bool: Whether keys missing from the filter are definitely absent
+        """
+        synced_at = self._synced_at
+        return (
+            synced_at is not None
+            and time.monotonic() - synced_at <= self.max_lag_seconds
+        )
+
+    def filter_keys(self, keys):
+        """Return the keys which may be in the collection
+
+        Args:
+            keys (list): Keys being looked up
+
+        Returns:
+            maybe_keys (list): The keys not definitely absent from the collection
+        """
+        bloom_filter = self.bloom_filter
+        if bloom_filter is None:
+            return keys
+        if not self.is_synced():
+            # Such as after the lambda was frozen between invocations, so catch up now
+            self._sync_wakeup.set()
+            with self._lock:
+                self.unsynced_lookups += 1
+            return keys
+        maybe_keys = [key for key in keys if key in bloom_filter]
+        with self._lock:
+            self.keys_checked += len(keys)
+            self.definite_misses += len(keys) - len(maybe_keys)
+        return maybe_keys
+
+    def record_lookup(self, maybe_count, found_count, skipped_round_trip):
+        """Record the outcome of a lookup, to measure the false positive rate
+
+        Args:
+            maybe_count (int): Number of keys the filter reported as possibly present
+            found_count (int): Number of those keys found in the collection
+            skipped_round_trip (bool): Whether the database query was skipped entirely
+        """
+        if not self.is_synced():
+            return
+        with self._lock:
+            self.false_positives += maybe_count - found_count
+            self.round_trips_skipped += int(skipped_round_trip)
+
+    def add_many(self, keys):
+        """Add keys stored by this lambda to the filter, and to the log for the other lambdas.
+        A failure to write the log is logged rather than raised, it only means the other
+        lambdas process those sents again until their next rebuild
+
+        Args:
+            keys (list): Keys of the stored sents
+        """
+        if len(keys) == 0:
+            return
+        digests = [get_digest(key) for key in keys]
+        bloom_filter = self.bloom_filter
+        if bloom_filter is not None:
+            bloom_filter.add_digests(digests)
+        created_at = datetime.datetime.utcnow()
+        try:
+            inserted_id = self.log_col.insert_one(
+                {
+                    "collection": self.sents_col.name,
+                    "digests": b"".join(digests),
+                    "created_at": created_at,
+                }
+            ).inserted_id
+        except Exception:
+            logger.exception("Couldn't add %d keys to the bloom filter log", len(keys))
+            return
+        with self._lock:
+            if self.bloom_filter is bloom_filter:
+                self._seen_log_ids[inserted_id] = created_at
+
+    def stats(self):
+        """Return the index counters
+
+        Returns:
+            stats (Dict): Dictionary of counter name : value
+        """
+        bloom_filter = self.bloom_filter
+        synced = self.is_synced()
+        with self._lock:
+            negatives = self.false_positives + self.definite_misses
+            return {
+                "ready": bloom_filter is not None,
+                "synced": synced,
+                "keys": 0 if bloom_filter is None else bloom_filter.count,
+                "keys_checked": self.keys_checked,
+                "definite_misses": self.definite_misses,
+                "false_positives": self.false_positives,
+                "observed_false_positive_rate": self.false_positives
+                / max(negatives, 1),
+                "estimated_false_positive_rate": (
+                    0
+                    if bloom_filter is None
+                    else bloom_filter.estimated_false_positive_rate()
+                ),
+                "round_trips_skipped": self.round_trips_skipped,
+                "unsynced_lookups": self.unsynced_lookups,
+                "log_entries_read": self.log_entries_read,
+            }
+
+    def load_snapshot(self):
+        """Load the filter from its snapshot in the database, if it's newer than the current one
+
+        Returns:
+            bool: True if a snapshot was loaded
+        """
+        snapshot = self.snapshot_col.find_one(
+            {"_id": self.sents_col.name, "built_at": {"$gt": self.built_at}}
+            if self.built_at is not None
+            else {"_id": self.sents_col.name}
+        )
+        if snapshot is None:
+            return False
+        bloom_filter = BloomFilter.from_bytes(snapshot["filter"])
+        self._install(bloom_filter, snapshot["built_at"])
+        logger.info("Loaded bloom filter snapshot of %d keys", bloom_filter.count)
+        return True
+
+    def rebuild(self):
+        """Build a new filter by scanning the keys of the collection, then save a snapshot"""
+        built_at = datetime.datetime.utcnow()
+        key_count = self.sents_col.estimated_document_count()
+        # Leave room to grow until the next rebuild, within the snapshot's size limit
+        bloom_filter = BloomFilter(
+            max(self.capacity, 2 * key_count),
+            self.error_rate,
+            max_bits=8 * (self.max_bytes - _HEADER.size),
+        )
+        keys = []
+        for doc in self.sents_col.find({}, {self.key_field: 1}).batch_size(10000):
+            keys.append(doc[self.key_field])
+            if len(keys) >= 10000:
+                bloom_filter.add_many(keys)
+                keys = []
+        bloom_filter.add_many(keys)
+        if bloom_filter.estimated_false_positive_rate() > self.error_rate:
+            logger.warning(
+                "Bloom filter of %d keys is capped at %d bytes, with a %.3f false positive rate",
+                bloom_filter.count,
+                self.max_bytes,
+                bloom_filter.estimated_false_positive_rate(),
+            )
+        self._install(bloom_filter, built_at)
+        self.snapshot_col.replace_one(
+            {"_id": self.sents_col.name},
+            {"filter": bloom_filter.to_bytes(), "built_at": built_at},
+            upsert=True,
+        )
+        logger.info("Rebuilt bloom filter of %d keys", bloom_filter.count)
+
+    def sync(self):
+        """Add the log entries written since the filter last caught up to the filter
+
+        Returns:
+            bool: True if the filter caught up with the log
+        """
+        bloom_filter = self.bloom_filter
+        if bloom_filter is None:
+            return False
+        read_at = datetime.datetime.utcnow()
+        read_started = time.monotonic()
+        if (
+            read_at - self.built_at
+        ).total_seconds() > self.log_ttl_seconds - self.log_margin_seconds:
+            # Entries written since the filter was built may have expired
+            return False
+        since = self._synced_to - datetime.timedelta(seconds=self.log_margin_seconds)
+        entries = self.log_col.find(
+            {"collection": self.sents_col.name, "created_at": {"$gte": since}},
+            {"digests": True, "created_at": True},
+        )
+        for entry in entries:
+            with self._lock:
+                if entry["_id"] in self._seen_log_ids:
+                    continue
+                self._seen_log_ids[entry["_id"]] = entry["created_at"]
+                self.log_entries_read += 1
+            digests = entry["digests"]
+            bloom_filter.add_digests(
+                [
+                    digests[start : start + DIGEST_BYTES]
+                    for start in range(0, len(digests), DIGEST_BYTES)
+                ]
+            )
+        with self._lock:
+            if self.bloom_filter is not bloom_filter:
+                return False
+            # Entries created before the next read's window won't be read again
+            forget_before = read_at - datetime.timedelta(
+                seconds=self.log_margin_seconds
+            )
+            self._seen_log_ids = {
+                entry_id: created_at
+                for entry_id, created_at in self._seen_log_ids.items()
+                if created_at >= forget_before
+            }
+            self._synced_to = read_at
+            self._synced_at = read_started
+        return True
+
+    def _install(self, bloom_filter, built_at):
+        """Replace the current filter. It isn't trusted until it has caught up with the log
+        entries written since it was built"""
+        with self._lock:
+            self.bloom_filter = bloom_filter
+            self.built_at = built_at
+            self._synced_to = built_at
+            self._synced_at = None
+            self._seen_log_ids = {}
+
+    def _age_seconds(self):
+        """Return the age of the current filter in seconds, or None if there isn't one"""
+        if self.built_at is None:
+            return None
+        return (datetime.datetime.utcnow() - self.built_at).total_seconds()
+
+    def _is_stale(self):
+        """Return True if there's no filter, or it's due to be rebuilt"""
+        age = self._age_seconds()
+        return age is None or age >= self.rebuild_seconds
+
+    def _maintain(self):
+        """Thread target keeping the filter fresh. A newer snapshot is loaded if there is one,
+        otherwise the lambda holding the rebuild lock rebuilds the filter, and the others wait
+        for its snapshot. In between, the filter catches up with the log every sync_seconds
+        """
+        next_snapshot_check = 0
+        while True:
+            try:
+                if time.monotonic() >= next_snapshot_check:
+                    next_snapshot_check = time.monotonic() + self.poll_seconds
+                    self.load_snapshot()
+                    if self._is_stale() and self.rebuild_lock.try_acquire():
+                        try:
+                            # Another lambda may have saved a snapshot while the lock was free
+                            self.load_snapshot()
+                            if self._is_stale():
+                                self.rebuild()
+                        finally:
+                            self.rebuild_lock.release()
+                    age = self._age_seconds()
+                    if age is not None and age < self.rebuild_seconds:
+                        next_snapshot_check = time.monotonic() + max(
+                            self.rebuild_seconds - age, self.poll_seconds
+                        )
+                self.sync()
+            except Exception:
+                logger.exception("Bloom filter maintenance failed")
+            self._sync_wakeup.wait(self.sync_seconds)
+            self._sync_wakeup.clear()
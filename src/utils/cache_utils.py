@@ -0,0 +1,110 @@
+"""The module for caching processed sents in memory between warm invocations"""
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+
+class ResultCache:
+    """Bounded least recently used cache of normalised_sent : processed_sent, with an
+    optional time to live"""
+
+    def __init__(self, max_entries, max_bytes=None, ttl_seconds=None):
+        """Initialise an empty cache
+
+        Args:
+            max_entries (int): Maximum number of entries held in the cache
+            max_bytes (int): Maximum approximate size of all keys and values, None for no limit
+            ttl_seconds (float): Seconds before an entry expires, None for no expiry
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # OrderedDict of normalised_sent : (processed_sent, expiry_time, size), ordered from least
+        # to most recently used
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        # Several invocations may share the cache at once, so guard every change with a lock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, normalised_sents):
+        """Look up several sents at once
+
+        Args:
+            normalised_sents (str[]): List of normalised sents to look up
+
+        Returns:
+            cached_sents (Dict): Dictionary of the cached sents found
+              normalised_sent : processed_sent
+        """
+        cached_sents = {}
+        now = time.monotonic()
+        with self._lock:
+            for sent in normalised_sents:
+                entry = self._entries.get(sent)
+                if entry is not None and entry[1] is not None and entry[1] <= now:
+                    self._remove(sent)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(sent)
+                    cached_sents[sent] = entry[0]
+                    self.hits += 1
+        return cached_sents
+
+    def put_many(self, processed_sents):
+        """Add several sents at once, evicting the least recently used entries if the cache is
+        full
+
+        Args:
+            processed_sents (Dict): Dictionary of normalised_sent : processed_sent
+        """
+        expiry_time = None
+        if self.ttl_seconds is not None:
+            expiry_time = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for sent, processed_sent in processed_sents.items():
+                if sent in self._entries:
+                    self._remove(sent)
+                size = sys.getsizeof(sent) + sys.getsizeof(processed_sent)
+                self._entries[sent] = (processed_sent, expiry_time, size)
+                self._size_bytes += size
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._size_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        """Return the cache counters, used for sizing the cache
+
+        Returns:
+            stats (Dict): Dictionary of counter name : value
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _remove(self, sent):
+        """Remove an entry, the caller must hold the lock"""
+        _, _, size = self._entries.pop(sent)
+        self._size_bytes -= size
@@ -0,0 +1,187 @@
+"""The module for converting the model to safetensors, and loading it memory mapped"""
+
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+
+import torch
+from transformers import AutoConfig, AutoModelWithLMHead, AutoTokenizer
+
+from config.config import (
+    ENV_SAFETENSORS_CHECKPOINT_VAR_NAME,
+    MODEL_CHECKPOINT,
+    MODEL_MANIFEST_FILE,
+    SAFETENSORS_CHECKPOINT,
+)
+
+logger = logging.getLogger()
+
+SAFETENSORS_INDEX_FILE = "model.safetensors.index.json"
+SAFETENSORS_FILE = "model.safetensors"
+
+# Safetensors dtype names : torch dtypes
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def is_converted(source_dir, target_dir):
+    """Check whether target_dir holds a conversion of the checkpoint currently in source_dir.
+    A conversion records the manifest of the checkpoint it was made from
+
+    Args:
+        source_dir (string): Directory of the downloaded checkpoint
+        target_dir (string): Directory of the converted checkpoint
+
+    Returns:
+        bool: True if the conversion is present and up to date
+    """
+    try:
+        with open(os.path.join(source_dir, MODEL_MANIFEST_FILE)) as source_file:
+            source_manifest = json.load(source_file)
+        with open(os.path.join(target_dir, MODEL_MANIFEST_FILE)) as target_file:
+            target_manifest = json.load(target_file)
+    except (OSError, ValueError):
+        return False
+    return source_manifest["etag"] == target_manifest["etag"]
+
+
+def get_safetensors_checkpoint():
+    """Return the directory of the safetensors checkpoint, converting the downloaded checkpoint
+    if it hasn't been converted yet
+
+    Returns:
+        checkpoint (string): Directory of the safetensors checkpoint
+    """
+    baked_checkpoint = os.environ.get(ENV_SAFETENSORS_CHECKPOINT_VAR_NAME)
+    if baked_checkpoint:
+        return baked_checkpoint
+    if not is_converted(MODEL_CHECKPOINT, SAFETENSORS_CHECKPOINT):
+        convert_checkpoint(MODEL_CHECKPOINT, SAFETENSORS_CHECKPOINT)
+    return SAFETENSORS_CHECKPOINT
+
+
+def convert_checkpoint(source_dir, target_dir):
+    """Convert a checkpoint to the safetensors format. This reads the whole model once, so
+    it's only done when the checkpoint changes
+
+    Args:
+        source_dir (string): Directory of the downloaded checkpoint
+        target_dir (string): Directory to write the converted checkpoint to
+    """
+
+    def save_safetensors(staging_dir):
+        model = AutoModelWithLMHead.from_pretrained(source_dir, local_files_only=True)
+        model.save_pretrained(staging_dir, safe_serialization=True)
+
+    write_converted_checkpoint(source_dir, target_dir, save_safetensors)
+    logger.info("Converted checkpoint %s to safetensors at %s", source_dir, target_dir)
+
+
+def write_converted_checkpoint(source_dir, target_dir, save_func):
+    """Write a converted checkpoint to a staging directory, then move it into place along with
+    the tokenizer and the manifest of the source checkpoint
+
+    Args:
+        source_dir (string): Directory of the downloaded checkpoint
+        target_dir (string): Directory to write the converted checkpoint to
+        save_func (callable): Function called with the staging directory to save the model to
+    """
+    staging_dir = target_dir + ".partial"
+    if os.path.isdir(staging_dir):
+        shutil.rmtree(staging_dir)
+    save_func(staging_dir)
+    AutoTokenizer.from_pretrained(source_dir, local_files_only=True).save_pretrained(
+        staging_dir
+    )
+    # Copy the manifest last, it marks the conversion as complete
+    source_manifest = os.path.join(source_dir, MODEL_MANIFEST_FILE)
+    if os.path.isfile(source_manifest):
+        shutil.copyfile(source_manifest, os.path.join(staging_dir, MODEL_MANIFEST_FILE))
+    if os.path.isdir(target_dir):
+        shutil.rmtree(target_dir)
+    os.rename(staging_dir, target_dir)
+
+
+def map_safetensors_file(file_path):
+    """Memory map a safetensors file, returning tensors which share memory with the file
+
+    Args:
+        file_path (string): Path to the safetensors file
+
+    Returns:
+        state_dict (Dict): Dictionary of tensor name : tensor
+    """
+    with open(file_path, "rb") as tensor_file:
+        # ACCESS_COPY gives copy on write pages, so the tensors are writeable without the
+        # file ever being changed, and untouched pages are shared with the page cache
+        file_map = mmap.mmap(tensor_file.fileno(), 0, access=mmap.ACCESS_COPY)
+    # The file starts with the length of a JSON header, which gives the dtype, shape and byte
+    # offsets of each tensor in the data section that follows it
+    (header_len,) = struct.unpack("<Q", file_map[:8])
+    header = json.loads(file_map[8 : 8 + header_len])
+    data_start = 8 + header_len
+    state_dict = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            state_dict[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        state_dict[name] = torch.frombuffer(
+            file_map,
+            dtype=dtype,
+            count=(end - start) // dtype.itemsize,
+            offset=data_start + start,
+        ).view(info["shape"])
+    return state_dict
+
+
+def load_mmap_model(checkpoint_dir):
+    """Load a safetensors checkpoint without copying its weights. The model is built on the
+    meta device, which allocates no memory, then its parameters are pointed at the mapped file
+
+    Args:
+        checkpoint_dir (string): Directory of the safetensors checkpoint
+
+    Returns:
+        model (PreTrainedModel): The loaded model, in eval mode
+    """
+    index_path = os.path.join(checkpoint_dir, SAFETENSORS_INDEX_FILE)
+    if os.path.isfile(index_path):
+        with open(index_path) as index_file:
+            file_names = sorted(set(json.load(index_file)["weight_map"].values()))
+    else:
+        file_names = [SAFETENSORS_FILE]
+    state_dict = {}
+    for file_name in file_names:
+        state_dict |= map_safetensors_file(os.path.join(checkpoint_dir, file_name))
+
+    config = AutoConfig.from_pretrained(checkpoint_dir, local_files_only=True)
+    with torch.device("meta"):
+        model = AutoModelWithLMHead.from_config(config)
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    # Shared weights, such as T5's embeddings, are only saved once, so tie them back together
+    model.tie_weights()
+    missing = [
+        name
+        for name, tensor in list(model.named_parameters()) + list(model.named_buffers())
+        if tensor.is_meta
+    ]
+    if len(missing) > 0:
+        raise ValueError(f"Checkpoint {checkpoint_dir} is missing weights {missing}")
+    return model.eval()
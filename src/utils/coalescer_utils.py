@@ -0,0 +1,113 @@
+"""The module for coalescing inference requests from concurrent invocations into one batch"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger()
+
+
+class RequestCoalescer:
+    """Class for gathering sents from concurrent callers for a few milliseconds, or until a
+    batch is full, and running them through the model as one batch. Each caller gets back only
+    its own results. It has the same generate_processed_sents method as ModelHandler, so it can
+    be used in its place"""
+
+    def __init__(self, model_handler, max_wait_seconds, max_batch_size):
+        """Initialise the coalescer, the batching thread is started on first use
+
+        Args:
+            model_handler: Object with a generate_processed_sents method to run batches on
+            max_wait_seconds (float): Maximum time the first caller in a batch waits for others
+            max_batch_size (int): Number of sents which triggers a batch without waiting
+        """
+        self.model_handler = model_handler
+        self.max_wait_seconds = max_wait_seconds
+        self.max_batch_size = max_batch_size
+        # List of (normalised_sents, future) waiting to be batched
+        self._pending = []
+        self._pending_sents = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self.batches_run = 0
+        self.requests_coalesced = 0
+
+    def generate_processed_sents(self, normalised_sents):
+        """Tokenize, process and decode the results for a list of sents, batched with the sents
+        of any other concurrent callers.
+
+        Args:
+            normalised_sents (str[]): List of normalised sent strings
+
+        Returns:
+            new_processed_sents (str[]): List of processed sent strings
+        """
+        if len(normalised_sents) == 0:
+            return []
+        future = Future()
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run_batches, name="request-coalescer", daemon=True
+                )
+                self._thread.start()
+            self._pending.append((normalised_sents, future))
+            self._pending_sents += len(normalised_sents)
+            self._condition.notify()
+        return future.result()
+
+    def _take_batch(self):
+        """Wait for pending requests and take a batch of them off the queue
+
+        Returns:
+            batch ((str[], Future)[]): List of the requests in the batch
+        """
+        with self._condition:
+            while len(self._pending) == 0:
+                self._condition.wait()
+            deadline = time.monotonic() + self.max_wait_seconds
+            while self._pending_sents < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            # Take whole requests until the batch is full. A request larger than the batch size
+            # is still taken whole, as its caller needs all of its results
+            batch = []
+            batch_sents = 0
+            while len(self._pending) > 0 and (
+                len(batch) == 0
+                or batch_sents + len(self._pending[0][0]) <= self.max_batch_size
+            ):
+                normalised_sents, future = self._pending.pop(0)
+                batch.append((normalised_sents, future))
+                batch_sents += len(normalised_sents)
+            self._pending_sents -= batch_sents
+            return batch
+
+    def _run_batches(self):
+        """Thread target running batches for as long as the process lives"""
+        while True:
+            batch = self._take_batch()
+            # Callers may ask for the same sents, so only process each one once
+            unique_sents = list(
+                dict.fromkeys(
+                    sent for normalised_sents, _ in batch for sent in normalised_sents
+                )
+            )
+            try:
+                processed_sents = dict(
+                    zip(
+                        unique_sents,
+                        self.model_handler.generate_processed_sents(unique_sents),
+                    )
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.requests_coalesced += len(batch)
+            for normalised_sents, future in batch:
+                future.set_result([processed_sents[sent] for sent in normalised_sents])
@@ -1,26 +1,85 @@
 """The module for handling database operations"""
 
+import hashlib
 import logging
 import os
-import time
+import threading
 
-from pymongo import ASCENDING, MongoClient
+from collections import defaultdict
+
+from pymongo import ASCENDING, MongoClient, ReadPreference, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from config.config import (
+    DEFAULT_MONGO_READ_PREFERENCE,
+    DEFAULT_SENTS_DB_LAYOUT,
     ENV_DB_VAR_NAME,
     ENV_HOST_VAR_NAME,
+    ENV_MONGO_READ_PREFERENCE_VAR_NAME,
     ENV_PASS_VAR_NAME,
+    ENV_SENTS_DB_LAYOUT_VAR_NAME,
     ENV_URI_VAR_NAME,
     ENV_USER_VAR_NAME,
+    MONGO_BLOOM_COLLECTION,
+    MONGO_BLOOM_LOG_COLLECTION,
     MONGO_COLLECTION,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_HASHED_COLLECTION,
+    MONGO_INDEX_MARKER_FILE,
+    MONGO_INDEX_VERSION,
+    MONGO_JOB_CHUNK_COLLECTION,
+    MONGO_JOB_COLLECTION,
+    MONGO_LOCK_BASE_DELAY_SECONDS,
     MONGO_LOCK_COLLECTION,
     MONGO_LOCK_ID,
+    MONGO_LOCK_LEASE_SECONDS,
+    MONGO_LOCK_MAX_DELAY_SECONDS,
+    MONGO_LOCK_MAX_WAIT_SECONDS,
+    MONGO_MAX_IDLE_TIME_MS,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MAX_QUERY_BYTES,
+    MONGO_MAX_QUERY_SENTS,
+    MONGO_META_COLLECTION,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    SENTS_DB_HASH_BYTES,
+    SENTS_DB_HASHED_HITS_KEY,
+    SENTS_DB_HASHED_PROC_KEY,
+    SENTS_DB_HASHED_STORE_TEXT,
+    SENTS_DB_HASHED_TEXT_KEY,
+    SENTS_DB_LAYOUT_HASHED,
+    SENTS_DB_LAYOUT_TEXT,
+    SENTS_DB_HITS_KEY,
     SENTS_DB_NORM_KEY,
     SENTS_DB_PROC_KEY,
+    SENT_BLOOM_CAPACITY,
+    SENT_BLOOM_ERROR_RATE,
+    SENT_BLOOM_LOG_MARGIN_SECONDS,
+    SENT_BLOOM_LOG_TTL_SECONDS,
+    SENT_BLOOM_MAX_BYTES,
+    SENT_BLOOM_MAX_LAG_SECONDS,
+    SENT_BLOOM_POLL_SECONDS,
+    SENT_BLOOM_REBUILD_LEASE_SECONDS,
+    SENT_BLOOM_REBUILD_LOCK_PREFIX,
+    SENT_BLOOM_REBUILD_SECONDS,
+    SENT_BLOOM_SYNC_SECONDS,
 )
+from utils.bloom_utils import SentMembershipIndex
+from utils.lock_utils import MongoLeaseLock
+from utils.metrics_utils import get_metrics
 
 logger = logging.getLogger()
 
+# MongoDB read preference modes by name
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
 
 def get_mongodb_uri(mongodb_user, mongodb_pass, mongodb_host):
     """
@@ -49,102 +108,383 @@ def get_mongodb_uri(mongodb_user, mongodb_pass, mongodb_host):
     return uri
 
 
-def check_sent_collection(db_handler, full_sents, normalised_sents):
-    """Function for checking if a sent already exists in the mongodb table for processed sents.
-    Then return a dictionary of strings with full_sent as the key, and processed_sent as the
-    value. Also return a list of indexes for unprocessed sents.
+def check_sent_collection(
+    db_handler, normalised_sents, result_cache=None, disk_cache=None
+):
+    """Function for checking if sents already exist in the mongodb table for processed sents.
+    Then return a dictionary of strings with normalised_sent as the key, and processed_sent as
+    the value. Also return a list of the unprocessed sents.
 
     Args:
-        full_sents (str[]): List of full sents
-        normalised_sents (str[]): List of normalised sents
+        db_handler (DbHandler): Handler used to query the database
+        normalised_sents (str[]): List of unique normalised sents
+        result_cache (ResultCache): Optional in-memory cache, checked before the database and
+                                    filled with any sents found in the database
+        disk_cache (DiskCache): Optional on-disk cache, checked after the in-memory cache and
+                                filled with any sents found in the database
 
     Returns:
-        processed_sents (Dict): A dictionary of already processed sents with full_sent as the
-                                 key, and processed_sent as the value
-        unprocessed_sent_indexes (int[]): A list of indexes for unprocessed sents.
+        processed_sents (Dict): A dictionary of already processed sents with normalised_sent as
+                                the key, and processed_sent as the value
+        unprocessed_sents (str[]): A list of normalised sents which haven't been processed
     """
-    # check mongodb database for sents
-    matching_sents_dict = db_handler.find_many_sents(normalised_sents)
-    if len(matching_sents_dict) > 0:
-        # Format results into a list of (sent_index, is_repeat, processed_sent) tuples
-        repeat_sent_tuples = [
-            (
-                index,
-                sent in matching_sents_dict,
-                matching_sents_dict[sent] if sent in matching_sents_dict else None,
-            )
-            for index, sent in enumerate(normalised_sents)
+    metrics = get_metrics()
+    processed_sents = {}
+    uncached_sents = normalised_sents
+    if result_cache is not None:
+        processed_sents = result_cache.get_many(normalised_sents)
+        uncached_sents = [
+            sent for sent in normalised_sents if sent not in processed_sents
         ]
-
-        # Filter the sents we already have results for into processed_sents dict
-        processed_sents = {
-            full_sents[index]: processed_sent
-            for index, is_repeat, processed_sent in repeat_sent_tuples
-            if is_repeat
-        }
-        # Filter indexes of sents which we don't yet have results for into
-        # unprocessed_sent_indexes list
-        unprocessed_sent_indexes = [
-            index
-            for index, is_repeat, processed_sent in repeat_sent_tuples
-            if not is_repeat
+        metrics.count("cache_hits", len(processed_sents))
+        metrics.count("cache_misses", len(uncached_sents))
+    if disk_cache is not None and len(uncached_sents) > 0:
+        with metrics.time("disk_cache"):
+            disk_cached_sents = disk_cache.get_many(uncached_sents)
+        metrics.count("disk_cache_hits", len(disk_cached_sents))
+        if result_cache is not None:
+            result_cache.put_many(disk_cached_sents)
+        processed_sents = processed_sents | disk_cached_sents
+        uncached_sents = [
+            sent for sent in uncached_sents if sent not in disk_cached_sents
         ]
-    else:
-        processed_sents = {}
-        unprocessed_sent_indexes = list(range(len(normalised_sents)))
-    return processed_sents, unprocessed_sent_indexes
+    # check mongodb database for the sents not found in the cache
+    if len(uncached_sents) > 0:
+        with metrics.time("find_many_sents"):
+            found_sents = db_handler.find_many_sents(uncached_sents)
+        metrics.count("db_hits", len(found_sents))
+        metrics.count("db_misses", len(uncached_sents) - len(found_sents))
+        if result_cache is not None:
+            result_cache.put_many(found_sents)
+        if disk_cache is not None:
+            disk_cache.put_many(found_sents)
+        processed_sents = processed_sents | found_sents
+    unprocessed_sents = [
+        sent for sent in normalised_sents if sent not in processed_sents
+    ]
+    return processed_sents, unprocessed_sents
+
+
+def chunk_query_sents(normalised_sents, max_sents, max_bytes):
+    """Split a list of sents into chunks small enough for a single $in query. MongoDB limits
+    a query document to 16MB, so chunks are bounded by both count and encoded size
+
+    Args:
+        normalised_sents (str[]): List of sents to split
+        max_sents (int): Maximum number of sents in a chunk
+        max_bytes (int): Maximum total encoded size of the sents in a chunk
+
+    Returns:
+        chunks (str[][]): List of chunks of sents
+    """
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for sent in normalised_sents:
+        sent_bytes = len(sent.encode("utf-8"))
+        if len(chunk) > 0 and (
+            len(chunk) >= max_sents or chunk_bytes + sent_bytes > max_bytes
+        ):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(sent)
+        chunk_bytes += sent_bytes
+    if len(chunk) > 0:
+        chunks.append(chunk)
+    return chunks
+
+
+def hash_sent(normalised_sent):
+    """Function returning the fixed width key of a sent in the hashed layout
+
+    Args:
+        normalised_sent (string): normalised sent to hash
+
+    Returns:
+        bytes: 16 byte blake2b digest of the sent
+    """
+    return hashlib.blake2b(
+        normalised_sent.encode("utf-8"), digest_size=SENTS_DB_HASH_BYTES
+    ).digest()
+
+
+class SentLayout:
+    """Class describing how processed sents are stored in a collection"""
+
+    def __init__(
+        self, collection_name, key_field, proc_field, text_field, hits_field, key_func
+    ):
+        """Initialise the layout
+
+        Args:
+            collection_name (string): Name of the collection using this layout
+            key_field (string): Indexed field a sent is looked up by
+            proc_field (string): Field holding the processed sent
+            text_field (string): Field holding the normalised sent, used to detect hash
+                                 collisions. None if the normalised sent isn't stored separately
+            hits_field (string): Field counting the requests which included the sent
+            key_func (callable): Function returning the key_field value for a normalised sent
+        """
+        self.collection_name = collection_name
+        self.key_field = key_field
+        self.proc_field = proc_field
+        self.text_field = text_field
+        self.hits_field = hits_field
+        self.key_func = key_func
+
+    def get_projection(self):
+        """Return the projection of the fields read_doc needs, so lookups don't fetch whole
+        documents
+
+        Returns:
+            Dict: The projection
+        """
+        projection = {"_id": False, self.key_field: True, self.proc_field: True}
+        if self.text_field is not None:
+            projection[self.text_field] = True
+        return projection
+
+    def make_upsert(self, normalised_sent, processed_sent):
+        """Return the operation storing a sent, without overwriting an existing document
+
+        Returns:
+            UpdateOne: The upsert operation
+        """
+        fields = {self.proc_field: processed_sent}
+        if self.text_field is not None:
+            fields[self.text_field] = normalised_sent
+        return UpdateOne(
+            {self.key_field: self.key_func(normalised_sent)},
+            {"$setOnInsert": fields},
+            upsert=True,
+        )
+
+    def read_doc(self, doc, sents_by_key):
+        """Return the normalised and processed sent stored in a document
+
+        Args:
+            doc (Dict): Document found by a lookup
+            sents_by_key (Dict): Dictionary of key : normalised sent for the lookup
+
+        Returns:
+            (string, string): The normalised and processed sent, or None if the document
+                              belongs to a different sent with the same hash
+        """
+        normalised_sent = sents_by_key[doc[self.key_field]]
+        if (
+            self.text_field is not None
+            and self.text_field in doc
+            and doc[self.text_field] != normalised_sent
+        ):
+            logger.warning("Hash collision for sent %s", normalised_sent)
+            return None
+        return normalised_sent, doc[self.proc_field]
+
+
+def get_sent_layout(layout_name):
+    """Function returning the layout with the given name
+
+    Args:
+        layout_name (string): SENTS_DB_LAYOUT_TEXT or SENTS_DB_LAYOUT_HASHED
+
+    Returns:
+        SentLayout: The layout
+    """
+    if layout_name == SENTS_DB_LAYOUT_TEXT:
+        # The original layout, looked up by the full normalised sent
+        return SentLayout(
+            MONGO_COLLECTION,
+            SENTS_DB_NORM_KEY,
+            SENTS_DB_PROC_KEY,
+            None,
+            SENTS_DB_HITS_KEY,
+            lambda sent: sent,
+        )
+    if layout_name == SENTS_DB_LAYOUT_HASHED:
+        # Looked up by a fixed width hash held in _id, which MongoDB always indexes
+        return SentLayout(
+            MONGO_HASHED_COLLECTION,
+            "_id",
+            SENTS_DB_HASHED_PROC_KEY,
+            SENTS_DB_HASHED_TEXT_KEY if SENTS_DB_HASHED_STORE_TEXT else None,
+            SENTS_DB_HASHED_HITS_KEY,
+            hash_sent,
+        )
+    raise ValueError(f"Unknown sent layout {layout_name}")
 
 
 class DbHandler:
     """Class for handling all database methods"""
 
-    def __init__(self):
-        """Initialise the database connection"""
+    def __init__(self, warm_up=True):
+        """Initialise the database connection. Connecting and creating indexes happen on a
+        background thread, so they overlap the rest of the cold start
+
+        Args:
+            warm_up (bool): Whether to start connecting and creating indexes immediately,
+                            otherwise the first operation connects
+        """
         mongodb_user = os.environ.get(ENV_USER_VAR_NAME)
         mongodb_pass = os.environ.get(ENV_PASS_VAR_NAME)
         mongodb_db_name = os.environ.get(ENV_DB_VAR_NAME)
         mongodb_host = os.environ.get(ENV_HOST_VAR_NAME)
         mongodb_uri = get_mongodb_uri(mongodb_user, mongodb_pass, mongodb_host)
-        self.mongo_client = MongoClient(host=mongodb_uri)
+        self.mongo_client = MongoClient(
+            host=mongodb_uri,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            retryReads=True,
+        )
         self.mongo_db = self.mongo_client[mongodb_db_name]
-        self.mongo_col = self.mongo_db[MONGO_COLLECTION]
+        self.layout = get_sent_layout(
+            os.environ.get(ENV_SENTS_DB_LAYOUT_VAR_NAME, DEFAULT_SENTS_DB_LAYOUT)
+        )
+        self.mongo_col = self.mongo_db[self.layout.collection_name]
+        # Lookups go through read_col, which may read from secondaries
+        self.read_col = self.mongo_col
+        self.set_read_preference(
+            os.environ.get(
+                ENV_MONGO_READ_PREFERENCE_VAR_NAME, DEFAULT_MONGO_READ_PREFERENCE
+            )
+        )
         self.lock_col = self.mongo_db[MONGO_LOCK_COLLECTION]
-        # Ensure there is an index on the 'normalised_sent' key, which is the main searched field
-        # This increases efficiency when finding later
-        self.mongo_col.create_index(
-            [(SENTS_DB_NORM_KEY, ASCENDING)], name="search_index", unique=True
+        self.meta_col = self.mongo_db[MONGO_META_COLLECTION]
+        # Jobs are recorded next to the processed sents, so any invocation can carry on with
+        # any job
+        self.job_col = self.mongo_db[MONGO_JOB_COLLECTION]
+        self.job_chunk_col = self.mongo_db[MONGO_JOB_CHUNK_COLLECTION]
+        self.membership_index = None
+        self._warm_up_thread = None
+        if warm_up:
+            self._warm_up_thread = threading.Thread(
+                target=self._warm_up, name="mongo-warm-up", daemon=True
+            )
+            self._warm_up_thread.start()
+
+    def set_read_preference(self, mode_name):
+        """Set where sent lookups read from. Writes always go to the primary
+
+        Args:
+            mode_name (string): MongoDB read preference mode name, such as
+                                "secondaryPreferred"
+        """
+        self.read_col = self.mongo_col.with_options(
+            read_preference=READ_PREFERENCES[mode_name]
         )
 
-    def lock_mutex(self):
-        """Mutex lock implementation using mongodb"""
-        lock_acquired = False
-        while not lock_acquired:
-            # Lambda has an init phase of 10 seconds. A cold start is guaranteed to take longer,
-            # so we force a timeout here to avoid a lambda locking the mutex before being
-            # prematurely timed out. This also avoids constantly spamming MongoDB for the lock
-            time.sleep(10)
-            # Try to lock the mutex
-            logger.info("Attempting to lock mutex")
-            res = self.lock_col.update_one(
-                {"_id": MONGO_LOCK_ID}, {"$set": {"locked": True}}, upsert=True
+    def ensure_indexes(self):
+        """Create the indexes the lookups and jobs need, unless this sandbox or the database has a
+        record of them being created already. create_index is idempotent, so racing another
+        lambda is harmless
+
+        Returns:
+            bool: True if the indexes were created by this call
+        """
+        index_id = f"indexes:{self.layout.collection_name}"
+        marker_file = f"{MONGO_INDEX_MARKER_FILE}.{self.layout.collection_name}"
+        marker = str(MONGO_INDEX_VERSION)
+        if os.path.exists(marker_file):
+            with open(marker_file, encoding="ascii") as marker_fp:
+                if marker_fp.read() == marker:
+                    return False
+        created = False
+        if (
+            self.meta_col.find_one({"_id": index_id, "version": MONGO_INDEX_VERSION})
+            is None
+        ):
+            if self.layout.key_field != "_id":
+                # Ensure there is an index on the 'normalised_sent' key, which is the main
+                # searched field. This increases efficiency when finding later
+                self.mongo_col.create_index(
+                    [(self.layout.key_field, ASCENDING)],
+                    name="search_index",
+                    unique=True,
+                )
+            # Job chunks are claimed and paged through by job and chunk index
+            self.job_chunk_col.create_index(
+                [("job_id", ASCENDING), ("index", ASCENDING)], name="job_chunk_index"
             )
-            # res includes the number of records modified. If the lock was unlocked
-            # then the modified count > 0. If it's already locked, the modified count == 0s
-            # If the record didn't exist, the modified_count is 0, but the upserted_id is not None.
-            # Otherwise the upserted_id is None
-            lock_acquired = res.modified_count > 0 or (res.upserted_id is not None)
-            logger.info(
-                "lock result %d, %s", res.modified_count, (res.upserted_id is not None)
+            # The bloom filter log is read by time, and expires once no filter needs it
+            self.mongo_db[MONGO_BLOOM_LOG_COLLECTION].create_index(
+                [("created_at", ASCENDING)],
+                name="bloom_log_ttl_index",
+                expireAfterSeconds=SENT_BLOOM_LOG_TTL_SECONDS,
             )
+            self.meta_col.replace_one(
+                {"_id": index_id}, {"version": MONGO_INDEX_VERSION}, upsert=True
+            )
+            created = True
+            logger.info("Created indexes for %s", self.layout.collection_name)
+        with open(marker_file, "w", encoding="ascii") as marker_fp:
+            marker_fp.write(marker)
+        return created
+
+    def wait_for_warm_up(self, timeout=None):
+        """Wait for the background connection and index creation to finish
+
+        Args:
+            timeout (float): Maximum number of seconds to wait, None to wait indefinitely
+        """
+        if self._warm_up_thread is not None:
+            self._warm_up_thread.join(timeout)
 
-    def unlock_mutex(self):
-        """Unlock the mutex lock"""
-        res = self.lock_col.update_one(
-            {"_id": MONGO_LOCK_ID}, {"$set": {"locked": False}}, upsert=True
+    def _warm_up(self):
+        """Thread target opening a connection and creating the indexes"""
+        try:
+            self.mongo_client.admin.command("ping")
+            self.ensure_indexes()
+        except Exception:
+            # Requests connect on their own if this fails
+            logger.exception("MongoDB warm up failed")
+
+    def get_lease_lock(self):
+        """Return a lock shared by every sandbox using this database
+
+        Returns:
+            MongoLeaseLock: Lock held through a document in the lock collection
+        """
+        return MongoLeaseLock(
+            self.lock_col,
+            MONGO_LOCK_ID,
+            MONGO_LOCK_LEASE_SECONDS,
+            MONGO_LOCK_MAX_WAIT_SECONDS,
+            MONGO_LOCK_BASE_DELAY_SECONDS,
+            MONGO_LOCK_MAX_DELAY_SECONDS,
         )
-        if res.modified_count == 0:
-            # Raise an exception if it's aready unlocked, because something must have gone wrong
-            raise Exception("Trying to unlock mutex, but already unlocked")
+
+    def start_membership_index(self):
+        """Start loading a bloom filter of the stored sents in the background. Once it's ready,
+        sents which definitely aren't stored are no longer looked up"""
+        if self.membership_index is None:
+            self.membership_index = SentMembershipIndex(
+                self.mongo_col,
+                self.layout.key_field,
+                self.mongo_db[MONGO_BLOOM_COLLECTION],
+                SENT_BLOOM_CAPACITY,
+                SENT_BLOOM_ERROR_RATE,
+                SENT_BLOOM_MAX_BYTES,
+                SENT_BLOOM_REBUILD_SECONDS,
+                MongoLeaseLock(
+                    self.lock_col,
+                    SENT_BLOOM_REBUILD_LOCK_PREFIX + self.layout.collection_name,
+                    SENT_BLOOM_REBUILD_LEASE_SECONDS,
+                    0,
+                    MONGO_LOCK_BASE_DELAY_SECONDS,
+                    MONGO_LOCK_MAX_DELAY_SECONDS,
+                ),
+                SENT_BLOOM_POLL_SECONDS,
+                self.mongo_db[MONGO_BLOOM_LOG_COLLECTION],
+                SENT_BLOOM_SYNC_SECONDS,
+                SENT_BLOOM_MAX_LAG_SECONDS,
+                SENT_BLOOM_LOG_MARGIN_SECONDS,
+                SENT_BLOOM_LOG_TTL_SECONDS,
+            )
+            self.membership_index.start()
 
     # Use batch operations to improve performance
     def find_many_sents(self, normalised_sents):
@@ -166,44 +506,129 @@ class DbHandler:
                 logger.info(
                     "Sentences passed, looking for %d documents", len(normalised_sents)
                 )
-                # Using 'cursor_type=CursorType.EXHAUST' to get all results immediately causes an
-                #  error: database error: OP_QUERY is no longer supported.
-                matched_sents_responses = self.mongo_col.find(
-                    {SENTS_DB_NORM_KEY: {"$in": normalised_sents}}
-                )
-
-                if matched_sents_responses:
-                    # Convert list of documents into dict of (normalised_sent : processed_sent)
-                    matched_sents = {
-                        doc[SENTS_DB_NORM_KEY]: doc[SENTS_DB_PROC_KEY]
-                        for doc in matched_sents_responses
+                # Large requests are split only as far as MongoDB's document size limit needs
+                for sent_chunk in chunk_query_sents(
+                    normalised_sents, MONGO_MAX_QUERY_SENTS, MONGO_MAX_QUERY_BYTES
+                ):
+                    sents_by_key = {
+                        self.layout.key_func(sent): sent for sent in sent_chunk
                     }
-                    logger.info("Matched Sentences found: %d", len(matched_sents))
+                    query_keys = list(sents_by_key.keys())
+                    if self.membership_index is not None:
+                        query_keys = self.membership_index.filter_keys(query_keys)
+                        if len(query_keys) == 0:
+                            # Every sent in the chunk is definitely new
+                            self.membership_index.record_lookup(0, 0, True)
+                            continue
+                    chunk_matched_count = 0
+                    get_metrics().count("db_queries")
+                    # Using 'cursor_type=CursorType.EXHAUST' to get all results immediately causes
+                    #  an error: database error: OP_QUERY is no longer supported.
+                    # Only the needed fields are fetched, and every match comes back in the
+                    # first batch rather than after a getMore round trip
+                    matched_sents_responses = self.read_col.find(
+                        {self.layout.key_field: {"$in": query_keys}},
+                        self.layout.get_projection(),
+                        batch_size=len(query_keys),
+                    )
+                    # Convert list of documents into dict of (normalised_sent : processed_sent)
+                    for doc in matched_sents_responses:
+                        matched_sent = self.layout.read_doc(doc, sents_by_key)
+                        if matched_sent is not None:
+                            matched_sents[matched_sent[0]] = matched_sent[1]
+                            chunk_matched_count += 1
+                    if self.membership_index is not None:
+                        self.membership_index.record_lookup(
+                            len(query_keys), chunk_matched_count, False
+                        )
+                logger.info("Matched Sentences found: %d", len(matched_sents))
         except Exception as e:
             logger.info(str(e))
         return matched_sents
 
     def store_sents(self, normalised_sents, processed_sents):
-        """Handles inserting several sentence pairs to the database
+        """Handles upserting several sentence pairs to the database. The writes are unordered,
+        so a sentence already stored by another lambda doesn't stop the rest being written
 
         Args:
             normalised_sents (str[]): List of normalised sentences
             processed_sents (str[]): List of processed sentences
+
+        Returns:
+            written_count (int): Number of new documents written, or None if the write failed
         """
-        documents = [
-            {
-                SENTS_DB_NORM_KEY: normalised_sent,
-                SENTS_DB_PROC_KEY: processed_sents[index],
-            }
+        operations = [
+            self.layout.make_upsert(normalised_sent, processed_sents[index])
             for index, normalised_sent in enumerate(normalised_sents)
         ]
         # Use try and except here to allow the lambda to continue functioning if the non-essential
         #  database operations fail
         try:
-            if len(documents) > 0:
-                response = self.mongo_col.insert_many(documents)
-                if response:
-                    print(response)
-                    logger.info("Many Sentences inserted")
+            if len(operations) > 0:
+                metrics = get_metrics()
+                metrics.count("stored_sents", len(operations))
+                with metrics.time("store_sents"):
+                    response = self.mongo_col.bulk_write(operations, ordered=False)
+                logger.info("Many Sentences upserted %d", response.upserted_count)
+                self._add_to_membership_index(normalised_sents)
+                return response.upserted_count
+            return 0
+        except BulkWriteError as e:
+            # Concurrent upserts of the same new sentence can still collide on the unique index.
+            # Unordered writes carry on past the failure, so only the colliding ones are lost,
+            # and they've been stored by whoever won
+            logger.info(
+                "Many Sentences upserted %d, with %d errors",
+                e.details["nUpserted"],
+                len(e.details["writeErrors"]),
+            )
+            self._add_to_membership_index(normalised_sents)
+            return e.details["nUpserted"]
+        except Exception as e:
+            logger.info(str(e))
+            return None
+
+    def increment_hits(self, sent_counts):
+        """Add to the request counts of stored sents, in bulk. Sents not stored yet are skipped
+
+        Args:
+            sent_counts (Dict): Dictionary of normalised_sent : number of requests
+
+        Returns:
+            updated_count (int): Number of documents updated, or None if the update failed
+        """
+        # Sents with the same count share one update
+        sents_by_count = defaultdict(list)
+        for sent, count in sent_counts.items():
+            sents_by_count[count].append(sent)
+        operations = [
+            UpdateMany(
+                {
+                    self.layout.key_field: {
+                        "$in": [self.layout.key_func(sent) for sent in sent_chunk]
+                    }
+                },
+                {"$inc": {self.layout.hits_field: count}},
+            )
+            for count, sents in sents_by_count.items()
+            for sent_chunk in chunk_query_sents(
+                sents, MONGO_MAX_QUERY_SENTS, MONGO_MAX_QUERY_BYTES
+            )
+        ]
+        # Use try and except here to allow the lambda to continue functioning if the non-essential
+        #  database operations fail
+        try:
+            if len(operations) > 0:
+                response = self.mongo_col.bulk_write(operations, ordered=False)
+                return response.modified_count
+            return 0
         except Exception as e:
             logger.info(str(e))
+            return None
+
+    def _add_to_membership_index(self, normalised_sents):
+        """Add newly stored sents to the bloom filter, if there is one"""
+        if self.membership_index is not None:
+            self.membership_index.add_many(
+                [self.layout.key_func(sent) for sent in normalised_sents]
+            )
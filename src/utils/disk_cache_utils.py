@@ -0,0 +1,229 @@
+"""The module for the on-disk cache of processed sents, which outlives the process so a new
+process in the same sandbox starts with the sents seen before, and can be seeded from a
+snapshot of the most requested sents"""
+
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger()
+
+# Number of sents per sqlite statement, under sqlite's limit on bound variables
+_SQL_CHUNK_SIZE = 500
+
+
+class DiskCache:
+    """Bounded sqlite cache of normalised_sent : processed_sent. Entries are evicted least
+    recently used first, in bulk, once the cache holds more than max_entries. Several processes
+    in a sandbox can share the file"""
+
+    def __init__(self, path, max_entries, evict_fraction):
+        """Open the cache file, creating it if needed
+
+        Args:
+            path (string): Location of the sqlite file
+            max_entries (int): Maximum number of entries held in the cache
+            evict_fraction (float): Share of max_entries evicted at once when the cache is full
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_fraction = evict_fraction
+        # The connection is shared between invocations on different threads, so every use is
+        # made holding the lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            # Write ahead logging lets other processes read while one writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sents (sent TEXT PRIMARY KEY,"
+                " processed TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS last_used_index ON sents (last_used)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._entry_count = self._connection.execute(
+                "SELECT COUNT(*) FROM sents"
+            ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, normalised_sents):
+        """Look up several sents at once, marking the ones found as recently used
+
+        Args:
+            normalised_sents (str[]): List of normalised sents to look up
+
+        Returns:
+            cached_sents (Dict): Dictionary of the cached sents found
+              normalised_sent : processed_sent
+        """
+        cached_sents = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(normalised_sents), _SQL_CHUNK_SIZE):
+                sent_chunk = normalised_sents[i : i + _SQL_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(sent_chunk))
+                cached_sents |= dict(
+                    self._connection.execute(
+                        f"SELECT sent, processed FROM sents WHERE sent IN ({placeholders})",
+                        sent_chunk,
+                    )
+                )
+            if len(cached_sents) > 0:
+                self._connection.executemany(
+                    "UPDATE sents SET last_used = ? WHERE sent = ?",
+                    [(now, sent) for sent in cached_sents],
+                )
+            self.hits += len(cached_sents)
+            self.misses += len(normalised_sents) - len(cached_sents)
+        return cached_sents
+
+    def put_many(self, processed_sents, last_used=None):
+        """Add several sents at once, evicting the least recently used entries if the cache is
+        full
+
+        Args:
+            processed_sents (Dict): Dictionary of normalised_sent : processed_sent
+            last_used (float): Time to record the sents as last used, now if None
+        """
+        if len(processed_sents) == 0:
+            return
+        if last_used is None:
+            last_used = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                cursor = self._connection.executemany(
+                    "INSERT OR IGNORE INTO sents VALUES (?, ?, ?)",
+                    [
+                        (sent, processed_sent, last_used)
+                        for sent, processed_sent in processed_sents.items()
+                    ],
+                )
+                self._entry_count += cursor.rowcount
+                if self._entry_count > self.max_entries:
+                    self._evict()
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def load_snapshot(self, snapshot_path):
+        """Bulk load a hot set snapshot, unless it's already been loaded into this file.
+        Snapshot entries are marked as used before anything a request has used, so they're
+        evicted first
+
+        Args:
+            snapshot_path (string): Location of a snapshot written by write_hot_set
+
+        Returns:
+            int: Number of entries loaded
+        """
+        stat = os.stat(snapshot_path)
+        snapshot_id = f"{stat.st_size}:{stat.st_mtime_ns}"
+        with self._lock:
+            loaded_id = self._connection.execute(
+                "SELECT value FROM meta WHERE key = 'snapshot'"
+            ).fetchone()
+        if loaded_id is not None and loaded_id[0] == snapshot_id:
+            return 0
+        loaded_count = 0
+        batch = {}
+        for normalised_sent, processed_sent in read_hot_set(snapshot_path):
+            batch[normalised_sent] = processed_sent
+            if len(batch) >= 10000:
+                # The snapshot is ordered most requested first, so later batches are marked as
+                # used longer ago and evicted first
+                self.put_many(batch, -loaded_count)
+                loaded_count += len(batch)
+                batch = {}
+        self.put_many(batch, -loaded_count)
+        loaded_count += len(batch)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('snapshot', ?)", (snapshot_id,)
+            )
+        logger.info("Loaded %d hot set sents into the disk cache", loaded_count)
+        return loaded_count
+
+    def stats(self):
+        """Return the cache counters
+
+        Returns:
+            stats (Dict): Dictionary of counter name : value
+        """
+        with self._lock:
+            return {
+                "entries": self._entry_count,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict(self):
+        """Delete the least recently used entries, must be called holding the lock in a
+        transaction"""
+        # Other processes may have added entries too, so count again before evicting
+        self._entry_count = self._connection.execute(
+            "SELECT COUNT(*) FROM sents"
+        ).fetchone()[0]
+        evict_count = self._entry_count - int(
+            self.max_entries * (1 - self.evict_fraction)
+        )
+        if evict_count <= 0:
+            return
+        self._connection.execute(
+            "DELETE FROM sents WHERE sent IN"
+            " (SELECT sent FROM sents ORDER BY last_used LIMIT ?)",
+            (evict_count,),
+        )
+        self._entry_count -= evict_count
+        self.evictions += evict_count
+
+
+def write_hot_set(snapshot_path, processed_sents):
+    """Write a hot set snapshot, as gzipped newline delimited json [normalised, processed]
+    pairs
+
+    Args:
+        snapshot_path (string): Location to write the snapshot
+        processed_sents (iterable): (normalised_sent, processed_sent) pairs, most requested
+                                    first
+
+    Returns:
+        int: Number of sents written
+    """
+    written_count = 0
+    with gzip.open(snapshot_path, "wt", encoding="utf-8") as snapshot:
+        for pair in processed_sents:
+            snapshot.write(json.dumps(list(pair), ensure_ascii=False) + "\n")
+            written_count += 1
+    return written_count
+
+
+def read_hot_set(snapshot_path):
+    """Read a hot set snapshot written by write_hot_set
+
+    Args:
+        snapshot_path (string): Location of the snapshot
+
+    Yields:
+        (string, string): normalised_sent, processed_sent pairs
+    """
+    with gzip.open(snapshot_path, "rt", encoding="utf-8") as snapshot:
+        for line in snapshot:
+            if line.strip():
+                normalised_sent, processed_sent = json.loads(line)
+                yield normalised_sent, processed_sent
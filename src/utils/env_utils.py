@@ -0,0 +1,38 @@
+"""The module for reading optional settings from environment variables"""
+
+import os
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def get_env_flag(var_name, default):
+    """Function for reading a boolean setting from an environment variable
+
+    Args:
+        var_name (string): Name of the environment variable
+        default (bool): Value used when the variable isn't set
+
+    Returns:
+        bool: The value of the setting
+    """
+    value = os.environ.get(var_name)
+    if value is None or len(value) == 0:
+        return default
+    return value.strip().lower() in TRUE_VALUES
+
+
+def get_env_number(var_name, default, cast=int):
+    """Function for reading a numeric setting from an environment variable
+
+    Args:
+        var_name (string): Name of the environment variable
+        default (int | float): Value used when the variable isn't set
+        cast (type): Type to convert the value to, int or float
+
+    Returns:
+        int | float: The value of the setting
+    """
+    value = os.environ.get(var_name)
+    if value is None or len(value) == 0:
+        return default
+    return cast(value)
@@ -0,0 +1,332 @@
+"""The module for asynchronous jobs, which process a large sent list in checkpointed chunks
+over as many invocations as needed"""
+
+import datetime
+import json
+import logging
+import time
+import uuid
+
+from pymongo import ASCENDING, ReturnDocument
+
+from utils.db_utils import chunk_query_sents
+
+logger = logging.getLogger()
+
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+
+class JobStore:
+    """Class recording jobs and their chunks in MongoDB. Every chunk is claimed with a lease
+    before it's processed, so a chunk abandoned by a timed out invocation is picked up again
+    once its lease expires, and a job resumes from its first unfinished chunk. Each claim
+    records an owner token, and only the current owner can finish or release a chunk, so an
+    invocation which outlived its lease can't overwrite the claim of the one which took over
+    """
+
+    def __init__(self, job_col, chunk_col, lease_seconds, max_attempts):
+        """Initialise the store. The chunk index is created with the other indexes, by
+        DbHandler.ensure_indexes
+
+        Args:
+            job_col (Collection): Collection with one document per job
+            chunk_col (Collection): Collection with one document per chunk of a job
+            lease_seconds (float): Time a claimed chunk is reserved for its invocation
+            max_attempts (int): Number of times a chunk may fail before its job fails
+        """
+        self.job_col = job_col
+        self.chunk_col = chunk_col
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def create_job(self, sent_list, chunk_size, max_chunk_bytes):
+        """Record a new job, split into chunks of at most chunk_size sents
+
+        Args:
+            sent_list (str[]): Original sents to process
+            chunk_size (int): Maximum number of sents in a chunk
+            max_chunk_bytes (int): Maximum encoded size of the sents in a chunk, keeping chunk
+                                   documents under MongoDB's size limit
+
+        Returns:
+            job (Dict): The job document
+        """
+        job_id = uuid.uuid4().hex
+        sent_chunks = chunk_query_sents(sent_list, chunk_size, max_chunk_bytes)
+        now = datetime.datetime.utcnow()
+        job = {
+            "_id": job_id,
+            "status": JOB_STATUS_PENDING,
+            "total_sents": len(sent_list),
+            "total_chunks": len(sent_chunks),
+            "done_chunks": 0,
+            "created": now,
+            "updated": now,
+            "error": None,
+        }
+        # Chunks are written before the job, so a job never exists without all of its chunks
+        if len(sent_chunks) > 0:
+            self.chunk_col.insert_many(
+                [
+                    {
+                        "_id": f"{job_id}:{index}",
+                        "job_id": job_id,
+                        "index": index,
+                        "sents": sent_chunk,
+                        "status": JOB_STATUS_PENDING,
+                        "lease_until": None,
+                        "owner": None,
+                        "attempts": 0,
+                        "results": None,
+                    }
+                    for index, sent_chunk in enumerate(sent_chunks)
+                ],
+                ordered=False,
+            )
+        else:
+            job["status"] = JOB_STATUS_DONE
+        self.job_col.insert_one(job)
+        logger.info("Created job %s of %d chunks", job_id, len(sent_chunks))
+        return job
+
+    def get_job(self, job_id):
+        """Return the job document, or None if there's no such job"""
+        return self.job_col.find_one({"_id": job_id})
+
+    def claim_chunk(self, job_id):
+        """Claim the first chunk of a job which is unfinished and not leased by another
+        invocation
+
+        Args:
+            job_id (string): ID of the job
+
+        Returns:
+            chunk (Dict): The claimed chunk document, with its new owner token, or None if no
+                          chunk is available
+        """
+        now = datetime.datetime.utcnow()
+        return self.chunk_col.find_one_and_update(
+            {
+                "job_id": job_id,
+                "$or": [
+                    {"status": JOB_STATUS_PENDING},
+                    {"status": JOB_STATUS_RUNNING, "lease_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": JOB_STATUS_RUNNING,
+                    "lease_until": now + datetime.timedelta(seconds=self.lease_seconds),
+                    "owner": uuid.uuid4().hex,
+                }
+            },
+            sort=[("index", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def get_next_lease_expiry(self, job_id):
+        """Return when the first lease on an unfinished chunk of a job runs out
+
+        Args:
+            job_id (string): ID of the job
+
+        Returns:
+            lease_until (datetime): Expiry of the earliest lease, or None if no chunk is leased
+        """
+        chunk = self.chunk_col.find_one(
+            {"job_id": job_id, "status": JOB_STATUS_RUNNING},
+            {"lease_until": 1},
+            sort=[("lease_until", ASCENDING)],
+        )
+        return None if chunk is None else chunk["lease_until"]
+
+    def complete_chunk(self, chunk, results):
+        """Record the results of a claimed chunk, and the progress of its job
+
+        Args:
+            chunk (Dict): The chunk document returned by claim_chunk
+            results (str[]): Processed sent for each sent in the chunk
+
+        Returns:
+            bool: False if the chunk was claimed by another invocation after its lease expired
+        """
+        response = self.chunk_col.update_one(
+            {
+                "_id": chunk["_id"],
+                "owner": chunk["owner"],
+                "status": JOB_STATUS_RUNNING,
+            },
+            {"$set": {"status": JOB_STATUS_DONE, "results": results}},
+        )
+        if response.modified_count == 0:
+            logger.info("Chunk %s was taken over, not recording it", chunk["_id"])
+            return False
+        job = self.job_col.find_one_and_update(
+            {"_id": chunk["job_id"]},
+            {
+                "$inc": {"done_chunks": 1},
+                "$set": {
+                    "status": JOB_STATUS_RUNNING,
+                    "updated": datetime.datetime.utcnow(),
+                },
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if job["done_chunks"] >= job["total_chunks"]:
+            self.job_col.update_one(
+                {"_id": job["_id"], "status": JOB_STATUS_RUNNING},
+                {"$set": {"status": JOB_STATUS_DONE}},
+            )
+        return True
+
+    def fail_chunk(self, chunk, error):
+        """Release a claimed chunk after it failed, failing its job once the chunk has used
+        all of its attempts
+
+        Args:
+            chunk (Dict): The chunk document returned by claim_chunk
+            error (string): Description of the failure
+
+        Returns:
+            bool: False if the chunk was claimed by another invocation after its lease expired
+        """
+        attempts = chunk["attempts"] + 1
+        failed = attempts >= self.max_attempts
+        response = self.chunk_col.update_one(
+            {
+                "_id": chunk["_id"],
+                "owner": chunk["owner"],
+                "status": JOB_STATUS_RUNNING,
+            },
+            {
+                "$set": {
+                    "status": JOB_STATUS_FAILED if failed else JOB_STATUS_PENDING,
+                    "lease_until": None,
+                    "owner": None,
+                    "attempts": attempts,
+                }
+            },
+        )
+        if response.modified_count == 0:
+            logger.info("Chunk %s was taken over, not releasing it", chunk["_id"])
+            return False
+        if failed:
+            self.job_col.update_one(
+                {"_id": chunk["job_id"]},
+                {
+                    "$set": {
+                        "status": JOB_STATUS_FAILED,
+                        "error": error,
+                        "updated": datetime.datetime.utcnow(),
+                    }
+                },
+            )
+        return True
+
+    def get_results_page(self, job_id, start_chunk, page_chunks):
+        """Return the results of a page of finished chunks
+
+        Args:
+            job_id (string): ID of the job
+            start_chunk (int): Index of the first chunk in the page
+            page_chunks (int): Maximum number of chunks in the page
+
+        Returns:
+            results (Dict): Dictionary of original_sent : processed sent
+            next_chunk (int): Index of the first chunk of the next page, or None if the page
+                              reaches the last finished chunk
+        """
+        results = {}
+        next_chunk = start_chunk
+        chunks = self.chunk_col.find(
+            {"job_id": job_id, "index": {"$gte": start_chunk}},
+            {"index": 1, "status": 1, "sents": 1, "results": 1},
+            sort=[("index", ASCENDING)],
+            limit=page_chunks + 1,
+        )
+        for count, chunk in enumerate(chunks):
+            # Results are paged in chunk order, so a page stops at the first unfinished chunk
+            if chunk["status"] != JOB_STATUS_DONE:
+                return results, next_chunk
+            if count == page_chunks:
+                return results, chunk["index"]
+            results |= dict(zip(chunk["sents"], chunk["results"]))
+            next_chunk = chunk["index"] + 1
+        return results, None
+
+
+def run_job(
+    job_store, job_id, process_func, get_remaining_ms, min_remaining_ms, poll_seconds
+):
+    """Process chunks of a job until it's finished, or there's too little time left to process
+    another one. Chunks leased by other invocations are waited for, as an invocation which
+    timed out or crashed leaves its chunk leased until the lease runs out
+
+    Args:
+        job_store (JobStore): Store holding the job
+        job_id (string): ID of the job
+        process_func (callable): Function taking a list of original sents and returning a
+                                 dictionary of original_sent : processed sent
+        get_remaining_ms (callable): Function returning the milliseconds left in this
+                                     invocation, or None if there's no limit
+        min_remaining_ms (int): Time needed to process a chunk and save its results
+        poll_seconds (float): Longest wait between checks on chunks leased by other
+                              invocations
+
+    Returns:
+        chunks_processed (int): Number of chunks finished by this call
+        out_of_time (bool): True if chunks may be left for another invocation
+    """
+    chunks_processed = 0
+    while True:
+        job = job_store.get_job(job_id)
+        if job is None or job["status"] in (JOB_STATUS_DONE, JOB_STATUS_FAILED):
+            return chunks_processed, False
+        remaining_ms = get_remaining_ms()
+        if remaining_ms is not None and remaining_ms < min_remaining_ms:
+            return chunks_processed, True
+        chunk = job_store.claim_chunk(job_id)
+        if chunk is None:
+            lease_until = job_store.get_next_lease_expiry(job_id)
+            if lease_until is None:
+                return chunks_processed, False
+            # Wait for the chunk to be finished, or for its lease to run out so it can be
+            # claimed, without waiting into the time needed to process it
+            wait_seconds = min(
+                max((lease_until - datetime.datetime.utcnow()).total_seconds(), 0),
+                poll_seconds,
+            )
+            if remaining_ms is not None:
+                wait_seconds = min(
+                    wait_seconds, (remaining_ms - min_remaining_ms) / 1000
+                )
+            time.sleep(max(wait_seconds, 0.1))
+            continue
+        try:
+            processed_sents = process_func(chunk["sents"])
+        except Exception as e:
+            logger.exception("Chunk %s failed", chunk["_id"])
+            job_store.fail_chunk(chunk, str(e))
+            continue
+        if job_store.complete_chunk(
+            chunk, [processed_sents[sent] for sent in chunk["sents"]]
+        ):
+            chunks_processed += 1
+
+
+def invoke_async(lambda_client, function_arn, payload):
+    """Invoke a lambda function without waiting for it to finish
+
+    Args:
+        lambda_client (botocore.client.Lambda): Client used to invoke the lambda
+        function_arn (string): ARN of the lambda to invoke
+        payload (Dict): Event passed to the lambda
+    """
+    lambda_client.invoke(
+        FunctionName=function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(payload),
+    )
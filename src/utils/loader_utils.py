@@ -0,0 +1,173 @@
+"""The module for downloading and loading the model, either immediately or in the background"""
+
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from config.config import (
+    COALESCE_MAX_BATCH_SIZE,
+    DEFAULT_COALESCE_WAIT_MS,
+    DEFAULT_INFERENCE_WORKERS,
+    DEFAULT_REMOTE_MODEL_LOCK,
+    ENV_COALESCE_WAIT_MS_VAR_NAME,
+    ENV_INFERENCE_WORKERS_VAR_NAME,
+    ENV_REMOTE_MODEL_LOCK_VAR_NAME,
+    INFERENCE_WORKER_THREADS,
+    MODEL_LOAD_RETRY_BASE_SECONDS,
+    MODEL_LOAD_RETRY_MAX_SECONDS,
+    MODEL_LOCK_NAME,
+    WRITEABLE_DIR,
+)
+from utils.env_utils import get_env_flag, get_env_number
+from utils.coalescer_utils import RequestCoalescer
+from utils.lock_utils import LocalLock
+from utils.s3_utils import download_new_model
+from utils.startup_utils import startup_profiler
+
+logger = logging.getLogger()
+
+
+class ModelLoader:
+    """Class for loading the model once per environment, and handing it to invocations when
+    it's ready. Torch and transformers are only imported when the model is loaded, so a cold
+    start can serve cached sents without paying for those imports"""
+
+    def __init__(self, db_handler, worker_zygote=None):
+        """Initialise the loader without loading anything
+
+        Args:
+            db_handler (DbHandler): Handler providing the remote lock around the model download
+            worker_zygote (WorkerZygote): Zygote to fork inference workers from, or None to run
+                                          inference in this process
+        """
+        self.db_handler = db_handler
+        self.worker_zygote = worker_zygote
+        self.model_handler = None
+        self.load_error = None
+        # Set once loading has finished, whether it succeeded or not
+        self.ready = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = 0
+
+    def load(self):
+        """Download and load the model on the calling thread"""
+        # The download_new_model() and initialising the model_handler steps have race conditions
+        # where one lambda is invoked in the same environment before the other lambda finishes
+        # downloading the new model, so they are run under the mutex
+        try:
+            with startup_profiler.phase("model_lock"):
+                model_lock = self._model_lock()
+            with model_lock:
+                logger.info("Model not found, initiating download")
+                with startup_profiler.phase("model_download"):
+                    download_new_model()
+                logger.info("Model downloaded")
+                if self.worker_zygote is None:
+                    # Importing model_utils imports torch and transformers, which is slow
+                    with startup_profiler.phase("model_import"):
+                        from utils.model_utils import ModelHandler
+
+                    with startup_profiler.phase("model_init"):
+                        model_handler = ModelHandler()
+                else:
+                    # The zygote loads the model itself, and this process never imports torch
+                    from utils.worker_pool_utils import InferenceWorkerPool
+
+                    with startup_profiler.phase("worker_pool"):
+                        model_handler = InferenceWorkerPool(
+                            self.worker_zygote,
+                            get_env_number(
+                                ENV_INFERENCE_WORKERS_VAR_NAME,
+                                DEFAULT_INFERENCE_WORKERS,
+                            ),
+                            INFERENCE_WORKER_THREADS,
+                        )
+                logger.info("Model and Tokenizer loaded")
+                coalesce_wait_ms = get_env_number(
+                    ENV_COALESCE_WAIT_MS_VAR_NAME, DEFAULT_COALESCE_WAIT_MS, float
+                )
+                if coalesce_wait_ms > 0:
+                    model_handler = RequestCoalescer(
+                        model_handler, coalesce_wait_ms / 1000, COALESCE_MAX_BATCH_SIZE
+                    )
+                self.model_handler = model_handler
+                self._failures = 0
+        except Exception as e:
+            self._failures += 1
+            self._retry_at = time.monotonic() + min(
+                MODEL_LOAD_RETRY_BASE_SECONDS * 2 ** (self._failures - 1),
+                MODEL_LOAD_RETRY_MAX_SECONDS,
+            )
+            self.load_error = e
+            raise
+        finally:
+            self.ready.set()
+
+    def start(self):
+        """Start loading the model on a background thread"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._load_in_background, name="model-loader", daemon=True
+                )
+                self._thread.start()
+
+    def get_model_handler(self, timeout):
+        """Return the loaded model handler, waiting for it to finish loading if needed. After a
+        failed background load, the first call past the retry backoff starts loading again,
+        so one failure doesn't leave the sandbox unable to process new sents
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the model
+
+        Returns:
+            model_handler (ModelHandler): The loaded model handler
+        """
+        self._retry_failed_load()
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"Model was not loaded within {timeout} seconds")
+        if self.load_error is not None:
+            raise RuntimeError("Model failed to load") from self.load_error
+        return self.model_handler
+
+    def _retry_failed_load(self):
+        """Restart a failed background load, once the retry backoff has passed"""
+        with self._start_lock:
+            if (
+                self._thread is None
+                or not self.ready.is_set()
+                or self.load_error is None
+                or time.monotonic() < self._retry_at
+            ):
+                return
+            logger.info("Retrying the model load after %d failures", self._failures)
+            self.load_error = None
+            self.ready.clear()
+            self._thread = None
+        self.start()
+
+    def _model_lock(self):
+        """Return the lock held around the model download. The local lock is cheap and only
+        covers this sandbox, which is all the download needs. The MongoDB lease lock covers
+        every sandbox and is only taken when asked for"""
+        model_lock = ExitStack()
+        model_lock.enter_context(LocalLock(MODEL_LOCK_NAME, WRITEABLE_DIR))
+        if get_env_flag(ENV_REMOTE_MODEL_LOCK_VAR_NAME, DEFAULT_REMOTE_MODEL_LOCK):
+            try:
+                model_lock.enter_context(self.db_handler.get_lease_lock())
+            except BaseException:
+                model_lock.close()
+                raise
+        return model_lock
+
+    def _load_in_background(self):
+        """Thread target for load, logging failures instead of losing them with the thread"""
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Background model load failed")
+        finally:
+            startup_profiler.finish()
@@ -0,0 +1,177 @@
+"""The module for locking the model download, within a sandbox and optionally across sandboxes"""
+
+import datetime
+import fcntl
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger()
+
+# Threading locks for each lock name, shared by every LocalLock in this process
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+class LocalLock:
+    """Context manager lock for invocations in the same sandbox. A threading lock serialises
+    threads in this process, and a file lock in writeable memory serialises other processes
+    in the same sandbox. Both are released by the OS if the process dies"""
+
+    def __init__(self, name, lock_dir):
+        """Initialise the lock without acquiring it
+
+        Args:
+            name (string): Name of the lock, locks with the same name exclude each other
+            lock_dir (string): Writeable directory to hold the lock file
+        """
+        with _thread_locks_guard:
+            self._thread_lock = _thread_locks.setdefault(name, threading.Lock())
+        self.lock_path = os.path.join(lock_dir, name + ".lock")
+        self._lock_file = None
+
+    def acquire(self):
+        """Block until the lock is held"""
+        self._thread_lock.acquire()
+        try:
+            self._lock_file = open(self.lock_path, "a")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except Exception:
+            self._close_lock_file()
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        """Release the lock"""
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        finally:
+            self._close_lock_file()
+            self._thread_lock.release()
+
+    def _close_lock_file(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class MongoLeaseLock:
+    """Context manager lock shared by every sandbox through a MongoDB document. The holder is
+    recorded as an owner id, and the lock expires after a lease, so a sandbox which dies while
+    holding it can't block the others forever"""
+
+    def __init__(
+        self,
+        lock_col,
+        lock_id,
+        lease_seconds,
+        max_wait_seconds,
+        base_delay_seconds,
+        max_delay_seconds,
+    ):
+        """Initialise the lock without acquiring it
+
+        Args:
+            lock_col (Collection): MongoDB collection holding the lock document
+            lock_id: _id of the lock document
+            lease_seconds (float): Seconds before a held lock expires and can be taken
+            max_wait_seconds (float): Seconds to keep trying before giving up
+            base_delay_seconds (float): Delay before the first retry, doubled for each retry
+            max_delay_seconds (float): Upper bound on the delay between retries
+        """
+        self.lock_col = lock_col
+        self.lock_id = lock_id
+        self.lease_seconds = lease_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.owner_id = uuid.uuid4().hex
+
+    def try_acquire(self):
+        """Make a single attempt to take the lock
+
+        Returns:
+            bool: True if the lock is now held by this owner
+        """
+        now = datetime.datetime.utcnow()
+        try:
+            # The filter only matches if the lock is free, expired or already ours. If it's held
+            # by someone else the upsert tries to insert a second document with the same _id,
+            # which fails with a duplicate key error. Locks written before leases were added
+            # have no expiry, and are treated as expired
+            self.lock_col.update_one(
+                {
+                    "_id": self.lock_id,
+                    "$or": [
+                        {"locked": False},
+                        {"expires_at": None},
+                        {"expires_at": {"$lt": now}},
+                        {"owner": self.owner_id},
+                    ],
+                },
+                {
+                    "$set": {
+                        "locked": True,
+                        "owner": self.owner_id,
+                        "expires_at": now
+                        + datetime.timedelta(seconds=self.lease_seconds),
+                    }
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def acquire(self):
+        """Block until the lock is held, retrying with exponential backoff and jitter"""
+        deadline = time.monotonic() + self.max_wait_seconds
+        attempt = 0
+        while not self.try_acquire():
+            # Full jitter spreads out sandboxes which started waiting at the same time
+            delay = random.uniform(
+                0, min(self.max_delay_seconds, self.base_delay_seconds * 2**attempt)
+            )
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(
+                    f"Couldn't acquire lock {self.lock_id} within "
+                    f"{self.max_wait_seconds} seconds"
+                )
+            logger.info("Lock %s is held, retrying in %.2fs", self.lock_id, delay)
+            time.sleep(delay)
+            attempt += 1
+        logger.info("Lock %s acquired by %s", self.lock_id, self.owner_id)
+
+    def release(self):
+        """Release the lock, if it's still held by this owner"""
+        res = self.lock_col.update_one(
+            {"_id": self.lock_id, "owner": self.owner_id},
+            {"$set": {"locked": False, "owner": None, "expires_at": None}},
+        )
+        if res.modified_count == 0:
+            # The lease ran out and another sandbox took the lock. Their hold is still valid, so
+            # leave it alone
+            logger.warning(
+                "Lock %s lease expired before it was released by %s",
+                self.lock_id,
+                self.owner_id,
+            )
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,181 @@
+"""The module for timing the stages of a request and counting what it processed. Metrics are
+collected on the current request's RequestMetrics, found with get_metrics, and emitted as a
+CloudWatch embedded metric format log line once the request finishes"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger()
+
+
+class RequestMetrics:
+    """Class collecting the stage timings and counters of one request. Stages may be timed
+    from several threads, and the same stage timed repeatedly adds up"""
+
+    def __init__(self):
+        """Initialise empty metrics"""
+        self.stage_seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """Context manager adding the time spent inside it to a stage
+
+        Args:
+            stage (string): Name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_seconds[stage] += elapsed
+
+    def count(self, name, value=1):
+        """Add to a counter
+
+        Args:
+            name (string): Name of the counter
+            value (int): Amount to add
+        """
+        with self._lock:
+            self.counts[name] += value
+
+    def observe(self, name, value):
+        """Record one sample of a distribution, such as the time of each batch
+
+        Args:
+            name (string): Name of the metric
+            value (float): The sample
+        """
+        with self._lock:
+            self.samples[name].append(value)
+
+    def to_emf(self, namespace, dimensions):
+        """Return the metrics as a CloudWatch embedded metric format document
+
+        Args:
+            namespace (string): CloudWatch namespace of the metrics
+            dimensions (Dict): Dictionary of dimension name : value
+
+        Returns:
+            Dict: The EMF document
+        """
+        with self._lock:
+            values = dict(dimensions)
+            definitions = []
+            for stage, seconds in self.stage_seconds.items():
+                values[f"{stage}_ms"] = seconds * 1000
+                definitions.append({"Name": f"{stage}_ms", "Unit": "Milliseconds"})
+            for name, count in self.counts.items():
+                values[name] = count
+                definitions.append({"Name": name, "Unit": "Count"})
+            # EMF accepts up to 100 values for a metric, which CloudWatch treats as a
+            # distribution
+            for name, samples in self.samples.items():
+                values[name] = samples[-100:]
+                definitions.append({"Name": name, "Unit": "Milliseconds"})
+        values["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [list(dimensions.keys())],
+                    "Metrics": definitions,
+                }
+            ],
+        }
+        return values
+
+    def server_timing(self):
+        """Return the stage timings as a Server-Timing header value
+
+        Returns:
+            string: Comma separated stage;dur=milliseconds entries
+        """
+        with self._lock:
+            return ", ".join(
+                f"{stage};dur={seconds * 1000:.1f}"
+                for stage, seconds in self.stage_seconds.items()
+            )
+
+
+class NullMetrics:
+    """Class with the interface of RequestMetrics which records nothing, used when metrics are
+    disabled"""
+
+    def time(self, stage):
+        """Return a context manager which does nothing"""
+        return _NULL_TIMER
+
+    def count(self, name, value=1):
+        """Do nothing"""
+
+    def observe(self, name, value):
+        """Do nothing"""
+
+
+_NULL_TIMER = contextlib.nullcontext()
+NULL_METRICS = NullMetrics()
+_current_metrics = contextvars.ContextVar("current_metrics", default=NULL_METRICS)
+
+
+def get_metrics():
+    """Return the metrics of the current request, or NULL_METRICS outside of an instrumented
+    request. Threads started by a request only see its metrics if they run in a copy of its
+    context
+
+    Returns:
+        RequestMetrics: The current metrics
+    """
+    return _current_metrics.get()
+
+
+def instrument_handler(namespace, dimensions, get_enabled, get_server_timing):
+    """Decorator collecting metrics for every call of a lambda handler. The handler's total time
+    is recorded as the "total" stage, and the metrics are printed as one EMF json line
+
+    Args:
+        namespace (string): CloudWatch namespace of the metrics
+        dimensions (Dict): Dictionary of dimension name : value
+        get_enabled (callable): Function returning whether to collect metrics for a call
+        get_server_timing (callable): Function returning whether to add a Server-Timing
+                                      header to the response
+
+    Returns:
+        callable: The decorator
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def instrumented_handler(event, context):
+            if not get_enabled():
+                return handler(event, context)
+            metrics = RequestMetrics()
+            token = _current_metrics.set(metrics)
+            try:
+                with metrics.time("total"):
+                    response = handler(event, context)
+            finally:
+                _current_metrics.reset(token)
+                # EMF must be the whole log line, so it's printed rather than logged with the
+                # lambda log prefix
+                print(json.dumps(metrics.to_emf(namespace, dimensions)))
+            if get_server_timing() and isinstance(response, dict):
+                response.setdefault("headers", {})[
+                    "Server-Timing"
+                ] = metrics.server_timing()
+            return response
+
+        return instrumented_handler
+
+    return decorator
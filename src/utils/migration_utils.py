@@ -0,0 +1,86 @@
+"""The module for migrating processed sents between collection layouts"""
+
+import datetime
+import logging
+
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from config.config import SENTS_DB_NORM_KEY, SENTS_DB_PROC_KEY
+
+logger = logging.getLogger()
+
+
+def migrate_sent_collection(
+    source_col,
+    target_layout,
+    target_col,
+    state_col,
+    migration_id,
+    batch_size,
+    max_batches,
+    resume_margin_seconds,
+):
+    """Copy documents from a text layout collection to another layout in bounded batches. The
+    last copied _id is recorded after every batch, so the migration can be stopped and resumed,
+    and run again later to pick up documents written since. Documents are read in _id order.
+    ObjectIds only roughly increase over time, as they come from many hosts with their own
+    clocks, so a run starts resume_margin_seconds before the recorded position. Copying is
+    idempotent, and existing documents in the target are never overwritten
+
+    Args:
+        source_col (Collection): Collection using the text layout
+        target_layout (SentLayout): Layout of the target collection
+        target_col (Collection): Collection to copy into
+        state_col (Collection): Collection recording migration progress
+        migration_id (string): _id of this migration's progress document
+        batch_size (int): Number of documents copied per batch
+        max_batches (int): Maximum number of batches to copy in this run, None for no limit
+        resume_margin_seconds (float): Seconds of documents before the recorded position which
+                                       are read again when resuming
+
+    Returns:
+        copied_count (int): Number of documents read from the source in this run
+    """
+    state = state_col.find_one({"_id": migration_id}) or {}
+    last_id = state.get("last_id")
+    query = {} if last_id is None else {"_id": {"$gt": last_id}}
+    if isinstance(last_id, ObjectId):
+        resume_time = last_id.generation_time - datetime.timedelta(
+            seconds=resume_margin_seconds
+        )
+        query = {"_id": {"$gte": ObjectId.from_datetime(resume_time)}}
+    copied_count = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        docs = list(
+            source_col.find(query, {SENTS_DB_NORM_KEY: 1, SENTS_DB_PROC_KEY: 1})
+            .sort("_id", ASCENDING)
+            .limit(batch_size)
+        )
+        if len(docs) == 0:
+            break
+        operations = [
+            target_layout.make_upsert(doc[SENTS_DB_NORM_KEY], doc[SENTS_DB_PROC_KEY])
+            for doc in docs
+        ]
+        try:
+            target_col.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Collisions with documents written concurrently by lambdas are expected, as they
+            # hold the same result
+            logger.info(
+                "Migration batch had %d write errors", len(e.details["writeErrors"])
+            )
+        last_id = docs[-1]["_id"]
+        query = {"_id": {"$gt": last_id}}
+        state_col.update_one(
+            {"_id": migration_id},
+            {"$set": {"last_id": last_id}, "$inc": {"copied": len(docs)}},
+            upsert=True,
+        )
+        copied_count += len(docs)
+        batches += 1
+        logger.info("Migrated %d documents, up to _id %s", copied_count, last_id)
+    return copied_count
@@ -1,18 +1,38 @@
 """The module for handling the machine learning model operations"""
 
+import logging
 import os
+import resource
+import time
 
-from config.config import MODEL_CHECKPOINT, WRITEABLE_DIR
+from config.config import (
+    DEFAULT_INFERENCE_BACKEND,
+    DEFAULT_INFERENCE_MODE,
+    DEFAULT_MODEL_LOAD_FORMAT,
+    ENV_INFERENCE_BACKEND_VAR_NAME,
+    ENV_INFERENCE_MODE_VAR_NAME,
+    ENV_MODEL_LOAD_FORMAT_VAR_NAME,
+    INFERENCE_MODE_LABEL_SCORING,
+    MAX_BATCH_TOKENS,
+    MODEL_CHECKPOINT,
+    MODEL_LOAD_FORMAT_SAFETENSORS_MMAP,
+    SENT_MODEL_LABELS,
+    WRITEABLE_DIR,
+)
 
 # Set the huggingface cache directory to /tmp/, this points to writeable temp memory in lambda
 # This needs to be set before importing the transformers library
 os.environ["HF_HOME"] = WRITEABLE_DIR
 import torch
 
-# AutoModel is the class for loading a trained model from saved parameters, and running tokenised
-# data through that model
 # AutoTokenizer is the class for loading a trained tokenizer, and tokenizing/detokenizing data
-from transformers import AutoModelWithLMHead, AutoTokenizer
+from transformers import AutoTokenizer
+
+from utils.backend_utils import load_backend_model
+from utils.checkpoint_utils import get_safetensors_checkpoint
+from utils.metrics_utils import get_metrics
+
+logger = logging.getLogger()
 
 
 class ModelHandler:
@@ -24,33 +44,168 @@ class ModelHandler:
         # Model is t5-base-finetuned-emotion, found at
         # https://huggingface.co/mrm8488/t5-base-finetuned-emotion?text=I+wish+you+were+here+but+it+is+impossible
         # Model fine-tuned by mrm8488
+        load_start = time.perf_counter()
+        load_format = os.environ.get(
+            ENV_MODEL_LOAD_FORMAT_VAR_NAME, DEFAULT_MODEL_LOAD_FORMAT
+        )
+        backend = os.environ.get(
+            ENV_INFERENCE_BACKEND_VAR_NAME, DEFAULT_INFERENCE_BACKEND
+        )
+        checkpoint = MODEL_CHECKPOINT
+        if load_format == MODEL_LOAD_FORMAT_SAFETENSORS_MMAP:
+            checkpoint = get_safetensors_checkpoint()
         self.tokenizer = AutoTokenizer.from_pretrained(
-            MODEL_CHECKPOINT, cache_dir=WRITEABLE_DIR, local_files_only=True
+            checkpoint, cache_dir=WRITEABLE_DIR, local_files_only=True
+        )
+        self.model = load_backend_model(backend, checkpoint, load_format)
+        # ru_maxrss is in kilobytes on linux
+        logger.info(
+            "Model loaded as %s with the %s backend in %.2fs, peak RSS %d MB",
+            load_format,
+            backend,
+            time.perf_counter() - load_start,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
         )
-        self.model = AutoModelWithLMHead.from_pretrained(
-            MODEL_CHECKPOINT, cache_dir=WRITEABLE_DIR, local_files_only=True
+        self.inference_mode = os.environ.get(
+            ENV_INFERENCE_MODE_VAR_NAME, DEFAULT_INFERENCE_MODE
         )
+        # The model answers with a single decoder token, so for label scoring we only need the
+        # first token of each label. The label string is decoded the same way generate's output
+        # is (decoder start token followed by the label token) so both modes give equal results
+        decoder_start_id = self.model.config.decoder_start_token_id
+        self.label_token_ids = [
+            self.tokenizer(label, add_special_tokens=False)["input_ids"][0]
+            for label in SENT_MODEL_LABELS
+        ]
+        self.label_sents = [
+            self.tokenizer.decode([decoder_start_id, token_id])
+            for token_id in self.label_token_ids
+        ]
 
-    def generate_processed_sents(self, normalised_sents):
+    def generate_processed_sents(
+        self, normalised_sents, max_batch_tokens=MAX_BATCH_TOKENS
+    ):
         """Tokenize, process and decode the results for a list of sents.
 
         Args:
             normalised_sents (str[]): List of normalised sent strings
+            max_batch_tokens (int): Maximum number of padded tokens in a single model batch
+
+        Returns:
+            new_processed_sents (str[]): List of processed sent strings
+        """
+        new_processed_sents, _ = self.score_processed_sents(
+            normalised_sents, max_batch_tokens
+        )
+        return new_processed_sents
+
+    def score_processed_sents(
+        self, normalised_sents, max_batch_tokens=MAX_BATCH_TOKENS
+    ):
+        """Tokenize, process and decode the results for a list of sents, along with the score
+        of every label when running in label scoring mode.
+
+        Args:
+            normalised_sents (str[]): List of normalised sent strings
+            max_batch_tokens (int): Maximum number of padded tokens in a single model batch
 
         Returns:
             new_processed_sents (str[]): List of processed sent strings
+            label_scores (Dict[]): List of label : probability dictionaries, or None for each
+                                   sent when running in generate mode
         """
         # I've tested this locally, it seems that this method of batch tokenizing, then processing
         #  sents with the model is faster than with a list comprehension, or for loop on
         #  individual sents. However, this may prove more memory expensive
 
-        # Tokenize a list of sents, creating a list of tokenized sents
-        inputs = self.tokenizer(
-            normalised_sents,
-            return_tensors="pt",
-        )
+        metrics = get_metrics()
+        # Tokenize the whole list once without padding, so we know the length of every sent
+        with metrics.time("tokenize"):
+            encodings = self.tokenizer(normalised_sents)
+        metrics.count("model_sents", len(normalised_sents))
+        metrics.count("tokens", sum(len(ids) for ids in encodings["input_ids"]))
+        new_processed_sents = [None] * len(normalised_sents)
+        label_scores = [None] * len(normalised_sents)
+        for batch_indexes in make_token_batches(
+            encodings["input_ids"], max_batch_tokens
+        ):
+            # Pad only to the longest sent in this batch
+            with metrics.time("tokenize"):
+                inputs = self.tokenizer.pad(
+                    {
+                        "input_ids": [encodings["input_ids"][i] for i in batch_indexes],
+                        "attention_mask": [
+                            encodings["attention_mask"][i] for i in batch_indexes
+                        ],
+                    },
+                    return_tensors="pt",
+                )
+            metrics.count("model_batches")
+            metrics.count("padded_tokens", inputs["input_ids"].numel())
+            if self.inference_mode == INFERENCE_MODE_LABEL_SCORING:
+                batch_sents, batch_scores = self._score_labels(inputs)
+            else:
+                batch_sents = self._generate(inputs)
+                batch_scores = [None] * len(batch_sents)
+            # Scatter the results back to the position of their original sent
+            for index, processed_sent, scores in zip(
+                batch_indexes, batch_sents, batch_scores
+            ):
+                new_processed_sents[index] = processed_sent
+                label_scores[index] = scores
+        return new_processed_sents, label_scores
+
+    def _generate(self, inputs):
+        """Run a padded batch through model.generate and detokenize the results"""
+        metrics = get_metrics()
         # Run the list of tokenized sents through the model
-        summaries = self.model.generate(**inputs, max_length=2)
+        with metrics.time("generate"):
+            summaries = self.model.generate(**inputs, max_length=2)
         # Detokenize the resulting processed sents
-        new_processed_sents = [self.tokenizer.decode(result) for result in summaries]
-        return new_processed_sents
+        with metrics.time("decode"):
+            return [self.tokenizer.decode(result) for result in summaries]
+
+    def _score_labels(self, inputs):
+        """Run a padded batch through one encoder pass and one decoder step, and pick the most
+        likely label out of the known label tokens"""
+        batch_len = inputs["input_ids"].shape[0]
+        decoder_input_ids = torch.full(
+            (batch_len, 1), self.model.config.decoder_start_token_id, dtype=torch.long
+        )
+        with get_metrics().time("generate"), torch.inference_mode():
+            logits = self.model(**inputs, decoder_input_ids=decoder_input_ids).logits
+        # Only the label tokens are valid outputs, so restrict the argmax to them
+        label_probs = torch.softmax(logits[:, -1, self.label_token_ids], dim=-1)
+        best_labels = label_probs.argmax(dim=-1).tolist()
+        batch_sents = [self.label_sents[label] for label in best_labels]
+        batch_scores = [
+            dict(zip(SENT_MODEL_LABELS, row)) for row in label_probs.tolist()
+        ]
+        return batch_sents, batch_scores
+
+
+def make_token_batches(token_ids, max_batch_tokens):
+    """Group sents into batches of similar length, where each padded batch holds at most
+    max_batch_tokens tokens. A sent longer than max_batch_tokens is given a batch of its own.
+
+    Args:
+        token_ids (int[][]): List of unpadded token ids for each sent
+        max_batch_tokens (int): Maximum number of padded tokens in a single batch
+
+    Returns:
+        batches (int[][]): List of batches, each a list of indexes into token_ids
+    """
+    # Sorting by length means the last sent added to a batch is always the longest, so the padded
+    # size of a batch is simply its length multiplied by the length of its last sent
+    sorted_indexes = sorted(range(len(token_ids)), key=lambda i: len(token_ids[i]))
+    batches = []
+    batch = []
+    for index in sorted_indexes:
+        padded_tokens = len(token_ids[index]) * (len(batch) + 1)
+        if len(batch) > 0 and padded_tokens > max_batch_tokens:
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
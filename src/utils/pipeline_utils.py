@@ -0,0 +1,93 @@
+"""The module for overlapping database lookups, inference and database writes"""
+
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# Marks the end of the items in prefetch_map, so None can still be a valid item
+_NO_ITEM = object()
+
+
+def prefetch_map(func, items, depth=1):
+    """Generator yielding func(item) for each item in order, while up to depth of the following
+    items are already being computed on a background thread. This lets the caller work on one
+    result while the next is fetched. func runs in a copy of the caller's context
+
+    Args:
+        func (callable): Function applied to each item
+        items (list): Items to apply func to
+        depth (int): Maximum number of results computed ahead of the caller
+
+    Yields:
+        The result of func for each item, in the order of items
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = deque()
+        item_iter = iter(items)
+        for item in item_iter:
+            pending.append(pool.submit(contextvars.copy_context().run, func, item))
+            if len(pending) >= depth:
+                break
+        while len(pending) > 0:
+            # Re-raises any exception from func, in the same order it would have been raised
+            # when running serially
+            result = pending.popleft().result()
+            next_item = next(item_iter, _NO_ITEM)
+            if next_item is not _NO_ITEM:
+                pending.append(
+                    pool.submit(contextvars.copy_context().run, func, next_item)
+                )
+            yield result
+
+
+class BackgroundWriter:
+    """Class for running writes on a thread pool, with a bound on the number of writes waiting
+    so memory stays flat. Writes run in a copy of the submitting context. Use as a context
+    manager so every write is joined before leaving
+    """
+
+    def __init__(self, write_func, max_workers, max_pending):
+        """Initialise the thread pool
+
+        Args:
+            write_func (callable): Function called with each submitted item
+            max_workers (int): Number of threads running writes
+            max_pending (int): Maximum number of unfinished writes, submit blocks beyond this
+        """
+        self.write_func = write_func
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = deque()
+
+    def submit(self, item):
+        """Queue an item to be written, waiting for the oldest write if too many are pending
+
+        Args:
+            item: Item passed to write_func
+        """
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        self._pending.append(
+            self._pool.submit(contextvars.copy_context().run, self.write_func, item)
+        )
+
+    def join(self):
+        """Wait for every pending write, re-raising the first failure"""
+        try:
+            while len(self._pending) > 0:
+                self._pending.popleft().result()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.join()
+        else:
+            # Let the writes already submitted finish, without hiding the original exception
+            self._pool.shutdown(wait=True)
@@ -1,18 +1,27 @@
 """The module for downloading the model from s3"""
 
 import io
+import json
 import logging
 import os
 import shutil
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
 
 import boto3
+from botocore.exceptions import ClientError
 
 from config.config import (
+    HOT_SET_FILE,
     MODEL_CHECKPOINT,
-    MODEL_ZIP_LOCATION,
+    MODEL_DOWNLOAD_CHUNK_BYTES,
+    MODEL_DOWNLOAD_WORKERS,
+    MODEL_MANIFEST_FILE,
+    MODEL_STAGING_DIR,
+    MODEL_VERIFY_CHECKSUMS,
     SENT_MODEL_FILE,
-    WRITEABLE_DIR,
+    SENT_MODEL_NAME,
 )
 
 logger = logging.getLogger()
@@ -22,20 +31,241 @@ BUCKET_NAME = os.environ.get("BUCKET_NAME")
 s3 = boto3.resource("s3")
 
 
+class S3RangeReader(io.RawIOBase):
+    """Seekable, read only file object over an s3 object. The object is fetched in fixed size
+    ranges on a thread pool, reading ahead of the current position, so a ZipFile can extract
+    straight from s3 without the zip ever being written to disk"""
+
+    def __init__(self, client, bucket, key, etag, size, chunk_bytes, max_workers):
+        """Initialise the reader without fetching anything
+
+        Args:
+            client (S3.Client): Client used to fetch ranges
+            bucket (string): Name of the bucket holding the object
+            key (string): Key of the object
+            etag (string): ETag of the object, every range must come from this version
+            size (int): Size of the object in bytes
+            chunk_bytes (int): Size of each fetched range
+            max_workers (int): Number of ranges fetched in parallel
+        """
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.etag = etag
+        self.size = size
+        self.chunk_bytes = chunk_bytes
+        self.max_workers = max_workers
+        self._pos = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        # Dictionary of chunk index : future of the chunk's bytes
+        self._chunks = {}
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        return self._pos
+
+    def readinto(self, buffer):
+        if self._pos >= self.size:
+            return 0
+        chunk_index = self._pos // self.chunk_bytes
+        chunk = self._get_chunk(chunk_index)
+        chunk_offset = self._pos - chunk_index * self.chunk_bytes
+        read_len = min(len(buffer), len(chunk) - chunk_offset)
+        buffer[:read_len] = chunk[chunk_offset : chunk_offset + read_len]
+        self._pos += read_len
+        return read_len
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._chunks = {}
+        super().close()
+
+    def _get_chunk(self, chunk_index):
+        """Return the bytes of a chunk, scheduling the following chunks to be fetched"""
+        last_index = (self.size - 1) // self.chunk_bytes
+        for index in range(
+            chunk_index, min(chunk_index + self.max_workers, last_index) + 1
+        ):
+            if index not in self._chunks:
+                self._chunks[index] = self._pool.submit(self._fetch_chunk, index)
+        # Zip members are extracted in order, so chunks behind the current one won't be needed
+        # again. Dropping them keeps memory bounded to the read ahead window
+        for index in [index for index in self._chunks if index < chunk_index - 1]:
+            del self._chunks[index]
+        return self._chunks[chunk_index].result()
+
+    def _fetch_chunk(self, chunk_index):
+        start = chunk_index * self.chunk_bytes
+        end = min(start + self.chunk_bytes, self.size) - 1
+        response = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={start}-{end}",
+            IfMatch=self.etag,
+        )
+        return response["Body"].read()
+
+
+def read_manifest():
+    """Read the manifest of the extracted model, if there is one
+
+    Returns:
+        manifest (Dict): The manifest, or None if there is no readable manifest
+    """
+    try:
+        with open(os.path.join(MODEL_CHECKPOINT, MODEL_MANIFEST_FILE)) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def verify_extracted_model(manifest, verify_checksums):
+    """Check every file listed in the manifest is present and intact
+
+    Args:
+        manifest (Dict): The manifest of the extracted model
+        verify_checksums (bool): Whether to check the crc32 of each file, as well as its size
+
+    Returns:
+        bool: True if the extracted model matches the manifest
+    """
+    for file_name, file_info in manifest["files"].items():
+        file_path = os.path.join(MODEL_CHECKPOINT, file_name)
+        if (
+            not os.path.isfile(file_path)
+            or os.path.getsize(file_path) != file_info["size"]
+        ):
+            return False
+        if verify_checksums:
+            crc = 0
+            with open(file_path, "rb") as model_file:
+                for block in iter(lambda: model_file.read(1024 * 1024), b""):
+                    crc = zlib.crc32(block, crc)
+            if crc != file_info["crc"]:
+                return False
+    return True
+
+
 # Huggingface requires the model is stored in a writeable directory, so we copy the model
 # to lambda's writeable temp memory at '/tmp/'
 # Connect to s3 bucket and download NLP model
 def download_new_model():
-    """Downloads model from s3 bucket and copies to writeable memory location, which allows it to be
-    read later
+    """Makes sure an intact copy of the model is extracted to writeable memory, which allows it
+    to be read later. An extraction left over from the last initialization is reused if it
+    matches the model in the s3 bucket, otherwise the model is streamed from s3 and extracted
+    """
+    head = s3.meta.client.head_object(Bucket=BUCKET_NAME, Key=SENT_MODEL_FILE)
+    etag = head["ETag"]
+    manifest = read_manifest()
+    if (
+        manifest is not None
+        and manifest["etag"] == etag
+        and verify_extracted_model(manifest, MODEL_VERIFY_CHECKSUMS)
+    ):
+        logger.info("Model %s already extracted, skipping download", etag)
+        return
+    logger.info("Downloading model")
+    extract_model_from_s3(etag, head["ContentLength"])
+    logger.info("Model unzipped to %s", MODEL_CHECKPOINT)
+
+
+def extract_model_from_s3(etag, size):
+    """Stream the model zip from s3 and extract it to MODEL_CHECKPOINT, with a manifest
+
+    Args:
+        etag (string): ETag of the model zip
+        size (int): Size of the model zip in bytes
     """
-    # A model may be left over from the last initialization, but we can't guarantee its integrity so
-    # delete and download fresh
+    # Extract to a staging directory first, so an interrupted extraction is never mistaken for
+    # a complete one
+    if os.path.isdir(MODEL_STAGING_DIR):
+        shutil.rmtree(MODEL_STAGING_DIR)
+    reader = S3RangeReader(
+        s3.meta.client,
+        BUCKET_NAME,
+        SENT_MODEL_FILE,
+        etag,
+        size,
+        MODEL_DOWNLOAD_CHUNK_BYTES,
+        MODEL_DOWNLOAD_WORKERS,
+    )
+    with io.BufferedReader(reader, MODEL_DOWNLOAD_CHUNK_BYTES) as zip_stream:
+        with ZipFile(zip_stream, "r") as model_zip:
+            # The zip holds the model in a directory named after it. Anything else in the zip,
+            # such as __MACOSX metadata, isn't part of the model and isn't extracted
+            prefix = SENT_MODEL_NAME + "/"
+            if not any(name.startswith(prefix) for name in model_zip.namelist()):
+                prefix = ""
+            # Extracting in the order the members are stored means the zip is read front to back
+            # ZipFile checks the crc32 of every member as it's extracted
+            members = sorted(
+                (
+                    member
+                    for member in model_zip.infolist()
+                    if member.filename.startswith(prefix)
+                ),
+                key=lambda info: info.header_offset,
+            )
+            for member in members:
+                model_zip.extract(member, MODEL_STAGING_DIR)
+    model_root = os.path.join(MODEL_STAGING_DIR, prefix)
+    manifest = {
+        "etag": etag,
+        "files": {
+            member.filename.removeprefix(prefix): {
+                "size": member.file_size,
+                "crc": member.CRC,
+            }
+            for member in members
+            if not member.is_dir()
+        },
+    }
+    with open(os.path.join(model_root, MODEL_MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
     if os.path.isdir(MODEL_CHECKPOINT):
         shutil.rmtree(MODEL_CHECKPOINT)
-    logger.info("Downloading model")
-    s3.meta.client.download_file(BUCKET_NAME, SENT_MODEL_FILE, MODEL_ZIP_LOCATION)
-    logger.info("Model downloaded")
-    with ZipFile(MODEL_ZIP_LOCATION, "r") as model_zip:
-        model_zip.extractall(WRITEABLE_DIR)
-    logger.info("Model unzipped to %s", WRITEABLE_DIR)
+    os.rename(os.path.normpath(model_root), MODEL_CHECKPOINT)
+    if os.path.isdir(MODEL_STAGING_DIR):
+        shutil.rmtree(MODEL_STAGING_DIR)
+
+
+def download_hot_set(target_path):
+    """Download the disk cache's hot set snapshot from next to the model in the s3 bucket,
+    unless it's already been downloaded in this sandbox
+
+    Args:
+        target_path (string): Location to download the snapshot to
+
+    Returns:
+        bool: True if the snapshot is at target_path, False if the bucket has no snapshot
+    """
+    if os.path.exists(target_path):
+        return True
+    try:
+        # Downloaded beside the target then renamed, so an interrupted download isn't used
+        s3.meta.client.download_file(
+            BUCKET_NAME, HOT_SET_FILE, target_path + ".partial"
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+        raise
+    os.replace(target_path + ".partial", target_path)
+    return True
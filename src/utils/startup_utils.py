@@ -0,0 +1,219 @@
+"""The module for profiling a cold start. Each phase of the module level init is timed along
+with the resident memory after it, and every import is timed, so one report shows where a cold
+start spends its time. This module must only import the standard library and config, as it's
+imported before anything it's meant to measure"""
+
+import builtins
+import contextlib
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from config.config import (
+    DEFAULT_STARTUP_PROFILE,
+    ENV_STARTUP_PROFILE_VAR_NAME,
+    STARTUP_PROFILE_TOP_IMPORTS,
+)
+from utils.env_utils import get_env_flag
+
+logger = logging.getLogger()
+
+
+def get_rss_mb():
+    """Return the current resident memory of the process in MB, or the peak where the current
+    value isn't available
+
+    Returns:
+        float: Resident memory in MB
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StartupProfiler:
+    """Class recording the phases of a cold start and the time spent importing each module.
+    A disabled profiler records nothing"""
+
+    def __init__(self, enabled, top_imports):
+        """Initialise the profiler, starting the clock and the import timing if enabled
+
+        Args:
+            enabled (bool): Whether to record anything
+            top_imports (int): Number of the slowest modules listed in the report
+        """
+        self.enabled = enabled
+        self.top_imports = top_imports
+        self.phases = []
+        # Self time of each imported module, excluding the modules it imported in turn
+        self.import_seconds = defaultdict(float)
+        self._start = time.perf_counter()
+        self._last_mark = self._start
+        self._last_mark_rss = get_rss_mb() if enabled else 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._finished = False
+        self._original_import = None
+        self._original_import_module = None
+        if enabled:
+            self._install_import_hooks()
+
+    def mark(self, name):
+        """Record a phase lasting from the previous mark, or the profiler's creation, until now
+
+        Args:
+            name (string): Name of the phase
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        rss = get_rss_mb()
+        with self._lock:
+            self._record(name, self._last_mark, now, self._last_mark_rss, rss)
+            self._last_mark = now
+            self._last_mark_rss = rss
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager recording the code inside it as a phase. Phases may be nested in a
+        marked phase, and may run on other threads
+
+        Args:
+            name (string): Name of the phase
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        start_rss = get_rss_mb()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._record(name, start, time.perf_counter(), start_rss, get_rss_mb())
+
+    def finish(self):
+        """Stop timing imports and print the report as one json line. Only the first call
+        does anything"""
+        with self._lock:
+            if not self.enabled or self._finished:
+                return
+            self._finished = True
+        self._remove_import_hooks()
+        print(json.dumps({"startup_profile": self.report()}))
+
+    def report(self):
+        """Return the recorded phases and import times
+
+        Returns:
+            Dict: The report
+        """
+        with self._lock:
+            package_seconds = defaultdict(float)
+            for module_name, seconds in self.import_seconds.items():
+                package_seconds[module_name.split(".")[0]] += seconds
+            return {
+                "total_ms": (time.perf_counter() - self._start) * 1000,
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                / 1024,
+                "phases": list(self.phases),
+                "import_packages_ms": _top_ms(package_seconds, self.top_imports),
+                "slowest_imports_ms": _top_ms(self.import_seconds, self.top_imports),
+            }
+
+    def _record(self, name, start, end, start_rss, end_rss):
+        """Add a phase to the report, must be called holding the lock"""
+        self.phases.append(
+            {
+                "name": name,
+                "start_ms": (start - self._start) * 1000,
+                "wall_ms": (end - start) * 1000,
+                "rss_mb": end_rss,
+                "rss_delta_mb": end_rss - start_rss,
+                "thread": threading.current_thread().name,
+            }
+        )
+
+    def _install_import_hooks(self):
+        """Wrap the import statement and importlib.import_module, which transformers uses for
+        its lazily loaded modules, with timers"""
+        self._original_import = builtins.__import__
+        self._original_import_module = importlib.import_module
+        original_import = self._original_import
+        original_import_module = self._original_import_module
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            module_name = name
+            if level > 0 and globals is not None:
+                module_name = _resolve_relative(name, globals, level)
+            return self._time_import(
+                module_name, original_import, name, globals, locals, fromlist, level
+            )
+
+        def timed_import_module(name, package=None):
+            module_name = name
+            if name.startswith(".") and package is not None:
+                module_name = _resolve_relative(name, {"__package__": package}, 0)
+            return self._time_import(module_name, original_import_module, name, package)
+
+        builtins.__import__ = timed_import
+        importlib.import_module = timed_import_module
+
+    def _remove_import_hooks(self):
+        """Restore the import functions replaced by _install_import_hooks"""
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            importlib.import_module = self._original_import_module
+            self._original_import = None
+
+    def _time_import(self, module_name, import_func, *args):
+        """Run an import, recording its self time if it loaded any new modules"""
+        # Each thread keeps its own stack of the time spent in nested imports
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        module_count = len(sys.modules)
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return import_func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if len(stack) > 0:
+                stack[-1] += elapsed
+            if len(sys.modules) != module_count:
+                with self._lock:
+                    self.import_seconds[module_name] += elapsed - nested
+
+
+def _resolve_relative(name, globals, level):
+    """Return the absolute name of a relative import, or name if it can't be resolved"""
+    try:
+        package = globals.get("__package__") or globals.get("__name__", "")
+        return importlib.util.resolve_name("." * level + name, package)
+    except (ImportError, ValueError):
+        return name
+
+
+def _top_ms(seconds_by_name, count):
+    """Return the count largest times, in milliseconds, as a dictionary"""
+    slowest = sorted(seconds_by_name.items(), key=lambda item: item[1], reverse=True)
+    return {name: seconds * 1000 for name, seconds in slowest[:count]}
+
+
+# Created on import, so the clock starts as early as this module is imported
+startup_profiler = StartupProfiler(
+    get_env_flag(ENV_STARTUP_PROFILE_VAR_NAME, DEFAULT_STARTUP_PROFILE),
+    STARTUP_PROFILE_TOP_IMPORTS,
+)
@@ -1,8 +1,12 @@
 """The module for normalising sentences"""
 
+import functools
+
 import demoji
 from unidecode import unidecode
 
+from config.config import NORMALISE_CACHE_SIZE
+
 
 def normalise_sent(sent):
     """Function for normalising sentences for use with an ascii only NLP model
@@ -19,3 +23,73 @@ def normalise_sent(sent):
     # Convert non ascii characters to ascii equivalent
     normalised_val = unidecode(normalised_val)
     return normalised_val.strip()
+
+
+@functools.cache
+def get_emoji_chars():
+    """Function returning every non ascii character used in an emoji. Every emoji contains at
+    least one of these, so a sentence without any of them can't contain an emoji. The set is
+    built once, on first use, from the same codes demoji matches against
+
+    Returns:
+        emoji_chars (frozenset): Set of characters
+    """
+    # demoji only exposes its codes through this module attribute, which is stable for the
+    # pinned version
+    demoji.set_emoji_pattern()
+    return frozenset(
+        char for code in demoji._CODE_TO_DESC for char in code if not char.isascii()
+    )
+
+
+@functools.lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def normalise_non_ascii_sent(sent):
+    """Function for normalising a sentence containing non ascii characters, giving the same
+    result as normalise_sent. Results are memoized, as this is the expensive path
+
+    Args:
+        sent (string): sentence to normalise
+    """
+    normalised_val = sent.lower()
+    # demoji scans with one very large regex, so only use it if there could be an emoji
+    if not get_emoji_chars().isdisjoint(normalised_val):
+        normalised_val = demoji.replace_with_desc(normalised_val, sep="")
+    normalised_val = unidecode(normalised_val)
+    return normalised_val.strip()
+
+
+def normalise_sents(sents):
+    """Function for normalising a list of sentences, giving the same results as calling
+    normalise_sent on each one
+
+    Args:
+        sents (str[]): sentences to normalise
+
+    Returns:
+        normalised_sents (str[]): normalised sentences, in the same order
+    """
+    # Emojis always contain non ascii characters, and unidecode leaves ascii unchanged, so
+    # pure ascii sentences only need lowercasing and stripping
+    return [
+        sent.lower().strip() if sent.isascii() else normalise_non_ascii_sent(sent)
+        for sent in sents
+    ]
+
+
+def group_sents_by_normalised(sents):
+    """Function for normalising a list of sents, grouping the original sents by their
+    normalised sent. Repeated original sents are only normalised once
+
+    Args:
+        sents (str[]): List of original sents
+
+    Returns:
+        grouped_sents (Dict): Dictionary of normalised_sent : list of original sents, in the
+                              order they were first seen
+    """
+    # dict.fromkeys drops repeated sents but, unlike set(), keeps the order deterministic
+    unique_sents = list(dict.fromkeys(sents))
+    grouped_sents = {}
+    for sent, normalised_sent in zip(unique_sents, normalise_sents(unique_sents)):
+        grouped_sents.setdefault(normalised_sent, []).append(sent)
+    return grouped_sents
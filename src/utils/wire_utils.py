@@ -0,0 +1,158 @@
+"""The module for decoding request bodies and encoding response bodies. Besides plain json,
+request bodies may be gzip compressed, base64 encoded, or newline delimited json, and
+responses may be gzip compressed or positional"""
+
+import base64
+import gzip
+import json
+import logging
+
+from config.config import (
+    CONTENT_ENCODING_GZIP,
+    CONTENT_TYPE_NDJSON,
+    RESPONSE_ENCODING_HEADER,
+    RESPONSE_ENCODING_KEY,
+    RESPONSE_FORMAT_HEADER,
+    RESPONSE_FORMAT_KEY,
+    RESPONSE_FORMAT_MAP,
+    SENT_LIST_KEY,
+    WIRE_GZIP_MIN_BYTES,
+)
+
+# orjson serializes several times faster than json, but is optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger()
+
+
+def dumps_json(payload):
+    """Serialize to compact json, with orjson if it's installed
+
+    Args:
+        payload (object): json serializable object
+
+    Returns:
+        bytes: utf-8 encoded json
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+
+
+def loads_json(data):
+    """Deserialize json, with orjson if it's installed
+
+    Args:
+        data (bytes): utf-8 encoded json
+
+    Returns:
+        object: The deserialized object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def get_header(event, name):
+    """Return a request header, matching its name case insensitively as HTTP does
+
+    Args:
+        event (Dict): The lambda event
+        name (string): Lower case name of the header
+
+    Returns:
+        string: The header value, or None if it isn't set
+    """
+    headers = event.get("headers") or {}
+    for header_name, value in headers.items():
+        if header_name.lower() == name:
+            return value
+    return None
+
+
+def decode_request_body(event):
+    """Decode the body of an API request. The body may be base64 encoded, as marked by
+    isBase64Encoded, gzip compressed, as marked by the Content-Encoding header, and either a
+    json object or newline delimited json, as marked by the Content-Type header. Each line of
+    newline delimited json is one sent
+
+    Args:
+        event (Dict): The lambda event
+
+    Returns:
+        body (Dict): The request fields
+    """
+    body = event["body"]
+    if body is None:
+        return {}
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    content_encoding = get_header(event, "content-encoding") or ""
+    if CONTENT_ENCODING_GZIP in content_encoding.lower():
+        body = gzip.decompress(body)
+    content_type = get_header(event, "content-type") or ""
+    if CONTENT_TYPE_NDJSON in content_type.lower():
+        return {
+            SENT_LIST_KEY: [
+                loads_json(line) for line in body.splitlines() if line.strip()
+            ]
+        }
+    return loads_json(body)
+
+
+def get_response_options(event, request_fields):
+    """Return the response format and compression asked for by a request field, or failing
+    that its header
+
+    Args:
+        event (Dict): The lambda event
+        request_fields (Dict): Fields of the event and its body
+
+    Returns:
+        response_format (string): RESPONSE_FORMAT_MAP or RESPONSE_FORMAT_POSITIONAL
+        compress (bool): Whether to gzip the response
+    """
+    response_format = request_fields.get(RESPONSE_FORMAT_KEY) or get_header(
+        event, RESPONSE_FORMAT_HEADER
+    )
+    # Compression must be asked for explicitly, as Accept-Encoding is sent by default by most
+    # clients, which expect the plain json body they have always had
+    response_encoding = request_fields.get(RESPONSE_ENCODING_KEY) or get_header(
+        event, RESPONSE_ENCODING_HEADER
+    )
+    return (
+        response_format or RESPONSE_FORMAT_MAP,
+        CONTENT_ENCODING_GZIP in (response_encoding or "").lower(),
+    )
+
+
+def encode_response_body(payload, compress, compact=True):
+    """Serialize a response body, gzip compressing it if asked to and large enough to benefit
+
+    Args:
+        payload (object): json serializable body
+        compress (bool): Whether the caller asked for a gzip compressed body
+        compact (bool): Whether to use compact json, otherwise the body is serialized the way
+                        responses always have been, for callers which haven't asked for a
+                        wire format
+
+    Returns:
+        body (string): The response body, base64 encoded if it's compressed
+        is_base64_encoded (bool): Whether the body is base64 encoded
+        headers (Dict): Headers describing the body
+    """
+    body = dumps_json(payload) if compact else json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if compress and len(body) >= WIRE_GZIP_MIN_BYTES:
+        headers["Content-Encoding"] = CONTENT_ENCODING_GZIP
+        # Compression level 1 is much faster than the default, for most of the size reduction
+        body = gzip.compress(body, compresslevel=1)
+        return base64.b64encode(body).decode("ascii"), True, headers
+    return body.decode("utf-8"), False, headers
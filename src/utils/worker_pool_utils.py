@@ -0,0 +1,299 @@
+"""The module for sharding inference across forked worker processes"""
+
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+logger = logging.getLogger()
+
+
+def _worker_main(model_handler, conn, cpu_ids, num_threads):
+    """Worker process loop, processing each list of sents received until None is received
+
+    Args:
+        model_handler (ModelHandler): Model handler inherited from the zygote by fork
+        conn (Connection): Connection to the parent
+        cpu_ids (int[]): CPUs to pin the worker to, or None to leave it unpinned
+        num_threads (int): Number of torch intra-op threads for the worker
+    """
+    import torch
+
+    if cpu_ids is not None:
+        os.sched_setaffinity(0, cpu_ids)
+    torch.set_num_threads(num_threads)
+    while True:
+        try:
+            normalised_sents = conn.recv()
+        except EOFError:
+            break
+        if normalised_sents is None:
+            break
+        try:
+            conn.send((True, model_handler.generate_processed_sents(normalised_sents)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+def _fork_worker(conn, model_handler, num_threads, cpu_ids):
+    """Fork a worker from the zygote, and send the parent its end of a new connection
+
+    Args:
+        conn (Connection): The zygote's connection to the parent
+        model_handler (ModelHandler): The zygote's loaded model handler
+        num_threads (int): Number of torch intra-op threads for the worker
+        cpu_ids (int[]): CPUs to pin the worker to, or None to leave it unpinned
+    """
+    parent_sock, worker_sock = socket.socketpair()
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            conn.close()
+            parent_sock.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            _worker_main(
+                model_handler, Connection(worker_sock.detach()), cpu_ids, num_threads
+            )
+        except BaseException:
+            logger.exception("Inference worker failed")
+            exit_code = 1
+        finally:
+            # Skip the zygote's exit handlers, which belong to the zygote
+            os._exit(exit_code)
+    worker_sock.close()
+    conn.send((True, pid))
+    reduction.send_handle(conn, parent_sock.fileno(), None)
+    parent_sock.close()
+
+
+def _zygote_main(conn):
+    """Zygote process loop. The model is loaded on the first request for a worker, and every
+    worker is forked from this process, which never starts any threads of its own
+
+    Args:
+        conn (Connection): Connection to the parent
+    """
+    # Exited workers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    model_handler = None
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        try:
+            if model_handler is None:
+                # The tokenizer's and torch's thread pools would otherwise be started while
+                # loading, and the workers forked after them
+                os.environ["TOKENIZERS_PARALLELISM"] = "false"
+                import torch
+
+                from utils.model_utils import ModelHandler
+
+                torch.set_num_threads(1)
+                model_handler = ModelHandler()
+                # Freezing moves every object created so far out of the garbage collector's
+                # reach, so collections in the workers don't write to (and so copy) the pages
+                # holding the model
+                gc.collect()
+                gc.freeze()
+            _fork_worker(conn, model_handler, *request)
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class WorkerZygote:
+    """Class for a clean process the inference workers are forked from. Forking a process with
+    other threads running can leave the child holding a lock one of those threads had, such as
+    a logging or pymongo lock, so the zygote is forked before the lambda starts any threads.
+    It loads the model itself once the model is downloaded, and forks every worker, so the
+    workers share its weights copy-on-write, and a worker which dies can be replaced"""
+
+    def __init__(self):
+        """Fork the zygote. Must be called before any other thread is started"""
+        # Lambda has no /dev/shm, so multiprocessing.Pool and Queue can't be used there. Plain
+        # processes talking over sockets work
+        context = multiprocessing.get_context("fork")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_zygote_main,
+            args=(child_conn,),
+            name="inference-zygote",
+            daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+
+    def start_worker(self, num_threads, cpu_ids):
+        """Fork a worker from the zygote, loading the model in the zygote the first time. The
+        model must already be downloaded
+
+        Args:
+            num_threads (int): Number of torch intra-op threads for the worker
+            cpu_ids (int[]): CPUs to pin the worker to, or None to leave it unpinned
+
+        Returns:
+            pid (int): Process id of the worker
+            conn (Connection): Connection to the worker
+        """
+        with self._lock:
+            try:
+                self._conn.send((num_threads, cpu_ids))
+                succeeded, result = self._conn.recv()
+                if not succeeded:
+                    raise RuntimeError(f"Couldn't start an inference worker: {result}")
+                return result, Connection(reduction.recv_handle(self._conn))
+            except (EOFError, OSError) as e:
+                raise RuntimeError("Inference zygote died") from e
+
+    def close(self):
+        """Stop the zygote. Workers already started carry on until their pool is closed"""
+        with self._lock:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+            self._conn.close()
+        self._process.join()
+
+
+class InferenceWorkerPool:
+    """Class for running the model on several worker processes forked from a WorkerZygote.
+    Batches are sharded across the workers and the results are merged back in order. A worker
+    which dies is replaced, and its shard is run again on the replacement. It has the same
+    generate_processed_sents method as ModelHandler, so it can be used in its place"""
+
+    def __init__(self, zygote, num_workers, threads_per_worker):
+        """Start the worker processes
+
+        Args:
+            zygote (WorkerZygote): Zygote to fork the workers from
+            num_workers (int): Number of worker processes
+            threads_per_worker (int): Number of torch intra-op threads in each worker
+        """
+        self.zygote = zygote
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.restarts = 0
+        available_cpus = sorted(os.sched_getaffinity(0))
+        self._cpu_ids = [
+            available_cpus[
+                worker_index
+                * threads_per_worker : (worker_index + 1)
+                * threads_per_worker
+            ]
+            or None
+            for worker_index in range(num_workers)
+        ]
+        self._workers = [
+            zygote.start_worker(threads_per_worker, cpu_ids)
+            for cpu_ids in self._cpu_ids
+        ]
+        # Each worker handles one shard at a time, so callers take turns using the pool
+        self._lock = threading.Lock()
+        logger.info(
+            "Started %d inference workers with %d threads each",
+            num_workers,
+            threads_per_worker,
+        )
+
+    def generate_processed_sents(self, normalised_sents):
+        """Tokenize, process and decode the results for a list of sents across the workers.
+
+        Args:
+            normalised_sents (str[]): List of normalised sent strings
+
+        Returns:
+            new_processed_sents (str[]): List of processed sent strings
+        """
+        # Split into contiguous shards of near equal size, so results concatenate in order
+        shard_len, remainder = divmod(len(normalised_sents), self.num_workers)
+        shards = []
+        start = 0
+        for worker_index in range(self.num_workers):
+            end = start + shard_len + (1 if worker_index < remainder else 0)
+            shards.append(normalised_sents[start:end])
+            start = end
+        with self._lock:
+            results = self._run_shards(shards)
+            # A worker which died is replaced and its shard run once more, any other failure
+            # is reported
+            dead_shards = [
+                shards[index] if result is None else []
+                for index, result in enumerate(results)
+            ]
+            if any(len(shard) > 0 for shard in dead_shards):
+                for index, result in enumerate(self._run_shards(dead_shards)):
+                    if len(dead_shards[index]) > 0:
+                        results[index] = result
+        new_processed_sents = []
+        for result in results:
+            if result is None:
+                raise RuntimeError("Inference worker died")
+            succeeded, processed_sents = result
+            if not succeeded:
+                raise RuntimeError(f"Inference worker failed: {processed_sents}")
+            new_processed_sents.extend(processed_sents)
+        return new_processed_sents
+
+    def _run_shards(self, shards):
+        """Send each non empty shard to its worker and wait for every result. Workers found
+        dead are replaced. Must be called holding the lock
+
+        Returns:
+            results (List): (succeeded, processed sents or error) for each shard, or None for
+                            a shard whose worker died
+        """
+        results = [(True, [])] * self.num_workers
+        busy_indexes = []
+        for index, shard in enumerate(shards):
+            if len(shard) == 0:
+                continue
+            try:
+                self._workers[index][1].send(shard)
+                busy_indexes.append(index)
+            except OSError:
+                results[index] = None
+        # Every busy worker must be read from, even after a failure, so the next caller
+        # doesn't receive a stale result
+        for index in busy_indexes:
+            try:
+                results[index] = self._workers[index][1].recv()
+            except (EOFError, OSError):
+                results[index] = None
+        for index, result in enumerate(results):
+            if result is None:
+                self._restart_worker(index)
+        return results
+
+    def _restart_worker(self, index):
+        """Replace a dead worker with a new one forked from the zygote"""
+        pid, conn = self._workers[index]
+        logger.warning("Inference worker %d died, starting a replacement", pid)
+        conn.close()
+        self.restarts += 1
+        self._workers[index] = self.zygote.start_worker(
+            self.threads_per_worker, self._cpu_ids[index]
+        )
+
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            for _, conn in self._workers:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                conn.close()
+            self._workers = []
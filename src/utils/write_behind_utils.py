@@ -0,0 +1,181 @@
+"""The module for buffering database writes and flushing them in bulk"""
+
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger()
+
+
+class WriteBehindBuffer:
+    """Class for collecting processed sents and writing them to the database in bulk. Repeated
+    sents are coalesced, both while waiting in the buffer and against sents recently written by
+    any invocation sharing the buffer. Request counts of sents can be buffered the same way. The
+    buffer is flushed when it's full, on a timer, and whenever flush is called, which must be done
+    before a lambda returns, as the environment is frozen afterwards"""
+
+    def __init__(
+        self,
+        write_func,
+        max_pending,
+        flush_interval_seconds,
+        max_recent_keys,
+        max_retry_sents,
+        hits_func=None,
+    ):
+        """Initialise an empty buffer, the flush timer is started on first use
+
+        Args:
+            write_func (callable): Function called with (normalised_sents, processed_sents)
+                                   lists, returning the number written or None on failure
+            max_pending (int): Number of buffered sents which triggers a flush
+            flush_interval_seconds (float): Maximum time sents wait before a timed flush
+            max_recent_keys (int): Number of written sents remembered to skip repeat writes
+            max_retry_sents (int): Maximum number of buffered sents after putting back the sents
+                                   of a failed flush, beyond which the failed sents are dropped
+            hits_func (callable): Function called with a dictionary of normalised_sent : count
+                                  to add to the request counts, needed to use add_hits
+        """
+        self.write_func = write_func
+        self.hits_func = hits_func
+        self.max_pending = max_pending
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_recent_keys = max_recent_keys
+        self.max_retry_sents = max_retry_sents
+        # Dictionary of normalised_sent : processed_sent waiting to be written
+        self._pending = {}
+        # Counter of normalised_sent : requests not yet added to the database
+        self._pending_hits = Counter()
+        # OrderedDict of recently written normalised_sent : None, oldest first
+        self._recent_keys = OrderedDict()
+        self._lock = threading.Lock()
+        # Only one flush writes at a time, so a timed flush can't race one from a caller
+        self._flush_lock = threading.Lock()
+        self._timer_thread = None
+        self._timer_wakeup = threading.Event()
+        self.flushes = 0
+        self.docs_written = 0
+        self.docs_deduplicated = 0
+        self.failed_flushes = 0
+        self.docs_retried = 0
+        self.docs_dropped = 0
+        self.last_flush_seconds = 0
+        self.max_flush_seconds = 0
+        self.total_flush_seconds = 0
+
+    def add_many(self, processed_sents):
+        """Buffer several processed sents, flushing if the buffer is full
+
+        Args:
+            processed_sents (Dict): Dictionary of normalised_sent : processed_sent
+        """
+        with self._lock:
+            if self._timer_thread is None:
+                self._timer_thread = threading.Thread(
+                    target=self._flush_on_timer, name="write-behind", daemon=True
+                )
+                self._timer_thread.start()
+            for sent, processed_sent in processed_sents.items():
+                if sent in self._pending or sent in self._recent_keys:
+                    self.docs_deduplicated += 1
+                else:
+                    self._pending[sent] = processed_sent
+            is_full = len(self._pending) >= self.max_pending
+        if is_full:
+            self.flush()
+
+    def add_hits(self, normalised_sents):
+        """Buffer one request for each of several sents, written on the next flush
+
+        Args:
+            normalised_sents (str[]): List of requested normalised sents
+        """
+        with self._lock:
+            self._pending_hits.update(normalised_sents)
+
+    def flush(self):
+        """Write every buffered sent, then every buffered request count, to the database"""
+        with self._flush_lock:
+            self._flush_sents()
+            with self._lock:
+                hits = self._pending_hits
+                self._pending_hits = Counter()
+            # Counts are only added to stored sents, so they're written after the sents. A
+            # failed update only loses counts, which are approximate anyway
+            if len(hits) > 0:
+                self.hits_func(dict(hits))
+
+    def _flush_sents(self):
+        """Write every buffered sent to the database, the caller must hold the flush lock"""
+        with self._lock:
+            batch = self._pending
+            self._pending = {}
+        if len(batch) == 0:
+            return
+        flush_start = time.perf_counter()
+        written_count = self.write_func(list(batch.keys()), list(batch.values()))
+        flush_seconds = time.perf_counter() - flush_start
+        with self._lock:
+            self.flushes += 1
+            self.last_flush_seconds = flush_seconds
+            self.max_flush_seconds = max(self.max_flush_seconds, flush_seconds)
+            self.total_flush_seconds += flush_seconds
+            if written_count is None:
+                # The sents weren't written, so they're put back to be written on the next
+                # flush. Sents buffered since, then the newest failed sents, are kept in
+                # preference, and the failed sents beyond max_retry_sents are dropped, so an
+                # outage can't grow the buffer without limit. Dropped sents are processed again
+                # by the next lambda to see them
+                self.failed_flushes += 1
+                retry_sents = [sent for sent in batch if sent not in self._pending]
+                retry_count = max(
+                    0, min(len(retry_sents), self.max_retry_sents - len(self._pending))
+                )
+                pending = {
+                    sent: batch[sent]
+                    for sent in retry_sents[len(retry_sents) - retry_count :]
+                }
+                pending.update(self._pending)
+                self._pending = pending
+                self.docs_retried += retry_count
+                self.docs_dropped += len(retry_sents) - retry_count
+                logger.warning(
+                    "Write-behind flush failed, %d sents kept to retry, %d dropped",
+                    retry_count,
+                    len(retry_sents) - retry_count,
+                )
+                return
+            self.docs_written += written_count
+            self._recent_keys.update(dict.fromkeys(batch))
+            while len(self._recent_keys) > self.max_recent_keys:
+                self._recent_keys.popitem(last=False)
+
+    def stats(self):
+        """Return the buffer metrics
+
+        Returns:
+            stats (Dict): Dictionary of metric name : value
+        """
+        with self._lock:
+            return {
+                "queue_depth": len(self._pending),
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                "docs_retried": self.docs_retried,
+                "docs_dropped": self.docs_dropped,
+                "docs_written": self.docs_written,
+                "docs_deduplicated": self.docs_deduplicated,
+                "last_flush_seconds": self.last_flush_seconds,
+                "max_flush_seconds": self.max_flush_seconds,
+                "mean_flush_seconds": self.total_flush_seconds / max(self.flushes, 1),
+            }
+
+    def _flush_on_timer(self):
+        """Thread target flushing the buffer every flush interval"""
+        while True:
+            self._timer_wakeup.wait(self.flush_interval_seconds)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Timed write-behind flush failed")
@@ -0,0 +1,9 @@
+"""Shared test setup, putting src on the path the way the lambda image does, and the benchmarks
+directory on the path for the local stand-ins they share with the tests"""
+
+import os
+import sys
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(_ROOT, "src"))
+sys.path.insert(1, os.path.join(_ROOT, "benchmarks"))
@@ -0,0 +1,78 @@
+"""Tests for the bloom filter of stored sents shared by several lambdas, with mongomock standing
+in for MongoDB"""
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from utils.bloom_utils import SentMembershipIndex  # noqa: E402
+from utils.lock_utils import MongoLeaseLock  # noqa: E402
+
+STORED_KEYS = [f"stored sent {index}" for index in range(1000)]
+NEW_KEYS = [f"new sent {index}" for index in range(100)]
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    db.sents.insert_many([{"key": key} for key in STORED_KEYS])
+    return db
+
+
+def make_index(db, max_bytes=1024 * 1024, max_lag_seconds=60):
+    """Return an index as each lambda makes it, sharing the database's collections"""
+    return SentMembershipIndex(
+        db.sents,
+        "key",
+        db.snapshots,
+        1000,
+        0.01,
+        max_bytes,
+        3600,
+        MongoLeaseLock(db.locks, "bloom_rebuild:sents", 900, 0, 0.01, 0.01),
+        60,
+        db.log,
+        2,
+        max_lag_seconds,
+        60,
+        3 * 3600,
+    )
+
+
+def test_sents_stored_by_another_lambda_are_looked_up(db):
+    builder = make_index(db)
+    builder.rebuild()
+    other = make_index(db)
+    other.load_snapshot()
+    # A filter isn't trusted until it has caught up with the log
+    assert other.filter_keys(NEW_KEYS) == NEW_KEYS
+    assert other.sync()
+    assert other.filter_keys(STORED_KEYS) == STORED_KEYS
+    assert len(other.filter_keys(NEW_KEYS)) < 5
+
+    builder.add_many(NEW_KEYS[:50])
+    assert builder.filter_keys(NEW_KEYS[:50]) == NEW_KEYS[:50]
+    assert other.sync()
+    assert other.filter_keys(NEW_KEYS[:50]) == NEW_KEYS[:50]
+    # Entries read again within the margin aren't counted twice
+    assert other.sync()
+    assert other.stats()["log_entries_read"] == 1
+
+
+def test_lagging_filter_reports_every_key(db):
+    index = make_index(db, max_lag_seconds=0)
+    index.rebuild()
+    assert index.sync()
+
+    assert index.filter_keys(NEW_KEYS) == NEW_KEYS
+    assert index.stats()["unsynced_lookups"] == 1
+
+
+def test_filter_size_is_capped(db):
+    db.sents.insert_many([{"key": f"extra sent {index}"} for index in range(20000)])
+    index = make_index(db, max_bytes=4096)
+    index.rebuild()
+
+    assert len(db.snapshots.find_one()["filter"]) <= 4096
+    assert index.sync()
+    assert index.filter_keys(STORED_KEYS) == STORED_KEYS
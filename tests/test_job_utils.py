@@ -0,0 +1,148 @@
+"""Tests for asynchronous jobs, through the lambda handler and the job store, with mongomock
+standing in for MongoDB and moto for s3. Every sent is stored in advance, so the model is never
+needed"""
+
+import datetime
+import importlib
+import json
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+moto = pytest.importorskip("moto")
+
+from config.config import (  # noqa: E402
+    ENV_BUCKET_VAR_NAME,
+    ENV_DB_VAR_NAME,
+    ENV_JOB_SELF_INVOKE_VAR_NAME,
+    ENV_LAZY_MODEL_LOAD_VAR_NAME,
+    ENV_URI_VAR_NAME,
+    JOB_ACTION_KEY,
+    JOB_ACTION_RESULTS,
+    JOB_ACTION_RUN,
+    JOB_ACTION_STATUS,
+    JOB_ACTION_SUBMIT,
+    JOB_ID_KEY,
+    JOB_PAGE_KEY,
+    SENT_LIST_KEY,
+)
+from utils.job_utils import JobStore  # noqa: E402
+from utils.text_utils import normalise_sent  # noqa: E402
+
+SENTS = [f"Job sent number {index}" for index in range(9)]
+
+
+@pytest.fixture(scope="module")
+def app():
+    with pytest.MonkeyPatch.context() as monkeypatch, moto.mock_aws():
+        monkeypatch.setenv(ENV_DB_VAR_NAME, "job_test")
+        monkeypatch.setenv(ENV_URI_VAR_NAME, "mongodb://localhost")
+        monkeypatch.setenv(ENV_BUCKET_VAR_NAME, "job-test-bucket")
+        monkeypatch.setenv(ENV_LAZY_MODEL_LOAD_VAR_NAME, "1")
+        monkeypatch.setenv(ENV_JOB_SELF_INVOKE_VAR_NAME, "0")
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        import utils.db_utils as db_utils
+
+        monkeypatch.setattr(db_utils, "MongoClient", mongomock.MongoClient)
+        app = importlib.import_module("app")
+        # Small chunks and pages, so a job spans several of each
+        monkeypatch.setattr(app, "JOB_CHUNK_SIZE", 2)
+        monkeypatch.setattr(app, "JOB_RESULTS_PAGE_CHUNKS", 2)
+        app.db_handler.store_sents(
+            [normalise_sent(sent) for sent in SENTS],
+            [f"<pad> label {index % 3}" for index in range(len(SENTS))],
+        )
+        yield app
+
+
+def call(app, **fields):
+    response = app.lambda_handler(fields, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_job_results_are_paged(app):
+    expected = app.process_request(SENTS, 10)
+    status_code, job = call(
+        app, **{JOB_ACTION_KEY: JOB_ACTION_SUBMIT, SENT_LIST_KEY: SENTS}
+    )
+    assert status_code == 202
+    assert job["status"] == "pending"
+    assert job["total_chunks"] == 5
+    job_id = job[JOB_ID_KEY]
+
+    status_code, run = call(app, **{JOB_ACTION_KEY: JOB_ACTION_RUN, JOB_ID_KEY: job_id})
+    assert status_code == 200
+    assert run["chunks_processed"] == 5
+    status_code, job = call(
+        app, **{JOB_ACTION_KEY: JOB_ACTION_STATUS, JOB_ID_KEY: job_id}
+    )
+    assert job["status"] == "done"
+    assert job["done_chunks"] == 5
+
+    results = {}
+    page_starts = []
+    next_chunk = 0
+    while next_chunk is not None:
+        page_starts.append(next_chunk)
+        status_code, page = call(
+            app,
+            **{
+                JOB_ACTION_KEY: JOB_ACTION_RESULTS,
+                JOB_ID_KEY: job_id,
+                JOB_PAGE_KEY: next_chunk,
+            },
+        )
+        assert status_code == 200
+        results |= page["results"]
+        next_chunk = page[JOB_PAGE_KEY]
+    assert page_starts == [0, 2, 4]
+    assert results == expected
+
+    # Passing back the next_chunk of the last page gives an empty page, not an error
+    status_code, page = call(
+        app,
+        **{JOB_ACTION_KEY: JOB_ACTION_RESULTS, JOB_ID_KEY: job_id, JOB_PAGE_KEY: None},
+    )
+    assert status_code == 200
+    assert page["results"] == {}
+    assert page[JOB_PAGE_KEY] is None
+    status_code, _ = call(
+        app,
+        **{JOB_ACTION_KEY: JOB_ACTION_RESULTS, JOB_ID_KEY: job_id, JOB_PAGE_KEY: "x"},
+    )
+    assert status_code == 400
+
+
+def test_expired_lease_is_taken_over():
+    db = mongomock.MongoClient().db
+    job_store = JobStore(db.jobs, db.job_chunks, 300, 3)
+    job = job_store.create_job(SENTS[:2], 2, 1024)
+    stale_chunk = job_store.claim_chunk(job["_id"])
+    assert job_store.claim_chunk(job["_id"]) is None
+
+    # The first claim's invocation runs past its lease
+    db.job_chunks.update_one(
+        {"_id": stale_chunk["_id"]},
+        {
+            "$set": {
+                "lease_until": datetime.datetime.utcnow()
+                - datetime.timedelta(seconds=1)
+            }
+        },
+    )
+    chunk = job_store.claim_chunk(job["_id"])
+    assert chunk["_id"] == stale_chunk["_id"]
+    assert chunk["owner"] != stale_chunk["owner"]
+
+    # The stale owner can neither finish nor release the chunk it lost
+    assert not job_store.complete_chunk(stale_chunk, ["<pad> stale", "<pad> stale"])
+    assert not job_store.fail_chunk(stale_chunk, "timed out")
+    assert db.job_chunks.find_one({"_id": chunk["_id"]})["owner"] == chunk["owner"]
+    assert job_store.complete_chunk(chunk, ["<pad> joy", "<pad> anger"])
+    job = job_store.get_job(job["_id"])
+    assert job["status"] == "done"
+    assert job["done_chunks"] == 1
+    assert job_store.get_results_page(job["_id"], 0, 4) == (
+        dict(zip(SENTS[:2], ["<pad> joy", "<pad> anger"])),
+        None,
+    )
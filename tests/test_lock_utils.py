@@ -0,0 +1,105 @@
+"""Tests for the model download locks, with mongomock standing in for MongoDB"""
+
+import datetime
+import threading
+
+import pytest
+
+from utils.lock_utils import LocalLock, MongoLeaseLock
+
+mongomock = pytest.importorskip("mongomock")
+
+LOCK_ID = "test_lock"
+
+
+@pytest.fixture
+def lock_col():
+    return mongomock.MongoClient().db.locks
+
+
+def make_lock(lock_col, lease_seconds=60, max_wait_seconds=0.05):
+    return MongoLeaseLock(
+        lock_col,
+        LOCK_ID,
+        lease_seconds,
+        max_wait_seconds,
+        base_delay_seconds=0.01,
+        max_delay_seconds=0.02,
+    )
+
+
+def test_takes_over_legacy_lock_without_expiry(lock_col):
+    # Locks written before leases were added only have the locked flag
+    lock_col.insert_one({"_id": LOCK_ID, "locked": True})
+    lock = make_lock(lock_col)
+
+    assert lock.try_acquire()
+    assert lock_col.find_one({"_id": LOCK_ID})["owner"] == lock.owner_id
+
+
+def test_held_lock_is_not_acquired(lock_col):
+    holder = make_lock(lock_col)
+    waiter = make_lock(lock_col)
+    holder.acquire()
+
+    assert not waiter.try_acquire()
+    with pytest.raises(TimeoutError):
+        waiter.acquire()
+    assert lock_col.find_one({"_id": LOCK_ID})["owner"] == holder.owner_id
+
+
+def test_released_lock_can_be_acquired(lock_col):
+    holder = make_lock(lock_col)
+    waiter = make_lock(lock_col)
+    with holder:
+        assert not waiter.try_acquire()
+
+    assert waiter.try_acquire()
+
+
+def test_expired_lease_is_taken_over(lock_col):
+    holder = make_lock(lock_col)
+    holder.acquire()
+    lock_col.update_one(
+        {"_id": LOCK_ID},
+        {
+            "$set": {
+                "expires_at": datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+            }
+        },
+    )
+    taker = make_lock(lock_col)
+
+    assert taker.try_acquire()
+    assert lock_col.find_one({"_id": LOCK_ID})["owner"] == taker.owner_id
+
+
+def test_release_after_takeover_leaves_new_holder(lock_col):
+    holder = make_lock(lock_col, lease_seconds=-1)
+    holder.acquire()
+    taker = make_lock(lock_col)
+    taker.acquire()
+
+    holder.release()
+
+    doc = lock_col.find_one({"_id": LOCK_ID})
+    assert doc["locked"]
+    assert doc["owner"] == taker.owner_id
+    assert not make_lock(lock_col).try_acquire()
+
+
+def test_local_lock_excludes_other_threads(tmp_path):
+    lock = LocalLock("test_local_lock", str(tmp_path))
+    other = LocalLock("test_local_lock", str(tmp_path))
+    acquired = threading.Event()
+
+    def take_other():
+        with other:
+            acquired.set()
+
+    with lock:
+        thread = threading.Thread(target=take_other)
+        thread.start()
+        assert not acquired.wait(0.1)
+    thread.join(1)
+    assert acquired.is_set()
@@ -0,0 +1,87 @@
+"""Tests for the inference modes and backends, run on a tiny stand-in T5 whose labels are each
+a single token and which always answers with a label, like the fine-tuned model"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("sentencepiece")
+
+from config.config import (  # noqa: E402
+    ENV_INFERENCE_BACKEND_VAR_NAME,
+    ENV_INFERENCE_MODE_VAR_NAME,
+    INFERENCE_BACKEND_TORCH,
+    INFERENCE_BACKEND_TORCH_INT8,
+    INFERENCE_MODE_GENERATE,
+    INFERENCE_MODE_LABEL_SCORING,
+    SENT_MODEL_LABELS,
+)
+from corpus import PARITY_CORPUS  # noqa: E402
+from stand_ins import make_tiny_t5  # noqa: E402
+
+# The same minimum as benchmarks/backend_benchmark.py. Quantizing can flip sents whose top two
+# labels are nearly tied
+MIN_INT8_AGREEMENT = 0.95
+
+SENTS = [sent.lower() for sent in PARITY_CORPUS]
+
+
+@pytest.fixture(scope="module")
+def model_checkpoint(tmp_path_factory):
+    model_dir = str(tmp_path_factory.mktemp("model"))
+    make_tiny_t5(model_dir)
+    return model_dir
+
+
+@pytest.fixture
+def make_handler(model_checkpoint, monkeypatch):
+    import utils.model_utils as model_utils
+
+    monkeypatch.setattr(model_utils, "MODEL_CHECKPOINT", model_checkpoint)
+
+    def make(backend, mode):
+        monkeypatch.setenv(ENV_INFERENCE_BACKEND_VAR_NAME, backend)
+        monkeypatch.setenv(ENV_INFERENCE_MODE_VAR_NAME, mode)
+        return model_utils.ModelHandler()
+
+    return make
+
+
+@pytest.mark.parametrize(
+    "backend", [INFERENCE_BACKEND_TORCH, INFERENCE_BACKEND_TORCH_INT8]
+)
+def test_label_scoring_matches_generate(make_handler, backend):
+    generated = make_handler(backend, INFERENCE_MODE_GENERATE).generate_processed_sents(
+        SENTS
+    )
+    scorer = make_handler(backend, INFERENCE_MODE_LABEL_SCORING)
+    scored, label_scores = scorer.score_processed_sents(SENTS)
+
+    assert scored == generated
+    # The stand-in answers with more than one label, so the comparison means something
+    assert len(set(generated)) > 1
+    for processed_sent, scores in zip(scored, label_scores):
+        assert processed_sent.split()[-1] == max(scores, key=scores.get)
+        assert set(scores) == set(SENT_MODEL_LABELS)
+        assert sum(scores.values()) == pytest.approx(1)
+
+
+def test_int8_backend_agrees_with_torch(make_handler):
+    fp32 = make_handler(
+        INFERENCE_BACKEND_TORCH, INFERENCE_MODE_GENERATE
+    ).generate_processed_sents(SENTS)
+    int8 = make_handler(
+        INFERENCE_BACKEND_TORCH_INT8, INFERENCE_MODE_GENERATE
+    ).generate_processed_sents(SENTS)
+
+    labels = {f"<pad> {label}" for label in SENT_MODEL_LABELS}
+    assert set(int8) <= labels
+    agreement = sum(a == b for a, b in zip(fp32, int8)) / len(SENTS)
+    assert agreement >= MIN_INT8_AGREEMENT
+
+
+def test_batches_give_the_same_results(make_handler):
+    handler = make_handler(INFERENCE_BACKEND_TORCH, INFERENCE_MODE_GENERATE)
+    whole = handler.generate_processed_sents(SENTS)
+    # A small token budget splits the sents into many padded batches
+    assert handler.generate_processed_sents(SENTS, max_batch_tokens=64) == whole
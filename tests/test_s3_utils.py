@@ -0,0 +1,133 @@
+"""Tests for downloading and caching the extracted model, with moto standing in for s3"""
+
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+import boto3  # noqa: E402
+
+import utils.s3_utils as s3_utils  # noqa: E402
+from config.config import (  # noqa: E402
+    MODEL_MANIFEST_FILE,
+    SENT_MODEL_FILE,
+    SENT_MODEL_NAME,
+)
+
+BUCKET = "test-model-bucket"
+
+MODEL_FILES = {
+    "config.json": b'{"model_type": "t5"}',
+    "pytorch_model.bin": bytes(range(256)) * 64,
+}
+
+
+def make_model_zip(model_files, extra_files=None):
+    zip_bytes = io.BytesIO()
+    with zipfile.ZipFile(zip_bytes, "w") as model_zip:
+        for file_name, data in (extra_files or {}).items():
+            model_zip.writestr(file_name, data)
+        for file_name, data in model_files.items():
+            model_zip.writestr(f"{SENT_MODEL_NAME}/{file_name}", data)
+    return zip_bytes.getvalue()
+
+
+@pytest.fixture
+def bucket(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    with moto.mock_aws():
+        s3 = boto3.resource("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(s3_utils, "s3", s3)
+        monkeypatch.setattr(s3_utils, "BUCKET_NAME", BUCKET)
+        monkeypatch.setattr(s3_utils, "MODEL_CHECKPOINT", str(tmp_path / "model"))
+        monkeypatch.setattr(
+            s3_utils, "MODEL_STAGING_DIR", str(tmp_path / "model.partial")
+        )
+        monkeypatch.setattr(s3_utils, "MODEL_VERIFY_CHECKSUMS", True)
+        # Small ranges, so the zip is read in many parallel range requests
+        monkeypatch.setattr(s3_utils, "MODEL_DOWNLOAD_CHUNK_BYTES", 1024)
+        yield s3.Bucket(BUCKET)
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """Count the times the model is downloaded and extracted"""
+    calls = []
+    extract = s3_utils.extract_model_from_s3
+
+    def counting_extract(etag, size):
+        calls.append(etag)
+        extract(etag, size)
+
+    monkeypatch.setattr(s3_utils, "extract_model_from_s3", counting_extract)
+    return calls
+
+
+def read_extracted(file_name):
+    with open(os.path.join(s3_utils.MODEL_CHECKPOINT, file_name), "rb") as model_file:
+        return model_file.read()
+
+
+def test_extracted_model_is_reused(bucket, extractions):
+    bucket.put_object(Key=SENT_MODEL_FILE, Body=make_model_zip(MODEL_FILES))
+
+    s3_utils.download_new_model()
+    s3_utils.download_new_model()
+
+    assert len(extractions) == 1
+    for file_name, data in MODEL_FILES.items():
+        assert read_extracted(file_name) == data
+
+
+def test_changed_etag_downloads_again(bucket, extractions):
+    bucket.put_object(Key=SENT_MODEL_FILE, Body=make_model_zip(MODEL_FILES))
+    s3_utils.download_new_model()
+    new_files = MODEL_FILES | {"config.json": b'{"model_type": "t5", "v": 2}'}
+    bucket.put_object(Key=SENT_MODEL_FILE, Body=make_model_zip(new_files))
+
+    s3_utils.download_new_model()
+
+    assert len(extractions) == 2
+    assert extractions[0] != extractions[1]
+    assert read_extracted("config.json") == new_files["config.json"]
+
+
+def test_corrupt_file_downloads_again(bucket, extractions):
+    bucket.put_object(Key=SENT_MODEL_FILE, Body=make_model_zip(MODEL_FILES))
+    s3_utils.download_new_model()
+    # Same size, different contents, so only the checksum catches it
+    weights_path = os.path.join(s3_utils.MODEL_CHECKPOINT, "pytorch_model.bin")
+    with open(weights_path, "r+b") as weights_file:
+        weights_file.write(b"\xff" * 16)
+
+    s3_utils.download_new_model()
+
+    assert len(extractions) == 2
+    assert read_extracted("pytorch_model.bin") == MODEL_FILES["pytorch_model.bin"]
+
+
+def test_files_outside_the_model_directory_are_ignored(bucket, extractions):
+    extra_files = {
+        f"__MACOSX/{SENT_MODEL_NAME}/._config.json": b"resource fork",
+        "README.txt": b"not part of the model",
+    }
+    bucket.put_object(
+        Key=SENT_MODEL_FILE, Body=make_model_zip(MODEL_FILES, extra_files)
+    )
+
+    s3_utils.download_new_model()
+    s3_utils.download_new_model()
+
+    assert len(extractions) == 1
+    manifest = json.loads(read_extracted(MODEL_MANIFEST_FILE))
+    assert set(manifest["files"]) == set(MODEL_FILES)
+    assert sorted(os.listdir(s3_utils.MODEL_CHECKPOINT)) == sorted(
+        list(MODEL_FILES) + [MODEL_MANIFEST_FILE]
+    )
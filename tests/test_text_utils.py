@@ -0,0 +1,22 @@
+"""Tests that the batched sent normalisation gives exactly what normalising one sent at a time
+does"""
+
+import pytest
+
+pytest.importorskip("hypothesis")
+
+from hypothesis import example, given, settings  # noqa: E402
+from hypothesis import strategies as st  # noqa: E402
+
+from corpus import NON_ASCII_SENTS, PARITY_CORPUS  # noqa: E402
+from utils.text_utils import normalise_sent, normalise_sents  # noqa: E402
+
+# Draw from ascii, emoji and accented characters so every path is exercised
+emoji_text = st.sampled_from(NON_ASCII_SENTS + ["🙂", "‍", "️", "é", "　", "ǅ"])
+
+
+@settings(max_examples=500, deadline=None)
+@given(st.lists(st.one_of(st.text(), emoji_text, st.lists(emoji_text).map("".join))))
+@example(PARITY_CORPUS + NON_ASCII_SENTS)
+def test_normalise_sents_matches_normalise_sent(sents):
+    assert normalise_sents(sents) == [normalise_sent(sent) for sent in sents]
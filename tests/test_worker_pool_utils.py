@@ -0,0 +1,68 @@
+"""Tests for the inference worker pool, run on the tiny stand-in T5"""
+
+import os
+import signal
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("sentencepiece")
+
+from config.config import (  # noqa: E402
+    ENV_INFERENCE_BACKEND_VAR_NAME,
+    ENV_INFERENCE_MODE_VAR_NAME,
+    INFERENCE_BACKEND_TORCH,
+    INFERENCE_MODE_GENERATE,
+)
+from corpus import PARITY_CORPUS  # noqa: E402
+from stand_ins import make_tiny_t5  # noqa: E402
+
+SENTS = [sent.lower() for sent in PARITY_CORPUS]
+
+
+@pytest.fixture(scope="module")
+def model_checkpoint(tmp_path_factory):
+    model_dir = str(tmp_path_factory.mktemp("model"))
+    make_tiny_t5(model_dir)
+    return model_dir
+
+
+@pytest.fixture
+def model_utils(model_checkpoint, monkeypatch):
+    import utils.model_utils as model_utils
+
+    monkeypatch.setattr(model_utils, "MODEL_CHECKPOINT", model_checkpoint)
+    monkeypatch.setenv(ENV_INFERENCE_BACKEND_VAR_NAME, INFERENCE_BACKEND_TORCH)
+    monkeypatch.setenv(ENV_INFERENCE_MODE_VAR_NAME, INFERENCE_MODE_GENERATE)
+    return model_utils
+
+
+@pytest.fixture
+def pool(model_utils):
+    from utils.worker_pool_utils import InferenceWorkerPool, WorkerZygote
+
+    # The zygote is forked after the patches above, so it loads the stand-in
+    zygote = WorkerZygote()
+    pool = InferenceWorkerPool(zygote, 2, 1)
+    yield pool
+    pool.close()
+    zygote.close()
+
+
+def test_pool_matches_handler(model_utils, pool):
+    expected = model_utils.ModelHandler().generate_processed_sents(SENTS)
+
+    assert pool.generate_processed_sents(SENTS) == expected
+    # Fewer sents than workers leaves a shard empty
+    assert pool.generate_processed_sents(SENTS[:1]) == expected[:1]
+
+
+def test_dead_worker_is_replaced(model_utils, pool):
+    expected = model_utils.ModelHandler().generate_processed_sents(SENTS)
+    os.kill(pool._workers[0][0], signal.SIGKILL)
+
+    assert pool.generate_processed_sents(SENTS) == expected
+    assert pool.restarts == 1
+    assert pool.generate_processed_sents(SENTS) == expected
+    assert pool.restarts == 1
@@ -0,0 +1,58 @@
+"""Tests for the write-behind buffer keeping the sents of failed flushes to retry"""
+
+from utils.write_behind_utils import WriteBehindBuffer
+
+
+class FlakyStore:
+    """Stand-in for DbHandler.store_sents, failing until told to succeed"""
+
+    def __init__(self):
+        self.failing = True
+        self.stored = {}
+
+    def store_sents(self, normalised_sents, processed_sents):
+        if self.failing:
+            return None
+        self.stored.update(zip(normalised_sents, processed_sents))
+        return len(normalised_sents)
+
+
+def make_buffer(store, max_retry_sents):
+    return WriteBehindBuffer(store.store_sents, 1000, 60, 1000, max_retry_sents)
+
+
+def test_failed_sents_are_retried():
+    store = FlakyStore()
+    write_buffer = make_buffer(store, 100)
+    write_buffer.add_many({"a": "<pad> joy", "b": "<pad> anger"})
+    write_buffer.flush()
+    # A sent waiting to be retried is only buffered once
+    write_buffer.add_many({"b": "<pad> anger", "c": "<pad> fear"})
+    write_buffer.flush()
+    store.failing = False
+    write_buffer.flush()
+
+    assert store.stored == {"a": "<pad> joy", "b": "<pad> anger", "c": "<pad> fear"}
+    stats = write_buffer.stats()
+    assert stats["failed_flushes"] == 2
+    assert stats["docs_retried"] == 5
+    assert stats["docs_dropped"] == 0
+    assert stats["queue_depth"] == 0
+
+
+def test_retries_are_capped():
+    store = FlakyStore()
+    write_buffer = make_buffer(store, 3)
+    write_buffer.add_many({f"old {index}": "<pad> joy" for index in range(5)})
+    write_buffer.flush()
+    assert write_buffer.stats()["queue_depth"] == 3
+    assert write_buffer.stats()["docs_dropped"] == 2
+
+    # Newer sents take the room of older ones
+    write_buffer.add_many({f"new {index}": "<pad> sadness" for index in range(2)})
+    write_buffer.flush()
+    store.failing = False
+    write_buffer.flush()
+
+    assert set(store.stored) == {"old 4", "new 0", "new 1"}
+    assert write_buffer.stats()["docs_dropped"] == 4
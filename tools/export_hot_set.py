@@ -0,0 +1,87 @@
+"""Export the most requested processed sents as the disk cache's hot set snapshot.
+
+Sents are ranked by the request counts the lambda keeps with TRACK_SENT_HITS set, so sents
+never counted aren't exported. The snapshot can be uploaded next to the model zip in the s3
+bucket, where new sandboxes download it from, or copied into src/ to ship in the image.
+
+Uses the same MongoDB and bucket env variables as the lambda, either set or in a .env file.
+
+Usage:
+    python tools/export_hot_set.py --size 100000 --upload
+    python tools/export_hot_set.py --output src/hot_set.ndjson.gz
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import boto3  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from pymongo import DESCENDING  # noqa: E402
+
+from config.config import ENV_BUCKET_VAR_NAME, HOT_SET_FILE, HOT_SET_SIZE  # noqa: E402
+from utils.db_utils import DbHandler  # noqa: E402
+from utils.disk_cache_utils import write_hot_set  # noqa: E402
+
+
+def find_hot_sents(db_handler, size):
+    """Yield the most requested sents, most requested first
+
+    Args:
+        db_handler (DbHandler): Handler for the database holding the sents
+        size (int): Maximum number of sents
+
+    Yields:
+        (string, string): normalised_sent, processed_sent pairs
+    """
+    layout = db_handler.layout
+    # Sorting the whole collection without an index would exceed MongoDB's sort memory limit
+    db_handler.mongo_col.create_index(
+        [(layout.hits_field, DESCENDING)], name="hits_index"
+    )
+    projection = [layout.key_field, layout.proc_field]
+    if layout.text_field is not None:
+        projection.append(layout.text_field)
+    docs = (
+        db_handler.mongo_col.find({layout.hits_field: {"$gt": 0}}, projection)
+        .sort(layout.hits_field, DESCENDING)
+        .limit(size)
+    )
+    for doc in docs:
+        # The hashed layout can only be exported when it stores the normalised sent
+        normalised_sent = (
+            doc[layout.key_field]
+            if layout.text_field is None
+            else doc.get(layout.text_field)
+        )
+        if isinstance(normalised_sent, str):
+            yield normalised_sent, doc[layout.proc_field]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=HOT_SET_SIZE)
+    parser.add_argument("--output", default=HOT_SET_FILE)
+    parser.add_argument(
+        "--upload", action="store_true", help="Upload next to the model in s3"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+
+    db_handler = DbHandler()
+    written_count = write_hot_set(args.output, find_hot_sents(db_handler, args.size))
+    print(f"Exported {written_count} sents to {args.output}")
+    if args.upload:
+        bucket_name = os.environ.get(ENV_BUCKET_VAR_NAME)
+        boto3.client("s3").upload_file(args.output, bucket_name, HOT_SET_FILE)
+        print(f"Uploaded to s3://{bucket_name}/{HOT_SET_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Backfill the hashed layout collection from the original text layout collection.
+
+Documents are copied in bounded batches and progress is recorded in the migrations collection,
+so the tool can be stopped and re-run at any time. To switch layouts online, run it once to
+backfill, deploy with SENTS_DB_LAYOUT=hashed, then run it again to copy anything the old
+deployment wrote in between. Each run rereads the last few minutes before where the previous
+run stopped, as ObjectIds from different hosts don't strictly increase. Sents missing from the
+hashed collection are only reprocessed, so lookups stay correct throughout.
+
+Uses the same MongoDB env variables as the lambda, either set or in a .env file.
+
+Usage:
+    python tools/migrate_sent_collection.py --batch-size 1000
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from dotenv import load_dotenv  # noqa: E402
+
+from config.config import (  # noqa: E402
+    MONGO_COLLECTION,
+    MIGRATION_RESUME_MARGIN_SECONDS,
+    MONGO_MIGRATION_COLLECTION,
+    SENTS_DB_LAYOUT_HASHED,
+)
+from utils.db_utils import DbHandler, get_sent_layout  # noqa: E402
+from utils.migration_utils import migrate_sent_collection  # noqa: E402
+
+MIGRATION_ID = "text_to_hashed"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--max-batches",
+        type=int,
+        default=None,
+        help="Stop after this many batches, the next run resumes from there",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+
+    db_handler = DbHandler()
+    target_layout = get_sent_layout(SENTS_DB_LAYOUT_HASHED)
+    copied_count = migrate_sent_collection(
+        db_handler.mongo_db[MONGO_COLLECTION],
+        target_layout,
+        db_handler.mongo_db[target_layout.collection_name],
+        db_handler.mongo_db[MONGO_MIGRATION_COLLECTION],
+        MIGRATION_ID,
+        args.batch_size,
+        args.max_batches,
+        MIGRATION_RESUME_MARGIN_SECONDS,
+    )
+    print(f"Copied {copied_count} documents")
+
+
+if __name__ == "__main__":
+    main()